@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""Routes whose scheduled times are consistently off the model, across every month of the data.  Each
+month is streamed in chunks, and the residual of every flight (SchTime less the prediction of that
+month's coefficients for its region) is reduced to per-route aggregates: the number of flights and
+months, the mean, the sum of squared deviations (for the variance), the minimum and maximum, and the
+K flights with the largest absolute residual.  These merge across chunks, months and workers, so memory
+depends on the number of routes, not of flights.  Each month's aggregates are cached in the flight store
+('routeresiduals' and 'worstflights') with a hash of its inputs, so a nightly run only streams new or
+refitted months and merges the rest.  The report ranks routes by their mean residual, with airport
+names, and is written to '../data/reports/anomalies.csv', with the worst flights of the top routes in
+'anomalies_worst.csv'."""
+
+import hashlib
+import itertools
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from analysis.coefficients import REGIONS, build_coefficients
+from analysis.reports import REPORTDIR
+from analysis.routes import LATLONG, enrich, route_key
+from store.flightstore import (expand_frame, iter_month, load_month, months, partition_path,
+    write_month)
+
+K = 5  #Worst flights kept per route.
+MIN_FLIGHTS = 100  #Routes with fewer flights are left out of the ranking.
+TOP = 50  #Routes whose worst flights are written.
+CHUNKSIZE = 1 << 19
+WORST_COLUMNS = ['Year', 'Month', 'Date', 'Carrier', 'SchTime', 'Residual']
+
+_cache = {}
+
+
+def split_key(keys):
+    """Origin and destination AirportIds of route keys."""
+    return keys//10**7, keys%10**7
+
+
+def group_starts(codes, counts):
+    """Order of rows sorted by code (stable), and the first position of each code in that order."""
+    return np.argsort(codes, kind='mergesort'), np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+
+def top_rows(codes, counts, residual, k):
+    """Rows of the k largest absolute residuals of each code."""
+    order = np.lexsort((-np.abs(residual), codes))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(order)) - starts[codes[order]]
+    return order[rank < k]
+
+
+class RouteResiduals(object):
+    """Running aggregates of residuals by route: routes (sorted keys) and arrays of flights, months, mean,
+    m2 (sum of squared deviations from the mean), min and max aligned with them, and a dataframe of the
+    k worst flights of each route.  months is the number of merged month partials with flights on the
+    route; month_residuals sets it to 1."""
+
+    def __init__(self, k=K):
+        self.k = k
+        self.routes = np.zeros(0, dtype=np.int64)
+        self.flights = np.zeros(0, dtype=np.int64)
+        self.months = np.zeros(0, dtype=np.int64)
+        self.mean, self.m2, self.min, self.max = [np.zeros(0) for i in range(4)]
+        self.worst = pd.DataFrame(columns=['RouteKey'] + WORST_COLUMNS)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def _merge(self, parts, worst):
+        """Combine aggregates [(routes, flights, months, mean, m2, min, max)] of disjoint flights, with
+        Chan's formula for the mean and m2, and keep the k worst flights of each route."""
+        routes, flights, months, mean, m2, low, high = [np.concatenate(x) for x in zip(*parts)]
+        codes, self.routes = pd.factorize(routes, sort=True)
+        self.flights = np.bincount(codes, weights=flights).astype(np.int64)
+        self.months = np.bincount(codes, weights=months).astype(np.int64)
+        self.mean = np.bincount(codes, weights=flights*mean)/self.flights
+        self.m2 = np.bincount(codes, weights=m2 + flights*(mean - self.mean[codes])**2)
+        order, starts = group_starts(codes, np.bincount(codes))
+        self.min = np.minimum.reduceat(low[order], starts) if len(order) else np.zeros(0)
+        self.max = np.maximum.reduceat(high[order], starts) if len(order) else np.zeros(0)
+
+        worst = pd.concat(worst, ignore_index=True)
+        codes = np.searchsorted(self.routes, worst.RouteKey.values)
+        rows = top_rows(codes, np.bincount(codes, minlength=len(self.routes)),
+            worst.Residual.values.astype(np.float64), self.k)
+        self.worst = worst.iloc[np.sort(rows)].reset_index(drop=True)
+
+    def _parts(self):
+        return (self.routes, self.flights, self.months, self.mean, self.m2, self.min, self.max)
+
+    def add(self, origin, dest, residual, details=None):
+        """Add flights with the given origin, dest and residual arrays.  details is a dataframe aligned
+        with them holding any of WORST_COLUMNS to keep for the worst flights.  NaN residuals are skipped."""
+        residual = np.asarray(residual, dtype=np.float64)
+        rows = np.flatnonzero(~np.isnan(residual))
+        residual = residual[rows]
+        codes, routes = pd.factorize(route_key(origin, dest)[rows], sort=True)
+        counts = np.bincount(codes)
+        mean = np.bincount(codes, weights=residual)/counts if len(counts) else np.zeros(0)
+        m2 = np.bincount(codes, weights=(residual - mean[codes])**2) if len(counts) else np.zeros(0)
+        order, starts = group_starts(codes, counts)
+        low = np.minimum.reduceat(residual[order], starts) if len(order) else np.zeros(0)
+        high = np.maximum.reduceat(residual[order], starts) if len(order) else np.zeros(0)
+
+        top = top_rows(codes, counts, residual, self.k)
+        worst = pd.DataFrame({'RouteKey':routes[codes[top]], 'Residual':residual[top]},
+            columns=['RouteKey'] + WORST_COLUMNS)
+        if details is not None:
+            details = expand_frame(details.iloc[rows[top]].reset_index(drop=True))
+            for col in WORST_COLUMNS[:-1]:
+                if col in details.columns:
+                    worst[col] = details[col].values
+        self._merge([self._parts(), (routes, counts, np.zeros(len(routes)), mean, m2, low, high)],
+            [self.worst, worst])
+        return self
+
+    def merge(self, *others):
+        """Add the aggregates of others, of disjoint flights, into these."""
+        if others:
+            self._merge([self._parts()] + [other._parts() for other in others],
+                [self.worst] + [other.worst for other in others])
+        return self
+
+    def table(self):
+        """Aggregates by route: OriginAirportId, DestAirportId, Flights, Months, Mean, Std, Min and Max."""
+        origin, dest = split_key(self.routes)
+        return pd.DataFrame({'OriginAirportId':origin, 'DestAirportId':dest, 'Flights':self.flights,
+            'Months':self.months, 'Mean':self.mean, 'Std':np.sqrt(self.m2/np.maximum(self.flights - 1, 1)),
+            'Min':self.min, 'Max':self.max},
+            columns=['OriginAirportId', 'DestAirportId', 'Flights', 'Months', 'Mean', 'Std', 'Min', 'Max'])
+
+    def save(self, year, month):
+        """Write the aggregates as the 'routeresiduals' and 'worstflights' partitions of a month."""
+        origin, dest = split_key(self.routes)
+        write_month('routeresiduals', year, month, pd.DataFrame({'OriginAirportId':origin,
+            'DestAirportId':dest, 'Flights':self.flights, 'Mean':self.mean, 'M2':self.m2,
+            'Min':self.min, 'Max':self.max}))
+        worst = self.worst.copy()
+        worst['OriginAirportId'], worst['DestAirportId'] = split_key(worst.RouteKey.values.astype(np.int64))
+        write_month('worstflights', year, month, worst)
+
+    @classmethod
+    def load(cls, year, month, k=K):
+        """Aggregates of a month saved by save."""
+        residuals = cls(k)
+        df = load_month(year, month, kind='routeresiduals')
+        residuals.routes = route_key(df.OriginAirportId.values, df.DestAirportId.values)
+        residuals.flights = df.Flights.values
+        residuals.months = np.ones(len(df), dtype=np.int64)
+        residuals.mean, residuals.m2, residuals.min, residuals.max = [df[col].values
+            for col in ['Mean', 'M2', 'Min', 'Max']]
+        worst = load_month(year, month, kind='worstflights')
+        worst.insert(0, 'RouteKey', route_key(worst.OriginAirportId.values, worst.DestAirportId.values))
+        residuals.worst = worst[['RouteKey'] + WORST_COLUMNS]
+        return residuals
+
+
+def month_hash(coefficients, k=K):
+    """Hash of a month's inputs: the input hashes of its coefficients (the cleaned month and route table)
+    and k."""
+    return hashlib.sha1(' '.join(sorted(coefficients.InputHash)) + ' %d' %k).hexdigest()
+
+
+def saved_hash(year, month):
+    path = partition_path('routeresiduals', year, month) + '.json'
+    if os.path.exists(path) and os.path.exists(partition_path('worstflights', year, month)):
+        with open(path) as f:
+            return json.load(f).get('input')
+
+
+def month_residuals(args):
+    """Route aggregates of the residuals of one month, given (year, month, coefficients, k), where
+    coefficients are the month's rows of the coefficient table.  Loaded from the store if its inputs are
+    unchanged, otherwise streamed in chunks and saved."""
+    year, month, coefficients, k = args
+    inputhash = month_hash(coefficients, k)
+    if saved_hash(year, month) == inputhash:
+        return RouteResiduals.load(year, month, k)
+
+    #Coefficients (Distance, Jetstream, Intercept) by region; NaN for a region without a fit.
+    coef = np.full((len(REGIONS), 3), np.nan)
+    for row in coefficients.itertuples():
+        coef[REGIONS.index(row.Region)] = [row.Distance, row.Jetstream, row.Intercept]
+
+    residuals = RouteResiduals(k)
+    for chunk in iter_month(year, month, columns=['OriginAirportId', 'DestAirportId', 'SchTime', 'Date',
+            'Carrier'], chunksize=CHUNKSIZE, compact=True):
+        chunk = enrich(chunk, ['Distance', 'Jetstream', 'DestOverseas'])
+        region = coef[np.where(chunk.DestOverseas.values, REGIONS.index('Pacific'), REGIONS.index('US'))]
+        error = chunk.SchTime.values - (region[:, 0]*chunk.Distance.values +
+            region[:, 1]*chunk.Jetstream.values + region[:, 2])
+        chunk['Year'], chunk['Month'] = year, month
+        residuals.add(chunk.OriginAirportId.values, chunk.DestAirportId.values, error, chunk)
+    residuals.months = np.ones(len(residuals), dtype=np.int64)
+
+    residuals.save(year, month)
+    with open(partition_path('routeresiduals', year, month) + '.json', 'w') as f:
+        json.dump({'input':inputhash}, f)
+    return residuals
+
+
+def airport_names():
+    """Name of each AirportId in LatLong.csv, read once per process."""
+    if 'names' not in _cache:
+        latlong = pd.read_csv(LATLONG)[['AirportId', 'AirportName']].drop_duplicates('AirportId')
+        _cache['names'] = latlong.set_index('AirportId').AirportName
+    return _cache['names']
+
+
+def name_routes(df):
+    """df with the names of OriginAirportId and DestAirportId inserted as Origin and Dest."""
+    names = airport_names()
+    df = df.copy()
+    df.insert(df.columns.get_loc('OriginAirportId') + 1, 'Origin',
+        names.reindex(df.OriginAirportId.values).values)
+    df.insert(df.columns.get_loc('DestAirportId') + 1, 'Dest', names.reindex(df.DestAirportId.values).values)
+    return df
+
+
+def ranking(residuals, min_flights=MIN_FLIGHTS):
+    """Routes with at least min_flights flights, by decreasing absolute mean residual, with airport names."""
+    table = residuals.table()
+    table = table[table.Flights >= min_flights]
+    table = table.iloc[np.argsort(-np.abs(table.Mean.values), kind='mergesort')].reset_index(drop=True)
+    table.insert(0, 'Rank', np.arange(1, len(table) + 1))
+    return name_routes(table)
+
+
+def worst_flights(residuals, ranked, top=TOP):
+    """Worst flights of the first top routes of ranked, in rank order and by decreasing absolute residual."""
+    ranked = ranked.head(top)
+    keys = route_key(ranked.OriginAirportId.values, ranked.DestAirportId.values)
+    worst = residuals.worst[residuals.worst.RouteKey.isin(keys)]
+    rank = pd.Series(ranked.Rank.values, index=keys)[worst.RouteKey.values].values
+    order = np.lexsort((-np.abs(worst.Residual.values.astype(np.float64)), rank))
+    worst = worst.iloc[order]
+    origin, dest = split_key(worst.RouteKey.values.astype(np.int64))
+    df = pd.DataFrame({'Rank':rank[order], 'OriginAirportId':origin, 'DestAirportId':dest},
+        columns=['Rank', 'OriginAirportId', 'DestAirportId'])
+    for col in WORST_COLUMNS:
+        df[col] = worst[col].values
+    return name_routes(df)
+
+
+def build_anomalies(monthlist=None, workers=1, k=K, min_flights=MIN_FLIGHTS, top=TOP, write=True):
+    """Route residual aggregates over monthlist (default: all months), streaming only months whose inputs
+    changed, in a pool of workers if workers > 1.  Returns the ranking of routes and the worst flights
+    of the top routes, also written to REPORTDIR."""
+    monthlist = monthlist or months()
+    coefficients = build_coefficients(monthlist, workers)
+    todo = [(year, month, coefficients[(coefficients.Year == year) & (coefficients.Month == month)], k)
+        for year, month in monthlist]
+
+    #Merge month partials a batch at a time, so only a few are held at once.
+    residuals, batch = RouteResiduals(k), []
+    pool = Pool(workers) if workers > 1 and len(todo) > 1 else None
+    try:
+        for partial in (pool.imap_unordered(month_residuals, todo) if pool else itertools.imap(month_residuals, todo)):
+            batch.append(partial)
+            if len(batch) == 32:
+                residuals.merge(*batch)
+                batch = []
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    residuals.merge(*batch)
+
+    ranked = ranking(residuals, min_flights)
+    worst = worst_flights(residuals, ranked, top)
+    if write:
+        if not os.path.isdir(REPORTDIR):
+            os.makedirs(REPORTDIR)
+        ranked.to_csv(REPORTDIR + '/anomalies.csv', index=False)
+        worst.to_csv(REPORTDIR + '/anomalies_worst.csv', index=False)
+    return ranked, worst
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Table of monthly regression coefficients for Pacific and non-Pacific (US) flights.  Each row holds, 
+for one month and region, the coefficients and standard errors of the Distance/Jetstream model, R^2, 
+the number of flights, and the number with error > 20 min.  Alongside it, the residual table holds, 
+for each month, region and carrier (and 'All' carriers), the mean and the 10th and 90th percentiles of 
+the error of the region's model, which the prediction service gives as bands.  The tables are saved in 
+the flight store with a hash of each month's inputs, so only new or changed months are fitted again, 
+across a pool of worker processes."""
+
+import hashlib
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from analysis.filter import get_jetstream, get_pacific
+from analysis.regression import OLSStats
+from analysis.routes import get_routes, source_hash
+from store.flightstore import STORE, months, month_signature
+
+COEFFICIENTS = STORE + '/coefficients.parquet'
+RESIDUALS = STORE + '/residuals.parquet'
+REGIONS = ['Pacific', 'US']
+ERROR = 20  #Minutes of error counted as an error.
+COLUMNS = ['Year', 'Month', 'Region', 'Distance', 'Jetstream', 'Intercept', 'DistanceStderr', 
+    'JetstreamStderr', 'InterceptStderr', 'Score', 'Flights', 'Errors', 'InputHash']
+RESIDUAL_COLUMNS = ['Year', 'Month', 'Region', 'Carrier', 'Flights', 'Mean', 'Low', 'High', 'InputHash']
+BAND = (10, 90)  #Percentiles of the error given as Low and High.
+
+
+def input_hash(year, month, routes=None):
+    """Hash of everything a month's coefficients depend on: the cleaned month and the route table."""
+    routes = routes or source_hash()
+    return hashlib.sha1(month_signature('clean', year, month) + ' ' + routes).hexdigest()
+
+
+def residual_rows(year, month, region, carriers, error, inputhash):
+    """Rows of the residual table for the errors of one month and region, by carrier and for 'All'."""
+    rows = []
+    codes, names = pd.factorize(np.asarray(carriers), sort=True)
+    groups = [('All', error)] + [(name, error[codes == i]) for i, name in enumerate(names)]
+    for carrier, errors in groups:
+        low, high = np.percentile(errors, BAND)
+        rows.append({'Year':year, 'Month':month, 'Region':region, 'Carrier':carrier, 'Flights':len(errors), 
+            'Mean':errors.mean(), 'Low':low, 'High':high, 'InputHash':inputhash})
+    return rows
+
+
+def month_coefficients(args):
+    """Rows of the coefficient table and of the residual table for one month, given (year, month, 
+    inputhash)."""
+    year, month, inputhash = args
+    df = get_pacific(get_jetstream(year, month, ['Carrier']))
+    rows, residuals = [], []
+    for region, flights in zip(REGIONS, [df[df.DestOverseas], df[~df.DestOverseas]]):
+        row = {'Year':year, 'Month':month, 'Region':region, 'Flights':len(flights), 'InputHash':inputhash}
+        if len(flights) > 3:
+            params, score, stderror = OLSStats().update_frame(flights).solve()
+            error = flights.SchTime - (params[0]*flights.Distance + params[1]*flights.Jetstream + params[2])
+            row.update(zip(['Distance', 'Jetstream', 'Intercept'], params))
+            row.update(zip(['DistanceStderr', 'JetstreamStderr', 'InterceptStderr'], stderror))
+            row.update({'Score':score, 'Errors':int((np.abs(error) > ERROR).sum())})
+            residuals += residual_rows(year, month, region, flights.Carrier.values, error.values, inputhash)
+        rows.append(row)
+    return rows, residuals
+
+
+def load_table(path, columns):
+    """A saved table, or an empty one if it is missing or was saved without some of columns."""
+    if os.path.exists(path):
+        table = pd.read_parquet(path)
+        if set(columns) <= set(table.columns):
+            return table
+    return pd.DataFrame(columns=columns)
+
+
+def load_coefficients():
+    return load_table(COEFFICIENTS, COLUMNS)
+
+
+def load_residuals():
+    return load_table(RESIDUALS, RESIDUAL_COLUMNS)
+
+
+def save_table(table, path, refitted, new, keys):
+    """Replace the rows of refitted months of table with new, save it and return it."""
+    old = pd.Series(list(zip(table.Year, table.Month))).isin(refitted).values
+    table = pd.concat([table[~old], new], ignore_index=True)
+    table[['Year', 'Month', 'Flights']] = table[['Year', 'Month', 'Flights']].astype(int)
+    table = table.sort_values(keys).reset_index(drop=True)
+    if not os.path.isdir(STORE):
+        os.makedirs(STORE)
+    table.to_parquet(path + '.tmp', index=False)
+    os.rename(path + '.tmp', path)
+    return table
+
+
+def build_coefficients(monthlist=None, workers=1):
+    """Coefficient and residual tables for monthlist (default: all months), fitting only months whose 
+    inputs changed since they were saved.  Returns the coefficient table for monthlist, sorted by month 
+    and region."""
+    monthlist = monthlist or months()
+    residuals = load_residuals()
+    #Coefficients saved without residuals are fitted again.
+    table = load_coefficients() if os.path.exists(RESIDUALS) else pd.DataFrame(columns=COLUMNS)
+    routes = source_hash()
+    hashes = dict(((year, month), input_hash(year, month, routes)) for year, month in monthlist)
+
+    #Months with a saved row for each region, residuals and unchanged inputs are kept.
+    saved = {}
+    for year, month, inputhash in zip(table.Year, table.Month, table.InputHash):
+        saved.setdefault((year, month), []).append(inputhash)
+    savedresiduals = dict(((year, month), inputhash) 
+        for year, month, inputhash in zip(residuals.Year, residuals.Month, residuals.InputHash))
+    todo = [(year, month, hashes[year, month]) for year, month in monthlist 
+        if saved.get((year, month)) != [hashes[year, month]]*len(REGIONS) 
+        or savedresiduals.get((year, month), hashes[year, month]) != hashes[year, month]]
+
+    if todo:
+        get_routes()  #Load the route table once, before worker processes are forked.
+        if workers > 1:
+            pool = Pool(workers)
+            try:
+                results = pool.map(month_coefficients, todo)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [month_coefficients(args) for args in todo]
+
+        #Replace the rows of refitted months and save.
+        refitted = [(year, month) for year, month, inputhash in todo]
+        table = save_table(table, COEFFICIENTS, refitted, 
+            pd.DataFrame([row for rows, res in results for row in rows], columns=COLUMNS), 
+            ['Year', 'Month', 'Region'])
+        save_table(residuals, RESIDUALS, refitted, 
+            pd.DataFrame([row for rows, res in results for row in res], columns=RESIDUAL_COLUMNS), 
+            ['Year', 'Month', 'Region', 'Carrier'])
+
+    inlist = pd.Series(list(zip(table.Year, table.Month))).isin(monthlist).values
+    return table[inlist].reset_index(drop=True)
@@ -4,34 +4,22 @@ be used in our regression models."""
 
 import numpy as np
 import pandas as pd
+from analysis.routes import enrich
+from store.flightstore import load_month
 pd.options.mode.chained_assignment = None #Suppress overwrite error.
 
-def get_jetstream(year, month):
-    """Read flight data from a particular year and month, along with LatLong and distance tables.
-    Combine and produce a dataframe containing Distance, Jetstream, and SchTime, along with identifying 
-    flight information."""
-    latlong = pd.read_csv('../data/LatLong.csv')
-    flights = pd.read_csv('../data/%d_%d.csv' %(year, month))
-    dist = pd.read_csv('../data/distance.csv')
-
-    #Merge with LatLong and distance tables.
-    flights = flights.merge(dist, on=['OriginAirportId', 'DestAirportId'])
-    flights = flights.merge(latlong, left_on='OriginAirportId', right_on='AirportId')
-    flights.rename(columns={'Latitude':'OriginLat', 'Longitude':'OriginLong'}, inplace=True)
-    flights = flights.merge(latlong, left_on='DestAirportId', right_on='AirportId')
-    flights.rename(columns={'Latitude':'DestLat', 'Longitude':'DestLong'}, inplace=True)
-
-    #Calculate degrees Latitude North and degrees Longitude East travelled.
-    df = flights[['OriginAirportId', 'OriginLat', 'OriginLong', 'DestLat', 'DestLong', 'DestAirportId', 
-    'Distance', 'SchTime']]
-    df['dLat'] = df.DestLat - df.OriginLat
-    df['dLong'] = df.DestLong - df.OriginLong
-    df.dLong[df.dLong < -180] += 360
-    df.dLong[df.dLong > 180] -= 360
-
-    #Estimate Jetstream effect and return dataframe.
-    df['Jetstream'] = -df.dLong*df.Distance/np.sqrt(df.dLong**2 + df.dLat**2)
-    return df
+def get_jetstream(year, month, extra=()):
+    """Read flight data from a particular year and month, and gather Distance, coordinates and Jetstream 
+    from the route feature table.  Produce a dataframe containing Distance, Jetstream, and SchTime, along 
+    with identifying flight information and any extra flight columns, e.g. ['Carrier', 'SchDep'], in 
+    the compact form of load_month."""
+    extra = [col for col in extra if col not in ['OriginAirportId', 'DestAirportId', 'SchTime']]
+    flights = load_month(year, month, columns=['OriginAirportId', 'DestAirportId', 'SchTime'] + extra, 
+        compact=True)
+    df = enrich(flights, ['OriginLat', 'OriginLong', 'DestLat', 'DestLong', 'Distance', 'dLat', 'dLong', 
+        'Jetstream'])
+    return df[['OriginAirportId', 'OriginLat', 'OriginLong', 'DestLat', 'DestLong', 'DestAirportId', 
+        'Distance', 'SchTime', 'dLat', 'dLong', 'Jetstream'] + extra]
 
 def get_pacific(df):
     """Given a dataframe with information about Destination airport Latitude and Longitude, it returns 
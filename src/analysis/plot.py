@@ -1,111 +1,169 @@
 #!/usr/bin/env python
 """Plotting functions: Scheduled flight times given an airline and origin/dest, over time.
 Distance vs Scheduled flight time, indicating eastbound and westbound, regression lines, and error.
-Monthly regression coefficients over time."""
+Monthly regression coefficients over time.
+Scatter plots of more than DENSITY_POINTS flights are drawn as density images instead of one marker per 
+flight: the flights of each class (eastbound, westbound) are binned into a grid with one cell per pixel of 
+the axes, and each class is drawn as one image whose opacity grows with the log of the count, so drawing 
+time and file size depend on the image size rather than the number of flights.
+matplotlib.pyplot is imported by the functions that draw, on first use, so importing this module (as the 
+drivers do for COEF_PLOTS) does not load it."""
 
 import numpy as np
-import datetime
-import matplotlib.pyplot as plt
-import matplotlib.lines as mlines
-import matplotlib.patches as mpatches
+import matplotlib.colors as mcolors
 import pandas as pd
 pd.options.mode.chained_assignment = None #Suppress overwrite error.
 
-from analysis.filter import get_jetstream, get_pacific
+from analysis.anomalies import RouteResiduals, name_routes
+from analysis.coefficients import REGIONS, build_coefficients
 from analysis.regression import regression
+from analysis.session import get_session
+from store import flightstore
+from store.routeindex import scan_route
+from store.times import date_days, month_days, timetomin
 
 
+DENSITY_POINTS = 100000  #Larger scatter plots are drawn as density images.
+
+#Title, unit and file name of the plots of each regression coefficient, after the region.
+COEF_PLOTS = [('Scheduled Plane Speed', 'mph', 'Plane.jpg'), 
+    ('Jetstream Effect', 'mph', 'Jetstream.jpg'), 
+    ('Ground Time', 'min', 'Ground.jpg'), 
+    ('Correlation Coefficient', 'R^2', 'Fit.jpg')]
+
 monthdict = {1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 
     8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
 
 
-def timetomin(time):
-    """Turn hhmm into minutes after midnight."""
-    return (60*np.floor(time/100) + time%100)
+def pyplot():
+    """matplotlib.pyplot, imported on first use."""
+    import matplotlib.pyplot as plt
+    return plt
 
 
-def date_to_days(df):
-    """From a dataframe of strings 'year-mon-day', return days since epoch."""
-    epoch = datetime.datetime.utcfromtimestamp(0)
-    return map(lambda A: A.days, pd.to_datetime(df) - epoch)
+def legend(plt, regression=False):
+    """Legend of eastbound (red) and westbound (blue) flights, and the black regression lines."""
+    import matplotlib.lines as mlines
+    import matplotlib.patches as mpatches
+    lines = [mpatches.Patch(color='red', label='Eastbound'), mpatches.Patch(color='blue', label='Westbound')]
+    if regression:
+        lines.append(mlines.Line2D([], [], color='black', label='Regression'))
+    labels = [line.get_label() for line in lines]
+    plt.legend(lines, labels, loc='upper left')
 
 
-def plot_schtime(origin, destination, carrier):
+def time_axis():
+    """First and last day of the data, from flightstore.FIRST_MONTH to the end of LAST_MONTH, in days 
+    since epoch, with the ticks and labels of each new year in between."""
+    first, last = flightstore.FIRST_MONTH, flightstore.LAST_MONTH
+    end = (last[0] + last[1]//12, last[1]%12 + 1)
+    daystart, dayend = month_days([first, end])
+    labels = range(first[0] + 1, end[0] + 1)
+    return daystart, dayend, month_days([(year, 1) for year in labels]), labels
+
+
+def density_image(ax, x, y, color, extent):
+    """Draw points as an image of their counts on a grid with a cell per pixel of ax, over extent 
+    (xmin, xmax, ymin, ymax), in color with opacity increasing with log count."""
+    bbox = ax.get_window_extent()
+    bins = [max(int(bbox.width), 1), max(int(bbox.height), 1)]
+    counts = np.histogram2d(x, y, bins=bins, range=[extent[:2], extent[2:]])[0].T
+    rgba = np.zeros(counts.shape + (4,))
+    rgba[..., :3] = mcolors.to_rgb(color)
+    if counts.max() > 0:
+        #Cells with a single flight stay visible.
+        rgba[..., 3] = np.where(counts > 0, 0.2 + 0.8*np.log1p(counts)/np.log1p(counts.max()), 0)
+    ax.imshow(rgba, origin='lower', extent=extent, aspect='auto', interpolation='nearest')
+
+
+def scatter(ax, classes, extent=None, density=None, ms=2):
+    """Scatter plot of classes, a list of (x, y, color).  With density None, the points are drawn as 
+    density images if there are more than DENSITY_POINTS, else as markers of size ms.  The density 
+    images cover extent, by default the range of all points."""
+    classes = [(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), color) for x, y, color in classes]
+    if density is None:
+        density = sum(len(x) for x, y, color in classes) > DENSITY_POINTS
+    if not density:
+        for x, y, color in classes:
+            ax.plot(x, y, color + '.', ms=ms)
+        return
+    if extent is None:
+        xs = np.concatenate([x for x, y, color in classes])
+        ys = np.concatenate([y for x, y, color in classes])
+        extent = (xs.min(), xs.max(), ys.min(), ys.max()) if len(xs) else (0, 1, 0, 1)
+    for x, y, color in classes:
+        density_image(ax, x, y, color, extent)
+
+
+def plot_schtime(origin, destination, carrier, density=None):
     """Input: 5 digit AirportID code for origin and destination.  Plot scheduled flight times from 
-    origin to destination from Oct 1, 1987 to Dec 31, 2015."""
+    origin to destination over all months of the data.  density as in scatter."""
+    #Read the flights of this origin, destination, and carrier through the route index.
     dataframes = []
-    for year in range(1987, 2016):
-        if(year == 1987):
-            startmonth = 10
-        else:
-            startmonth = 1
-        for mon in range(startmonth, 13):
-            flights = pd.read_csv('../data/%d_%d.csv' %(year, mon))
-
-            #Filter by origin, destination, and carrier.
-            isflight = ((np.floor(flights.OriginAirportId/100) == origin) & 
-                (np.floor(flights.DestAirportId/100) == destination) & (flights.Carrier == carrier))
-            df = flights[isflight][['Date', 'SchDep', 'SchTime']]
-
-            #Determine \# days after Jan. 1, 1988.
-            df['Time'] = date_to_days(df.Date)
-            df['Time'] += timetomin(df.SchDep)/1440.
-            df.drop(['Date', 'SchDep'],axis=1, inplace=True)
-            dataframes.append(df)
-
+    for year, mon, df in scan_route(origin, destination, carrier, columns=['Date', 'SchDep', 'SchTime']):
+        #Determine \# days since epoch.
+        df['Time'] = date_days(df.Date) + timetomin(df.SchDep.values)/1440.
+        df.drop(['Date', 'SchDep'],axis=1, inplace=True)
+        dataframes.append(df)
+
+    if not dataframes:
+        dataframes = [pd.DataFrame({'Time':[], 'SchTime':[]})]  #No such flights.
     flightdist = pd.concat(dataframes, ignore_index=True)
     
     #Determine start and end date in days.
-    daystart = date_to_days(['1987-10-01'])[0]
-    dayend = date_to_days(['2016-01-01'])[0]
-    ticks = date_to_days(['%d-01-01' %year for year in range(1988, 2017)])
+    daystart, dayend, ticks, labels = time_axis()
     
     #Format, plot, and save graph.
+    plt = pyplot()
     fig, ax = plt.subplots(figsize=(20,10))
-    ax.plot(flightdist.Time, flightdist.SchTime, 'b.')
+    plt.subplots_adjust(bottom = 0.15)
+    scatter(ax, [(flightdist.Time, flightdist.SchTime, 'b')], 
+        (daystart, dayend, 0, flightdist.SchTime.max() + 10), density, ms=6)
     ax.set_xlim(daystart, dayend)
     ax.set_xticks(ticks)
-    labels = range(1988, 2017)
     ax.set_xticklabels(labels, rotation='vertical', fontsize=20)
     ax.set_title('%d to %d' %(origin, destination), fontsize=20)
     ax.set_xlabel('Date', fontsize=20)
     ax.set_ylabel('Scheduled Flight Time', fontsize=20)
-    plt.subplots_adjust(bottom = 0.15)
     fig.savefig('../graphs/%s%d_%d.jpg' %(carrier, origin, destination))
 
 
-def plot_distschtime(year, month, df):
-    """Plot Dist vs SchTime for flights in a given year and month."""
+def plot_distschtime(year, month, df, density=None):
+    """Plot Dist vs SchTime for flights in a given year and month.  density as in scatter."""
     if(len(df) == 0):
-        df = get_jetstream(year, month)  #Get Longitude info to see if west or eastbound.
+        df = get_session().flights(year, month)  #Get Longitude info to see if west or eastbound.
     westbound = (df.dLong < 0)
     eastbound = (df.dLong > 0)
 
     #Plot Dist vs SchTime. Color Eastbound flights red and Westbound flights blue.
+    plt = pyplot()
     fig, ax = plt.subplots()
-    ax.plot(df.Distance[eastbound], df.SchTime[eastbound], 'r.', ms = 2)
-    ax.plot(df.Distance[westbound], df.SchTime[westbound], 'b.', ms = 2)
+    scatter(ax, [(df.Distance[eastbound], df.SchTime[eastbound], 'r'), 
+        (df.Distance[westbound], df.SchTime[westbound], 'b')], density=density)
     ax.set_title('Flights in %s %d' %(monthdict[month], year))
     ax.set_xlabel('Distance (miles)')
     ax.set_ylabel('Scheduled Flight Time')
     
-    #Make legend.
-    red_patch = mpatches.Patch(color='red', label='Eastbound')
-    blue_patch = mpatches.Patch(color='blue', label='Westbound')
-    lines = [red_patch, blue_patch]
-    labels = [line.get_label() for line in lines]
-    plt.legend(lines, labels, loc='upper left')
+    legend(plt)
     fig.savefig('../graphs/DistvsSchTime_%d_%d.jpg' %(year, month))
 
 
-def plot_regression(year, month, df):
-    """Plot distance vs SchTime for flights in a given year and month, along with the 
-    regression lines capturing flights due east and due west."""
-    #Get regression coefficients for flights landing in Pacific and other flights.
+def fitted(year, month, df, params):
+    """The month's flights and model parameters: df, or all flights of the month from the session if 
+    df is empty, and params, or the regression of those flights if params is None."""
     if(len(df) == 0):
-        df = get_jetstream(year, month)
+        df = get_session().flights(year, month)
+        return df, get_session().fit(year, month)[0] if params is None else params
+    return df, regression(year, month, df)[0] if params is None else params
+
 
-    params = regression(year, month, df)[0]
+def plot_regression(year, month, df, density=None, params=None, title=None, path=None):
+    """Plot distance vs SchTime for flights in a given year and month, along with the 
+    regression lines capturing flights due east and due west.  density as in scatter.  params are 
+    the fitted coefficients of df, if already known (e.g. from Session.fit).  title and path replace 
+    those of the month, e.g. for a sample of many months (see analysis.sampling)."""
+    #Get regression coefficients for flights landing in Pacific and other flights.
+    df, params = fitted(year, month, df, params)
     dist = params[0]
     jet = params[1]
     ground = params[2]
@@ -119,123 +177,75 @@ def plot_regression(year, month, df):
     eastbound = (df.dLong > 0)
 
     #Plot Dist vs SchTime. Color Eastbound flights red and Westbound flights blue.
+    plt = pyplot()
     fig, ax = plt.subplots()
-    ax.plot(df.Distance[eastbound], df.SchTime[eastbound], 'r.', ms = 2)
-    ax.plot(df.Distance[westbound], df.SchTime[westbound], 'b.', ms = 2)
+    scatter(ax, [(df.Distance[eastbound], df.SchTime[eastbound], 'r'), 
+        (df.Distance[westbound], df.SchTime[westbound], 'b')], density=density)
     ax.plot(x, y_east, 'k')
     ax.plot(x, y_west, 'k')
-    ax.set_title('Flights in %s %d' %(monthdict[month], year))
+    ax.set_title(title or 'Flights in %s %d' %(monthdict[month], year))
     ax.set_xlabel('Distance (miles)')
     ax.set_ylabel('Scheduled Flight Time')
     
-    #Make legend.
-    red_patch = mpatches.Patch(color='red', label='Eastbound')
-    blue_patch = mpatches.Patch(color='blue', label='Westbound')
-    black_line = mlines.Line2D([], [], color='black', label='Regression')
-    lines = [red_patch, blue_patch, black_line]
-    labels = [line.get_label() for line in lines]
-    plt.legend(lines, labels, loc='upper left')
-    fig.savefig('../graphs/Regression_%d_%d.jpg' %(year, month))
+    legend(plt, regression=True)
+    fig.savefig(path or '../graphs/Regression_%d_%d.jpg' %(year, month))
 
 
-def plot_error(year, month, df, title):
-    """Plot the error from the linear regression in a histogram.  Output flights with error < -25."""
-    if(len(df) == 0):
-        df = get_jetstream(year, month)
-    
-    params = regression(year, month, df)[0]
+def plot_error(year, month, df, title, params=None):
+    """Plot the error from the linear regression in a histogram.  Output the routes with a flight of 
+    error < -25, worst first, by airport name (see analysis.anomalies for every month).  params as in 
+    plot_regression."""
+    df, params = fitted(year, month, df, params)
 
     #Determine Error.
-    df['Error'] = df.SchTime - (params[0]*df.Distance + params[1]*df.Jetstream + params[2])
+    error = df.SchTime.values - (params[0]*df.Distance.values + params[1]*df.Jetstream.values + params[2])
 
     #Plot the histograms.
+    plt = pyplot()
     fig, ax = plt.subplots()
-    ax.hist(df.Error, 50)
+    ax.hist(error, 50)
     ax.set_xlabel('Error (min)', fontsize=20)
     ax.set_ylabel('Freq', fontsize=20)
     ax.set_title(('%s %d ' + title) %(monthdict[month], year), fontsize=20)
     fig.savefig('../graphs/%s.jpg' %title)
 
-    #Output flights that have Error < -25.
-    latlong = pd.read_csv('LatLong.csv')
-    df = df[df.Error < -25]
-    errors = pd.DataFrame({'OriginAirportId':df.OriginAirportId, 'DestAirportId':df.DestAirportId})
-    errors.drop_duplicates(inplace=True)
-    errors.reset_index(drop=True)
-
-    errors = errors.merge(LL, left_on = 'OriginAirportId', right_on='AirportId')
-    errors.rename(columns={'AirportName':'OriginAirport'}, inplace=True)
-    errors = errors.merge(LL, left_on = 'DestAirportId', right_on='AirportId')
-    errors.rename(columns={'AirportName':'DestAirport'}, inplace=True)
-    for x in errors.index:
-        print "%s --> %s" %(errors.OriginAirport[x], errors.DestAirport[x])
-
-
-def plot_regression_coef():
-    """Plot regression coefficients for Pacific and non-Pacific flights from Oct 1987 to Dec 2015.
-    Also, count number of errors > 20 min."""
-    [pacplane, pacjet, pacground, pacfit, usplane, usjet, usground, usfit, time] = [[] for i in range(9)]
-    [pacflights, usflights, pac_error, us_error] = [0]*4
-
-    for year in range(1987, 2016):
-        if(year == 1987):
-            startmonth = 10
-        else:
-            startmonth = 1
-        for month in range(startmonth, 13):
-            print year, month
-            #Get Pacific and non-Pacific flights, and calculate Regression coefficients and fit.
-            df = get_jetstream(year, month)
-            df = get_pacific(df)
-            df_pac = df[df.DestOverseas]
-            df_us = df[~df.DestOverseas]
-            (pacparams, pacscore, pac_stderr) = regression(year, month, df_pac)
-            (usparams, us_score, us_stderr) = regression(year, month, df_us)
-
-            #Put this data into lists.
-            pacplane.append(60/pacparams[0])
-            pacjet.append(60/pacparams[0] - 60/(pacparams[0] + pacparams[1]))
-            pacground.append(pacparams[2])
-            pacfit.append(pacscore)
-
-            usplane.append(60/usparams[0])
-            usjet.append(60/usparams[0] - 60/(usparams[0] + usparams[1]))
-            usground.append(usparams[2])
-            usfit.append(us_score)
-            time.append(date_to_days(['%d-%d-01'] %(year, month))[0])
-
-            #Calculate and enumerate error.
-            df_pac['Error'] = df_pac.SchTime - (pacparams[0]*df_pac.Distance + pacparams[1]*df_pac.Jetstream + pacparams[2])
-            df_us['Error'] = df_us.SchTime - (usparams[0]*df_us.Distance + usparams[1]*df_us.Jetstream + usparams[2])
-            pacflights += len(df_pac)
-            pac_error += len(df_pac[np.abs(df_pac.Error) > 20])
-            usflights += len(df_us)
-            us_error += len(df_us[np.abs(df_us.Error) > 20])
-
-    print "Pacific Errors: %d out of %d" %(pac_error, pacflights)
-    print "Non-Pacific Errors: %d out of %d" %(us_error, usflights)
-
-    coeffs = {'Pacific':[pacplane, pacjet, pacground, pacfit], 'US':[usplane, usjet, usground, usfit]}
-    plotdict = {0:('Scheduled Plane Speed', 'mph', 'Plane.jpg'), 
-    1:('Jetstream Effect', 'mph', 'Jetstream.jpg'), 
-    2:('Ground Time', 'min', 'Ground.jpg'), 
-    3:('Correlation Coefficient', 'R^2', 'Fit.jpg')}
-
-    daystart = date_to_days(['1987-10-01'])[0]
-    dayend = date_to_days(['2016-01-01'])[0]
-    ticks = date_to_days(['%d-01-01' %year for year in range(1988, 2017)])
+    #Output routes that have a flight with Error < -25.
+    routes = RouteResiduals().add(df.OriginAirportId.values, df.DestAirportId.values, error)
+    errors = name_routes(routes.table())
+    errors = errors[errors.Min < -25].sort_values('Min')
+    for origin, dest, error in zip(errors.Origin, errors.Dest, errors.Min):
+        print "%s --> %s (%.1f min)" %(origin, dest, error)
+
+
+def plot_regression_coef(workers=1):
+    """Plot regression coefficients for Pacific and non-Pacific flights over all months of the data.
+    Also, count number of errors > 20 min.  Coefficients come from the saved coefficient table, which 
+    is only refitted for new or changed months."""
+    table = build_coefficients(workers=workers)
+
+    coeffs = {}
+    for region in REGIONS:
+        df = table[table.Region == region]
+        plane = 60/df.Distance
+        jet = 60/df.Distance - 60/(df.Distance + df.Jetstream)
+        coeffs[region] = [plane, jet, df.Intercept, df.Score]
+        time = month_days(zip(df.Year, df.Month))
+        print "%s Errors: %d out of %d" %('Non-Pacific' if region == 'US' else region, df.Errors.sum(),
+            df.Flights.sum())
+
+    daystart, dayend, ticks, labels = time_axis()
 
     #Plot Regression Coefficients
+    plt = pyplot()
     for region_prefix, region_coeffs in coeffs.viewitems():
         for j, region_coef in enumerate(region_coeffs):
             fig, ax = plt.subplots()
             ax.plot(time, region_coef)
-            labels = range(1988, 2017)
             ax.set_xlim(daystart, dayend)
             ax.set_xticks(ticks)
             ax.set_xticklabels(labels, rotation='vertical')
             ax.set_xlabel('Year')
-            ax.set_title(region_prefix + ' ' + plotdict[j][0])
-            ax.set_ylabel(plotdict[j][1])
+            ax.set_title(region_prefix + ' ' + COEF_PLOTS[j][0])
+            ax.set_ylabel(COEF_PLOTS[j][1])
             plt.subplots_adjust(bottom = 0.15)
-            fig.savefig(../graphs/region_prefix+plotdict[j][2])
+            fig.savefig('../graphs/' + region_prefix + COEF_PLOTS[j][2])
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Predict scheduled flight times with the fitted model.  For a route, month and carrier, the prediction
+is Intercept + Distance*distance + Jetstream*jetstream with the coefficients of the route's region
+(Pacific or US) in that month, plus the carrier's mean error, and the band is given by the carrier's
+10th and 90th percentiles of error (see analysis.coefficients).  A Predictor loads the coefficient and
+residual tables and the route features once, into arrays indexed by route, month, region and carrier,
+so a batch of requests is answered with a few vectorized lookups.  Routes are given by 7-digit or
+5-digit AirportIds; months after the last fitted month use its model, months before the first have
+none, and carriers without residuals in a month use those of all carriers."""
+
+import numpy as np
+import pandas as pd
+
+from analysis.coefficients import REGIONS, load_coefficients, load_residuals
+from analysis.routes import get_routes, route_key
+
+FIELDS = ['SchTime', 'Low', 'High']
+
+
+def month_number(year, month):
+    return np.asarray(year, dtype=np.int64)*12 + np.asarray(month, dtype=np.int64) - 1
+
+
+class Predictor(object):
+    """The model of every fitted month, held in arrays for vectorized predictions."""
+
+    def __init__(self, coefficients=None, residuals=None, routes=None):
+        coefficients = load_coefficients() if coefficients is None else coefficients
+        residuals = load_residuals() if residuals is None else residuals
+        routes = get_routes() if routes is None else routes
+
+        #Routes by 7-digit key, and by 5-digit key the latest 7-digit route (largest AirportSeqIds).
+        self.keys = routes.RouteKey.values
+        self.features = routes[['Distance', 'Jetstream']].values.astype(np.float64)
+        self.region = np.where(routes.DestOverseas.values, REGIONS.index('Pacific'), REGIONS.index('US'))
+        short = route_key(routes.OriginAirportId.values//100, routes.DestAirportId.values//100)
+        order = np.lexsort((self.keys, short))
+        last = np.append(short[order][1:] != short[order][:-1], True)
+        self.shortkeys, self.shortrows = short[order][last], order[last]
+
+        #Fitted months, and for every month from the first fitted one, the latest fitted month up to it.
+        fitted = np.unique(month_number(coefficients.Year.values, coefficients.Month.values))
+        self.first = fitted[0] if len(fitted) else 0
+        span = fitted[-1] - self.first + 1 if len(fitted) else 1
+        self.latest = np.searchsorted(fitted, np.arange(self.first, self.first + span), side='right') - 1
+        self.latest = np.maximum(self.latest, 0)
+
+        #Coefficients (Distance, Jetstream, Intercept) by fitted month and region.
+        self.coef = np.full((max(len(fitted), 1), len(REGIONS), 3), np.nan)
+        months = np.searchsorted(fitted, month_number(coefficients.Year.values, coefficients.Month.values))
+        regions = pd.Index(REGIONS).get_indexer(coefficients.Region.values)
+        self.coef[months, regions] = coefficients[['Distance', 'Jetstream', 'Intercept']].values.astype(
+            np.float64)
+
+        #Mean, Low and High error by fitted month, region and carrier; carrier 'All' is the last.
+        self.carriers = pd.Index(sorted(set(residuals.Carrier) - set(['All'])))
+        self.bands = np.full(self.coef.shape[:2] + (len(self.carriers) + 1, 3), np.nan)
+        residuals = residuals[month_number(residuals.Year.values, residuals.Month.values) >= self.first]
+        months = np.searchsorted(fitted, month_number(residuals.Year.values, residuals.Month.values))
+        regions = pd.Index(REGIONS).get_indexer(residuals.Region.values)
+        carriers = self.carrier_codes(residuals.Carrier.values)
+        self.bands[months, regions, carriers] = residuals[['Mean', 'Low', 'High']].values.astype(np.float64)
+
+    def carrier_codes(self, carriers):
+        """Index of each carrier in the bands, that of 'All' for unknown carriers or None."""
+        codes = self.carriers.get_indexer(np.asarray(carriers, dtype=object))
+        return np.where(codes < 0, len(self.carriers), codes)
+
+    def route_rows(self, origin, dest):
+        """Row of the route table of each (origin, dest), and whether it was found.  AirportIds under
+        100000 are 5-digit ids."""
+        origin = np.asarray(origin, dtype=np.int64)
+        dest = np.asarray(dest, dtype=np.int64)
+        short = (origin < 100000) & (dest < 100000)
+        rows = np.zeros(len(origin), dtype=np.int64)
+        found = np.zeros(len(origin), dtype=bool)
+        for keys, select, table in [(self.keys, ~short, None), (self.shortkeys, short, self.shortrows)]:
+            if not len(keys) or not select.any():
+                continue
+            key = route_key(origin[select], dest[select])
+            ids = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            found[select] = keys[ids] == key
+            rows[select] = ids if table is None else table[ids]
+        return rows, found
+
+    def predict_arrays(self, origin, dest, year, month, carrier=None):
+        """Predicted SchTime, Low and High for arrays (or scalars) of origin, dest, year, month and
+        carrier, as a dict of arrays with the Region and whether a prediction was Found.  Predictions of
+        unknown routes, months before the first fitted month and months outside 1 to 12 are NaN."""
+        origin = np.atleast_1d(origin)
+        n = len(origin)
+        dest, year, month = [np.broadcast_to(np.asarray(x), (n,)) for x in [dest, year, month]]
+        carrier = np.broadcast_to(np.asarray(carrier, dtype=object), (n,))
+
+        rows, found = self.route_rows(origin, dest)
+        found &= (month >= 1) & (month <= 12) & (month_number(year, month) >= self.first)
+        month = self.latest[np.clip(month_number(year, month) - self.first, 0, len(self.latest) - 1)]
+        region = self.region[rows]
+        coef = self.coef[month, region]
+        base = (coef[:, :2]*self.features[rows]).sum(1) + coef[:, 2]
+
+        bands = self.bands[month, region, self.carrier_codes(carrier)]
+        missing = np.isnan(bands[:, 0])
+        bands[missing] = self.bands[month[missing], region[missing], len(self.carriers)]
+        found &= ~np.isnan(base + bands[:, 0])
+
+        result = dict((name, np.where(found, base + bands[:, i], np.nan)) for i, name in enumerate(FIELDS))
+        result['Region'] = np.where(found, np.asarray(REGIONS, dtype=object)[region], None)
+        result['Found'] = found
+        return result
+
+    def predict(self, origin, dest, year, month, carrier=None):
+        """predict_arrays as a dataframe.  Building the dataframe costs more than the prediction of
+        a few flights, so the service uses predict_arrays."""
+        return pd.DataFrame(self.predict_arrays(origin, dest, year, month, carrier),
+            columns=FIELDS + ['Region', 'Found'])
+
+    def predict_one(self, origin, dest, year, month, carrier=None):
+        """Prediction of a single flight, as a dict."""
+        return self.predict([origin], dest, year, month, carrier).iloc[0].to_dict()
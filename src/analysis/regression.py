@@ -1,11 +1,78 @@
 #!/usr/bin/env python
 """Estimate parameters of models that predict SchTime using available info: SchDep, SchArr, Carrier, 
-    Date, Distance, Origin and Dest coordinates."""
+    Date, Distance, Origin and Dest coordinates.
+    OLS is computed from sufficient statistics X'X, X'y, y'y and n, accumulated in one pass over the data.  
+    Statistics of chunks, months or workers add up, so fitting many months holds one month at a time.  
+    fit_groups fits a model for every group of a key (region, carrier, origin, day, hour, ...) at once: 
+    the statistics of all groups are segmented sums over the group codes, and all groups are solved 
+    together."""
 
 import numpy as np
 import pandas as pd
-from sklearn import linear_model
-from analysis.filter import get_jetstream
+from analysis.filter import get_jetstream, get_pacific
+from store.flightstore import months
+from store.times import nearest_hour
+
+FEATURES = ['Distance', 'Jetstream']
+TARGET = 'SchTime'
+
+#Group keys computed from flights, and the flight columns they need beyond those of get_jetstream.  Hours
+#are rounded to the nearest, as in the schtime_by_dephour and schtime_by_arrhour reports.
+GROUPS = {
+    'Region':(lambda df: np.where(get_pacific(df[['DestLat', 'DestLong']]).DestOverseas, 'Pacific', 'US'), []), 
+    'DepHour':(lambda df: nearest_hour(df.SchDep.values), ['SchDep']), 
+    'ArrHour':(lambda df: nearest_hour(df.SchArr.values), ['SchArr']), 
+    'Origin':(lambda df: df.OriginAirportId.values, []), 
+    'Dest':(lambda df: df.DestAirportId.values, []), 
+    'Carrier':(lambda df: df.Carrier.values, ['Carrier']), 
+    'Day':(lambda df: df.Day.values, ['Day'])}
+
+
+class OLSStats(object):
+    """Sufficient statistics for OLS of y on the columns of x and an intercept (the last coefficient)."""
+
+    def __init__(self, k=len(FEATURES)):
+        self.xtx = np.zeros((k + 1, k + 1))
+        self.xty = np.zeros(k + 1)
+        self.yty = 0.
+        self.n = 0
+
+    def update(self, x, y):
+        """Add rows x (n by k) with targets y."""
+        x = np.column_stack([np.asarray(x, dtype=np.float64), np.ones(len(y))])
+        y = np.asarray(y, dtype=np.float64)
+        self.xtx += np.dot(x.T, x)
+        self.xty += np.dot(x.T, y)
+        self.yty += np.dot(y, y)
+        self.n += len(y)
+        return self
+
+    def update_frame(self, df, features=FEATURES, target=TARGET):
+        return self.update(df[features].values, df[target].values)
+
+    def merge(self, other):
+        """Add the statistics of other, e.g. from another chunk or worker."""
+        self.xtx += other.xtx
+        self.xty += other.xty
+        self.yty += other.yty
+        self.n += other.n
+        return self
+
+    def solve(self):
+        """Return (params, score, stderror): coefficients with the intercept last, R^2, and standard errors."""
+        xtxinv = np.linalg.pinv(self.xtx)
+        params = np.dot(xtxinv, self.xty)
+
+        #Residual and total sum of squares from the statistics alone.
+        sse = self.yty - 2*np.dot(params, self.xty) + np.dot(params, np.dot(self.xtx, params))
+        sst = self.yty - self.xty[-1]**2/self.n
+        score = 1 - sse/sst
+
+        #Calculate standard error.
+        mean_sqerr = max(sse, 0)/self.n    #Mean Square Error.
+        stderror = np.sqrt(mean_sqerr * np.diag(xtxinv))
+        return (list(params), score, stderror)
+
 
 def regression(year, month, df):
     """OLS regression modeling SchTime with Distance and Jetstream info."""
@@ -14,16 +81,131 @@ def regression(year, month, df):
         df = get_jetstream(year, month)
 
     #Run OLS regression.
-    x = df[['Distance', 'Jetstream']]
-    y = df['SchTime']
-    ols = linear_model.LinearRegression()
-    ols.fit(x,y)
-    params = list(ols.coef_)
-    params.append(ols.intercept_)
-    score = ols.score(x,y)
-
-    #Calculate standard error.
-    mean_sqerr = np.mean((y - ols.predict(x).T)**2)    #Mean Square Error.
-    x['ones'] = 1
-    stderror = np.sqrt(mean_sqerr * np.diag(np.linalg.pinv(np.dot(x.T, x))))
-    return (params, score, stderror)
+    return OLSStats().update_frame(df).solve()
+
+
+def group_stats(df, by, stats=None):
+    """Accumulate OLSStats of df for each value of by (column names or a Series aligned with df) into 
+    the dict stats, which is returned."""
+    stats = {} if stats is None else stats
+    for key, group in df.groupby(by):
+        stats.setdefault(key, OLSStats()).update_frame(group)
+    return stats
+
+
+def stream_regression(monthlist=None, subset=None, by=None):
+    """OLS regression over many months, holding one month at a time.  subset(df) optionally selects 
+    the flights of each month to use, e.g. lambda df: df[df.DestOverseas].  With by(df), a column name 
+    or function giving a group key for each flight, returns a dict of results for each group."""
+    stats = OLSStats() if by is None else {}
+    for year, month in (monthlist or months()):
+        df = get_jetstream(year, month)
+        if subset is not None:
+            df = subset(df)
+        if by is None:
+            stats.update_frame(df)
+        else:
+            group_stats(df, by(df) if callable(by) else by, stats)
+
+    if by is None:
+        return stats.solve()
+    return dict((key, groupstats.solve()) for key, groupstats in stats.items())
+
+
+def group_keys(df, by):
+    """Dict of group key arrays for by: a name in GROUPS or a column of df, or a list of them."""
+    by = [by] if isinstance(by, basestring) else list(by)
+    return dict((name, GROUPS[name][0](df) if name in GROUPS else df[name].values) for name in by), by
+
+
+def group_codes(keys, names):
+    """Group number of each row for the key arrays, and the index of distinct keys, sorted.  Categorical 
+    keys, such as Carrier of compact months, are sorted by value."""
+    codes, uniques = zip(*[pd.factorize(np.asarray(keys[name]), sort=True) for name in names])
+    if len(names) == 1:
+        return codes[0], pd.Index(uniques[0], name=names[0])
+    code, groups = pd.factorize(np.ravel_multi_index(codes, [len(x) for x in uniques]), sort=True)
+    levels = np.unravel_index(groups, [len(x) for x in uniques])
+    return code, pd.MultiIndex.from_arrays([x[level] for x, level in zip(uniques, levels)], names=names)
+
+
+def group_sums(df, by, features=FEATURES, target=TARGET):
+    """Sufficient statistics of every group of by, as a frame indexed by group with columns n, yty, 
+    xty0..k and xtx{i}_{j} for i <= j (the intercept is column k).  Frames of different chunks or 
+    months add up with merge_sums."""
+    keys, names = group_keys(df, by)
+    code, index = group_codes(keys, names)
+    x = [np.asarray(df[col].values, dtype=np.float64) for col in features] + [None]
+    y = np.asarray(df[target].values, dtype=np.float64)
+    segsum = lambda weights: np.bincount(code, weights, minlength=len(index))
+
+    sums = {'n':segsum(None), 'yty':segsum(y*y)}
+    for i, xi in enumerate(x):
+        sums['xty%d' %i] = segsum(y if xi is None else xi*y)
+        for j in range(i, len(x)):
+            xj = x[j]
+            sums['xtx%d_%d' %(i, j)] = segsum(None if xi is None else xi if xj is None else xi*xj)
+    return pd.DataFrame(sums, index=index)
+
+
+def merge_sums(sums):
+    """Add up group statistics from group_sums, e.g. of several months."""
+    merged = pd.concat(sums)
+    return merged.groupby(level=list(range(merged.index.nlevels))).sum()
+
+
+def solve_sums(sums, features=FEATURES):
+    """Fit every group of group statistics.  Returns a tidy table with a row per group: its keys, the 
+    coefficients and their standard errors, R^2 and the number of flights.  Groups with no more flights 
+    than coefficients are not fitted, and have NaN coefficients."""
+    k = len(features) + 1
+    n = sums.n.values
+    xty = np.column_stack([sums['xty%d' %i].values for i in range(k)])
+    xtx = np.empty((len(sums), k, k))
+    for i in range(k):
+        for j in range(i, k):
+            xtx[:, i, j] = xtx[:, j, i] = sums['xtx%d_%d' %(i, j)].values
+
+    #Solve all groups at once, as OLSStats.solve does for one.
+    xtxinv = np.linalg.pinv(xtx) if len(sums) else xtx
+    params = np.einsum('gij,gj->gi', xtxinv, xty)
+    sse = sums.yty.values - 2*(params*xty).sum(1) + np.einsum('gi,gij,gj->g', params, xtx, params)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sst = sums.yty.values - xty[:, -1]**2/n
+        score = 1 - sse/sst
+        stderror = np.sqrt((np.maximum(sse, 0)/n)[:, None]*np.diagonal(xtxinv, axis1=1, axis2=2))
+    fitted = n > k
+    params[~fitted], stderror[~fitted], score[~fitted] = np.nan, np.nan, np.nan
+
+    names = features + ['Intercept']
+    table = sums.index.to_frame(index=False)
+    for i, name in enumerate(names):
+        table[name] = params[:, i]
+    for i, name in enumerate(names):
+        table[name + 'Stderr'] = stderror[:, i]
+    table['Score'] = score
+    table['Flights'] = n.astype(np.int64)
+    return table
+
+
+def fit_groups(df, by, features=FEATURES, target=TARGET):
+    """Fit the model separately for each group of by (see group_keys) in one segmented pass, e.g. 
+    fit_groups(get_jetstream(2015, 1, ['Carrier']), 'Carrier').  Returns the tidy table of solve_sums."""
+    return solve_sums(group_sums(df, by, features, target), features)
+
+
+def stream_fit_groups(by, monthlist=None, subset=None):
+    """fit_groups over many months, holding one month at a time; the flight columns the keys need 
+    are read along with those of get_jetstream."""
+    names = [by] if isinstance(by, basestring) else list(by)
+    extra = sorted(set(col for name in names if name in GROUPS for col in GROUPS[name][1]) | 
+        set(name for name in names if name not in GROUPS))
+    sums = []
+    for year, month in (monthlist or months()):
+        df = get_jetstream(year, month, extra)
+        if subset is not None:
+            df = subset(df)
+        sums.append(group_sums(df, names))
+        if len(sums) > 1:
+            sums = [merge_sums(sums)]
+    return solve_sums(merge_sums(sums))
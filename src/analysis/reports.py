@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""The reports of BigQuery.txt, computed locally from the cleaned months in the flight store.  Each
+month is reduced to small partial aggregates (counts and sums keyed by day, hour, route, ...), which
+add up across months, so months are read one at a time by a pool of worker processes and only the
+partials are merged.  Finished reports are written as csv files to '../data/reports'."""
+
+import os
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from analysis.routes import DISTANCE, route_key
+from store.flightstore import DATA, months, load_month
+from store.times import day_of_month, nearest_hour
+
+REPORTDIR = DATA + '/reports'
+
+_cache = {}
+
+
+def get_distances():
+    """Sorted route keys and distances from distance.csv, read once per process."""
+    if 'distance' not in _cache:
+        dist = pd.read_csv(DISTANCE)
+        keys = route_key(dist.OriginAirportId, dist.DestAirportId)
+        order = np.argsort(keys)
+        _cache['distance'] = (keys[order], dist.Distance.values[order])
+    return _cache['distance']
+
+
+def get_longitudes():
+    """Sorted AirportIds and their longitudes from LatLong.csv, read once per process."""
+    if 'longitude' not in _cache:
+        latlong = pd.read_csv(DATA + '/LatLong.csv')[['AirportId', 'Longitude']].drop_duplicates('AirportId')
+        latlong = latlong.sort_values('AirportId')
+        _cache['longitude'] = (latlong.AirportId.values, latlong.Longitude.values)
+    return _cache['longitude']
+
+
+def lookup(keys, values, key):
+    """values of key in the sorted array keys, and whether each key was found."""
+    ids = np.minimum(np.searchsorted(keys, key), max(len(keys) - 1, 0))
+    found = keys[ids] == key if len(keys) else np.zeros(len(key), dtype=bool)
+    return values[ids] if len(keys) else np.zeros(len(key)), found
+
+
+class MonthFlights(object):
+    """A month of flights, with the derived columns reports share computed at most once."""
+
+    def __init__(self, year, month, df):
+        self.year = year
+        self.month = month
+        self.df = df
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def get(self, name, func):
+        if name not in self._columns:
+            self._columns[name] = func()
+        return self._columns[name]
+
+    @property
+    def schtime(self):
+        return self.get('schtime', lambda: self.df.SchTime.values.astype(np.float64))
+
+    @property
+    def route(self):
+        """Route number of each flight, 0, 1, ... in order of appearance."""
+        return self.get('route', lambda: pd.factorize(route_key(self.df.OriginAirportId.values,
+            self.df.DestAirportId.values))[0])
+
+    @property
+    def diff(self):
+        """SchTime less the mean SchTime of the route in this month."""
+        def diff():
+            counts = np.bincount(self.route)
+            means = np.bincount(self.route, weights=self.schtime)/counts
+            return self.schtime - means[self.route]
+        return self.get('diff', diff)
+
+    @property
+    def day_of_month(self):
+        return self.get('day_of_month', lambda: day_of_month(self.df.Date.values))
+
+
+def count_by(key, name):
+    """Partial: number of flights for each value of key."""
+    return pd.DataFrame({name:pd.Series(key).value_counts()}).rename_axis(None)
+
+
+def diff_by(flights, key):
+    """Partial: sum and count of SchTime less the route mean for each value of key."""
+    df = pd.DataFrame({'Key':key, 'Sum':flights.diff, 'Count':1})
+    return df.groupby('Key')[['Sum', 'Count']].sum().rename_axis(None)
+
+
+def spread(flights, group):
+    """Partial: sum over flights of the range (max - min) of SchTime in their group, and the count."""
+    if len(flights) == 0:
+        return pd.DataFrame({'Sum':[0.], 'Count':[0]}, index=['All'])
+    ranges = pd.Series(flights.schtime).groupby(group).agg(['min', 'max', 'size'])
+    return pd.DataFrame({'Sum':[float(((ranges['max'] - ranges['min'])*ranges['size']).sum())],
+        'Count':[len(flights)]}, index=['All'])
+
+
+def bound(flights, westbound):
+    """Partial: sum and count of SchTime for each route in this month, for routes travelling west (or
+    east) as in BigQuery.txt: DestLong - OriginLong in (-165, 0) or over 195 for westbound, and in
+    (0, 195) or under -165 for eastbound.  Months of 1987 are left out."""
+    df = flights.df
+    airports, longitudes = get_longitudes()
+    originlong, hasorigin = lookup(airports, longitudes, df.OriginAirportId.values)
+    destlong, hasdest = lookup(airports, longitudes, df.DestAirportId.values)
+    dlong = destlong - originlong
+    if westbound:
+        rows = ((dlong > -165) & (dlong < 0)) | (dlong > 195)
+    else:
+        rows = ((dlong > 0) & (dlong < 195)) | (dlong < -165)
+    rows &= hasorigin & hasdest & (flights.year > 1987)
+
+    df = pd.DataFrame({'OriginAirportId':df.OriginAirportId.values[rows],
+        'DestAirportId':df.DestAirportId.values[rows], 'Sum':flights.schtime[rows], 'Count':1})
+    df = df.groupby(['OriginAirportId', 'DestAirportId'])[['Sum', 'Count']].sum().reset_index()
+    df['Year'], df['Month'] = flights.year, flights.month
+    return df.set_index(['Year', 'Month', 'OriginAirportId', 'DestAirportId'])
+
+
+def finish_bound(partial):
+    """Average difference of SchTime from the mean of its route and year, by month."""
+    partial = partial.reset_index()
+    yearly = partial.groupby(['Year', 'OriginAirportId', 'DestAirportId'])[['Sum', 'Count']].transform('sum')
+    partial['Diff'] = partial.Sum - partial.Count*yearly.Sum/yearly.Count
+    bymonth = partial.groupby('Month')[['Count', 'Diff']].sum()
+    return pd.DataFrame({'month':bymonth.index, 'NumFlights':bymonth.Count.values,
+        'AveDiffFromMean':bymonth.Diff.values/bymonth.Count.values}, 
+        columns=['month', 'NumFlights', 'AveDiffFromMean'])
+
+
+def finish_count(key):
+    return lambda partial: partial.sort_index().rename_axis(key).reset_index()
+
+
+def finish_diff(key, sort=False):
+    def finish(partial):
+        report = pd.DataFrame({key:partial.index, 'AveDiffFromMean':partial.Sum.values/partial.Count.values}, 
+            columns=[key, 'AveDiffFromMean'])
+        return report.sort_values('AveDiffFromMean' if sort else key).reset_index(drop=True)
+    return finish
+
+
+def finish_spread(partial):
+    return pd.DataFrame({'AverageDev':partial.Sum.values/partial.Count.values})
+
+
+def distance_bins(flights):
+    """Partial: number of flights in each 100 mile bin of Distance.  Flights on routes missing from 
+    distance.csv are not counted."""
+    keys, distances = get_distances()
+    distance, found = lookup(keys, distances, route_key(flights.df.OriginAirportId.values,
+        flights.df.DestAirportId.values))
+    return count_by(100*np.floor(distance[found]/100. + 0.5), 'Freq')
+
+
+#Each report: (columns read, partial of a month, finish merged partial into the report).
+REPORTS = OrderedDict([
+    ('days', (['Day'],
+        lambda f: count_by(f.df.Day.values, 'NumberofFlights'), finish_count('Day'))),
+    ('dephours', (['SchDep'],
+        lambda f: count_by(nearest_hour(f.df.SchDep.values), 'NumberofFlights'), finish_count('dephour'))),
+    ('arrhours', (['SchArr'],
+        lambda f: count_by(nearest_hour(f.df.SchArr.values), 'NumberofFlights'), finish_count('arrhour'))),
+    ('westbound', ([], lambda f: bound(f, True), finish_bound)),
+    ('eastbound', ([], lambda f: bound(f, False), finish_bound)),
+    ('schtime_by_day', (['Day'], lambda f: diff_by(f, f.df.Day.values), finish_diff('Day'))),
+    ('schtime_by_dephour', (['SchDep'], lambda f: diff_by(f, nearest_hour(f.df.SchDep.values)), finish_diff('DepHour'))),
+    ('schtime_by_arrhour', (['SchArr'], lambda f: diff_by(f, nearest_hour(f.df.SchArr.values)), finish_diff('ArrHour'))),
+    ('distance', ([], distance_bins, finish_count('DistBin'))),
+    ('daily_variance', (['Date'], lambda f: spread(f, f.route*32 + f.day_of_month), finish_spread)),
+    ('monthly_variance', ([], lambda f: spread(f, f.route), finish_spread)),
+    ('schtime_by_carrier', (['Carrier'], lambda f: diff_by(f, f.df.Carrier.values), finish_diff('Carrier', sort=True)))])
+
+
+def month_partials(args):
+    """Partial aggregates of one month for each report, given (year, month, names)."""
+    year, month, names = args
+    columns = ['OriginAirportId', 'DestAirportId', 'SchTime']
+    for name in names:
+        columns += [col for col in REPORTS[name][0] if col not in columns]
+    flights = MonthFlights(year, month, load_month(year, month, columns=columns))
+    return dict((name, REPORTS[name][1](flights)) for name in names)
+
+
+def merge(partials):
+    """Add up partials of several months (or groups of months); they are summed by key."""
+    partials = [partial for partial in partials if len(partial)]
+    if not partials:
+        return pd.DataFrame()
+    merged = pd.concat(partials)
+    return merged.groupby(level=list(range(merged.index.nlevels))).sum()
+
+
+def build_reports(names=None, monthlist=None, workers=1, write=True):
+    """Compute the named reports (default: all) over monthlist (default: all months), reading months in
+    a pool of workers if workers > 1.  Returns a dict of report tables, also written to REPORTDIR."""
+    names = list(names or REPORTS)
+    todo = [(year, month, names) for year, month in (monthlist or months())]
+    if 'distance' in names:
+        get_distances()  #Read lookup tables once, before worker processes are forked.
+    if 'westbound' in names or 'eastbound' in names:
+        get_longitudes()
+
+    partials = dict((name, []) for name in names)
+    if workers > 1 and len(todo) > 1:
+        pool = Pool(workers)
+        try:
+            results = pool.imap_unordered(month_partials, todo)
+            for result in results:
+                for name in names:
+                    partials[name].append(result[name])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for args in todo:
+            result = month_partials(args)
+            for name in names:
+                partials[name].append(result[name])
+
+    reports = OrderedDict()
+    for name in names:
+        merged = merge(partials.pop(name))
+        reports[name] = REPORTS[name][2](merged) if len(merged) else pd.DataFrame()
+        if write:
+            if not os.path.isdir(REPORTDIR):
+                os.makedirs(REPORTDIR)
+            reports[name].to_csv(REPORTDIR + '/%s.csv' %name, index=False)
+    return reports
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Route feature table: for every (Origin, Dest) route in distance.csv with coordinates in LatLong.csv, 
+the Distance, coordinates, degrees Latitude North and Longitude East travelled, Jetstream and whether 
+the destination is in the Pacific.  These depend only on the route, so they are computed once, saved 
+in the flight store, and gathered onto flights by route number.  The table is rebuilt when LatLong.csv 
+or distance.csv change."""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from store.flightstore import DATA, STORE
+from store.manifest import Manifest, file_hash
+
+LATLONG = DATA + '/LatLong.csv'
+DISTANCE = DATA + '/distance.csv'
+ROUTES = STORE + '/routes.parquet'
+
+_cache = {}
+_hashes = {}  #path: (size, mtime, sha1)
+
+
+def cached_hash(path):
+    """sha1 of a file, hashed again only when its size or mtime change, as the manifest does."""
+    stat = os.stat(path)
+    size, mtime, sha1 = _hashes.get(path, (None, None, None))
+    if (size, mtime) != (stat.st_size, stat.st_mtime):
+        sha1 = file_hash(path)
+        _hashes[path] = (stat.st_size, stat.st_mtime, sha1)
+    return sha1
+
+
+def source_hash():
+    """Hash of the tables the route features are computed from."""
+    return Manifest.combine([cached_hash(LATLONG), cached_hash(DISTANCE)])
+
+
+def route_key(origin, dest):
+    """Single int64 key for 7-digit origin and destination AirportIds."""
+    return np.asarray(origin, dtype=np.int64)*10**7 + np.asarray(dest, dtype=np.int64)
+
+
+def build_routes():
+    """Compute the route feature table, sorted by route key."""
+    latlong = pd.read_csv(LATLONG)[['AirportId', 'Latitude', 'Longitude']].drop_duplicates('AirportId')
+    routes = pd.read_csv(DISTANCE)
+
+    #Merge with LatLong.
+    routes = routes.merge(latlong, left_on='OriginAirportId', right_on='AirportId')
+    routes.rename(columns={'Latitude':'OriginLat', 'Longitude':'OriginLong'}, inplace=True)
+    routes = routes.merge(latlong, left_on='DestAirportId', right_on='AirportId')
+    routes.rename(columns={'Latitude':'DestLat', 'Longitude':'DestLong'}, inplace=True)
+
+    #Calculate degrees Latitude North and degrees Longitude East travelled.
+    routes['dLat'] = routes.DestLat - routes.OriginLat
+    routes['dLong'] = routes.DestLong - routes.OriginLong
+    routes.loc[routes.dLong < -180, 'dLong'] += 360
+    routes.loc[routes.dLong > 180, 'dLong'] -= 360
+
+    #Estimate Jetstream effect, and whether the destination is in the Pacific.
+    routes['Jetstream'] = -routes.dLong*routes.Distance/np.sqrt(routes.dLong**2 + routes.dLat**2)
+    routes['DestOverseas'] = (routes.DestLat < 50) & (np.abs(routes.DestLong) > 130)
+
+    routes['RouteKey'] = route_key(routes.OriginAirportId, routes.DestAirportId)
+    routes = routes.sort_values('RouteKey').reset_index(drop=True)
+    return routes[['RouteKey', 'OriginAirportId', 'DestAirportId', 'Distance', 'OriginLat', 'OriginLong', 
+        'DestLat', 'DestLong', 'dLat', 'dLong', 'Jetstream', 'DestOverseas']]
+
+
+def get_routes():
+    """The route feature table, from memory or the flight store, rebuilt if its sources changed."""
+    source = source_hash()
+    if source in _cache:
+        return _cache[source]
+
+    if os.path.exists(ROUTES) and os.path.exists(ROUTES + '.json'):
+        with open(ROUTES + '.json') as f:
+            saved = json.load(f).get('source')
+    else:
+        saved = None
+
+    if saved == source:
+        routes = pd.read_parquet(ROUTES)
+    else:
+        routes = build_routes()
+        if not os.path.isdir(STORE):
+            os.makedirs(STORE)
+        routes.to_parquet(ROUTES, index=False)
+        with open(ROUTES + '.json', 'w') as f:
+            json.dump({'source':source}, f)
+
+    _cache.clear()
+    _cache[source] = routes
+    return routes
+
+
+def route_ids(routes, origin, dest):
+    """Row of each (origin, dest) in the route table, and whether the route is in the table."""
+    keys = routes.RouteKey.values
+    key = route_key(origin, dest)
+    ids = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+    return ids, keys[ids] == key if len(keys) else np.zeros(len(key), dtype=bool)
+
+
+def enrich(flights, columns):
+    """Flights on routes in the route table, with the given route feature columns added."""
+    routes = get_routes()
+    ids, found = route_ids(routes, flights.OriginAirportId.values, flights.DestAirportId.values)
+    flights = flights[found].reset_index(drop=True)
+    ids = ids[found]
+    for col in columns:
+        flights[col] = routes[col].values[ids]
+    return flights
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""Stratified samples of flights for interactive regressions and plots over many months.  Months are
+streamed in chunks and only sampled flights are kept, with the columns the model and plots use, so a
+decade of flights is never held in memory.  The strata are routes, which also fixes eastbound/westbound
+and DestOverseas.  Within each route and month, the i-th flight in scan order gets the number
+u = (offset + i*golden ratio) mod 1, with the offset a hash of the route, month and seed, and a flight
+is in the sample of rate r if u < r.  The sequence is evenly spread: each route contributes r*flights
+of every month to within a few flights, a bound growing as log(flights) (at most 3 for routes of up to
+5000 flights a month, 4 at 50,000, over rates of 0.001 to 0.3).  The sample is the same for the same
+months and seed, and the sample of a larger rate contains that of a smaller one, so growing it only
+adds flights.
+Flights with u up to RESERVE times the requested rate are kept, so the sample can grow that much
+without scanning the months again.  The sample has the same proportions as the data in every stratum,
+so the model is fitted as on all flights, and confidence intervals come from the standard errors of
+the fit.  Run it from a directory next to the data directory, as the drivers:
+
+    python -m analysis.sampling --first 2005-1 --last 2014-12 --region US --rate 0.002 --grow
+"""
+
+import argparse
+import sys
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from analysis.coefficients import REGIONS
+from analysis.plot import plot_regression
+from analysis.regression import OLSStats
+from analysis.routes import get_routes, route_ids
+from store.flightstore import iter_month, months, parse_month
+
+GOLDEN = (np.sqrt(5) - 1)/2
+Z = 1.959964  #Normal quantile of 95% confidence intervals.
+RESERVE = 4  #Flights are kept up to RESERVE times the requested rate.
+RATE = 0.01
+#Target half-width of the 95% confidence interval of each coefficient (min/mile, min/mile, min).  For
+#Distance, 0.0005 min/mile is about 2 mph of scheduled plane speed.
+PRECISION = OrderedDict([('Distance', 0.0005), ('Jetstream', 0.0005), ('Intercept', 0.5)])
+COLUMNS = ['Distance', 'Jetstream', 'dLong', 'DestOverseas']  #Route features kept with SchTime.
+
+
+def mix(x):
+    """splitmix64 finalizer of uint64 x (products wrap around)."""
+    x = np.atleast_1d(np.asarray(x, dtype=np.uint64))
+    with np.errstate(over='ignore'):
+        x = (x ^ (x >> np.uint64(30)))*np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27)))*np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def route_offsets(keys, year, month, seed):
+    """Offset in [0, 1) of the sequence of each route key in a month."""
+    salt = mix(np.uint64((seed*10000 + year)*100 + month))
+    return (mix(np.asarray(keys, dtype=np.int64).astype(np.uint64) ^ salt) >> np.uint64(11))/2.**53
+
+
+def empty_sample():
+    return pd.DataFrame(dict((col, np.zeros(0)) for col in ['U', 'SchTime'] + COLUMNS),
+        columns=['U', 'SchTime'] + COLUMNS)
+
+
+def runs(origin, dest):
+    """Start and length of the runs of rows with the same origin and destination."""
+    start = np.flatnonzero(np.append(True, (origin[1:] != origin[:-1]) | (dest[1:] != dest[:-1])))
+    return start, np.diff(np.append(start, len(origin)))
+
+
+def stratum_ranks(ids, start, counts):
+    """Position of each row among the earlier rows with the same id, given the runs of equal ids.  Clean
+    months are clustered by route, so each id is usually one run and positions count from its start;
+    otherwise the rows are sorted by id."""
+    if len(np.unique(ids[start])) == len(start):
+        return np.arange(len(ids)) - np.repeat(start, counts)
+    order = np.argsort(ids, kind='mergesort')
+    sorted_ids = ids[order]
+    first = np.flatnonzero(np.append(True, sorted_ids[1:] != sorted_ids[:-1]))
+    ranks = np.empty(len(ids), dtype=np.int64)
+    ranks[order] = np.arange(len(ids)) - np.repeat(first, np.diff(np.append(first, len(ids))))
+    return ranks
+
+
+def month_sample(args):
+    """Flights of one month with low <= u < high, given (year, month, low, high, seed), as a dataframe
+    of U, SchTime and COLUMNS, and the number of flights scanned on known routes.  Routes are looked up
+    once per run of rows on the same route."""
+    year, month, low, high, seed = args
+    routes = get_routes()
+    offsets = route_offsets(routes.RouteKey.values, year, month, seed)
+    seen = np.zeros(len(routes), dtype=np.int64)
+    samples, flights = [empty_sample()], 0
+    for chunk in iter_month(year, month, columns=['OriginAirportId', 'DestAirportId', 'SchTime']):
+        origin, dest = chunk.OriginAirportId.values, chunk.DestAirportId.values
+        start, counts = runs(origin, dest)
+        ids, found = route_ids(routes, origin[start], dest[start])
+        start, counts, ids = start[found], counts[found], ids[found]
+        rows = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        start = np.cumsum(counts) - counts
+        ids = np.repeat(ids, counts)
+        u = (offsets[ids] + (seen[ids] + stratum_ranks(ids, start, counts))*GOLDEN) % 1.
+        seen += np.bincount(ids, minlength=len(routes))
+        flights += len(ids)
+
+        keep = (u >= low) & (u < high)
+        sample = pd.DataFrame({'U':u[keep], 'SchTime':chunk.SchTime.values[rows[keep]]},
+            columns=['U', 'SchTime'])
+        for col in COLUMNS:
+            sample[col] = routes[col].values[ids[keep]]
+        samples.append(sample)
+    return pd.concat(samples, ignore_index=True), flights
+
+
+class StratifiedSample(object):
+    """Sample of the flights of monthlist (default: all months), grown on demand by rescanning."""
+
+    def __init__(self, monthlist=None, seed=0, workers=1, reserve=RESERVE):
+        self.monthlist = monthlist or months()
+        self.seed = seed
+        self.workers = workers
+        self.reserve = reserve
+        self.cap = 0.  #Flights with u < cap are held.
+        self.total = None  #Flights scanned, on routes of the route table.
+        self.flights = empty_sample()
+
+    def extend(self, rate):
+        """Hold the flights of the sample of rate, scanning the months for those not yet held."""
+        if rate <= self.cap:
+            return
+        high = min(1., rate*self.reserve)
+        todo = [(year, month, self.cap, high, self.seed) for year, month in self.monthlist]
+        get_routes()  #Load the route table once, before worker processes are forked.
+        if self.workers > 1 and len(todo) > 1:
+            pool = Pool(self.workers)
+            try:
+                results = pool.map(month_sample, todo)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [month_sample(args) for args in todo]
+        self.flights = pd.concat([self.flights] + [sample for sample, flights in results], ignore_index=True)
+        self.total = sum(flights for sample, flights in results)
+        self.cap = high
+
+    def frame(self, rate, region=None):
+        """Sampled flights of rate, or only those to region (one of REGIONS), with SchTime and COLUMNS."""
+        self.extend(rate)
+        rows = self.flights.U.values < rate
+        if region is not None:
+            if region not in REGIONS:
+                raise ValueError('Unknown region %r' %region)
+            overseas = self.flights.DestOverseas.values.astype(bool)
+            rows &= overseas if region == 'Pacific' else ~overseas
+        df = self.flights[rows].reset_index(drop=True)
+        df[['SchTime', 'Distance', 'Jetstream', 'dLong']] = df[['SchTime', 'Distance', 'Jetstream',
+            'dLong']].astype(np.float64)
+        return df
+
+    def fit(self, rate, region=None, precision=PRECISION):
+        """Fit the model of regression on the sample of rate.  Returns a table with a row per coefficient:
+        the estimate, standard error, 95% confidence interval (Low, High) and its HalfWidth, the Target
+        half-width of precision and whether it is Met, and the Flights and Rate of the sample."""
+        df = self.frame(rate, region)
+        params, score, stderror = OLSStats().update_frame(df).solve()
+        table = pd.DataFrame({'Coefficient':list(precision), 'Estimate':params, 'Stderr':stderror},
+            columns=['Coefficient', 'Estimate', 'Stderr'])
+        table['Low'] = table.Estimate - Z*table.Stderr
+        table['High'] = table.Estimate + Z*table.Stderr
+        table['HalfWidth'] = Z*table.Stderr
+        table['Target'] = list(precision.values())
+        table['Met'] = table.HalfWidth <= table.Target
+        table['Flights'] = len(df)
+        table['Rate'] = rate
+        table['Score'] = score
+        return table
+
+    def grow(self, rate=RATE, region=None, precision=PRECISION, maxrate=1.):
+        """Fit on the sample of rate, and grow the rate until every coefficient meets its precision or
+        maxrate is reached.  Half-widths shrink as 1/sqrt(flights), so each step grows the rate by the
+        square of the largest ratio of half-width to target (and at least 1.5 times).  Returns the table
+        of the last fit."""
+        while True:
+            table = self.fit(rate, region, precision)
+            if table.Met.all() or rate >= maxrate or not len(table) or table.Flights.iloc[0] == 0:
+                return table
+            ratio = np.nanmax(table.HalfWidth.values/table.Target.values)
+            rate = min(maxrate, rate*max(1.5, 1.1*ratio**2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit the scheduled time model on a stratified sample of '
+        'flights, with 95% confidence intervals.')
+    parser.add_argument('--first', default=None, help='first month, year-month (default: first of the data)')
+    parser.add_argument('--last', default=None, help='last month, year-month (default: last of the data)')
+    parser.add_argument('--region', default=None, choices=REGIONS, help='fit only flights to region')
+    parser.add_argument('--rate', type=float, default=RATE, help='fraction of flights sampled')
+    parser.add_argument('--grow', action='store_true', help='grow the sample until the precision is met')
+    parser.add_argument('--precision', type=float, nargs=3, default=None, metavar=tuple(PRECISION),
+        help='target half-widths of the confidence intervals (default: %s)'
+        %' '.join(str(x) for x in PRECISION.values()))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--plot', action='store_true', help='plot the sampled flights and regression lines')
+    args = parser.parse_args(argv)
+
+    first = parse_month(args.first) if args.first else None
+    last = parse_month(args.last) if args.last else None
+    precision = OrderedDict(zip(PRECISION, args.precision)) if args.precision else PRECISION
+    start = time.time()
+    sample = StratifiedSample(months(first, last), args.seed, args.workers)
+    if args.grow:
+        table = sample.grow(args.rate, args.region, precision)
+    else:
+        table = sample.fit(args.rate, args.region, precision)
+    print table.to_string(index=False)
+    print '%d of %d flights sampled (rate %.4g) in %.2f s' %(table.Flights.iloc[0], sample.total,
+        table.Rate.iloc[0], time.time() - start)
+
+    if args.plot:
+        monthlist = sample.monthlist
+        label = '%d-%d to %d-%d' %(monthlist[0] + monthlist[-1])
+        plot_regression(monthlist[0][0], monthlist[0][1], sample.frame(table.Rate.iloc[0], args.region),
+            params=list(table.Estimate), title='Sample of flights, %s' %label,
+            path='../graphs/Regression_sample_%s.jpg' %label.replace(' ', '_'))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""HTTP service for scheduled time predictions.  The Predictor is loaded once when the server starts,
+and requests are answered by a pool of threads from memory:
+
+    GET  /predict?origin=12478&dest=12892&year=2015&month=6&carrier=AA
+    POST /predict   with a json list of {"origin", "dest", "year", "month", "carrier"} objects
+
+A GET returns one json object with schtime, low, high and region (404 if the route or month has no
+model, 400 for a month outside 1 to 12); a POST returns a list, with null predictions for unknown routes
+and months, computed in one vectorized call.
+Connections are kept alive.  Run it from a directory next to the data directory, as the drivers:
+
+    python -m analysis.service --port 8080
+"""
+
+import argparse
+import json
+import socket
+import sys
+import threading
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import numpy as np
+
+from analysis.predict import Predictor
+
+KEYS = ['origin', 'dest', 'year', 'month', 'carrier']
+
+
+def results(query, prediction):
+    """Json-ready dicts of the requests in query (a dict of columns) and their predictions (a dict of
+    arrays from Predictor.predict_arrays)."""
+    found = prediction['Found']
+    columns = [query[key] for key in KEYS] + [
+        [round(x, 1) if ok else None for x, ok in zip(prediction[name].tolist(), found)]
+        for name in ['SchTime', 'Low', 'High']] + [prediction['Region'].tolist()]
+    names = KEYS + ['schtime', 'low', 'high', 'region']
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+class PredictServer(ThreadingMixIn, HTTPServer):
+    """Threaded server holding the Predictor."""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, predictor=None):
+        HTTPServer.__init__(self, address, PredictHandler)
+        self.predictor = predictor or Predictor()
+
+    def predict(self, query):
+        """Predictions of a dict of columns origin, dest, year, month and carrier."""
+        origin, dest, year, month = [np.asarray(query[key], dtype=np.int64) for key in KEYS[:4]]
+        if ((month < 1) | (month > 12)).any():
+            raise ValueError('month must be 1 to 12')
+        prediction = self.predictor.predict_arrays(origin, dest, year, month, query['carrier'])
+        query = dict(zip(KEYS, [x.tolist() for x in [origin, dest, year, month]] + [query['carrier']]))
+        return results(query, prediction)
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1  #Headers and body go out in one write when the response is flushed.
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_json(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == '/health':
+            return self.send_json(200, {'status':'ok'})
+        if url.path != '/predict':
+            return self.send_json(404, {'error':'not found'})
+        params = urlparse.parse_qs(url.query)
+        try:
+            query = dict((key, [params[key][0]] if key in params else [None]) for key in KEYS)
+            result = self.server.predict(query)[0]
+        except (ValueError, TypeError):
+            return self.send_json(400, {'error':'origin, dest, year and month must be integers, '
+                'with month 1 to 12'})
+        self.send_json(200 if result['schtime'] is not None else 404, result)
+
+    def do_POST(self):
+        if urlparse.urlparse(self.path).path != '/predict':
+            return self.send_json(404, {'error':'not found'})
+        try:
+            requests = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            query = dict((key, [request.get(key) for request in requests]) for key in KEYS)
+            result = self.server.predict(query) if requests else []
+        except (ValueError, TypeError, AttributeError):
+            return self.send_json(400, {'error':'expected a json list of requests with integer origin, dest, '
+                'year and month, with month 1 to 12'})
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8080, predictor=None):
+    """Start a PredictServer on localhost in a background thread and return it."""
+    server = PredictServer(('localhost', port), predictor)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve scheduled time predictions on localhost.')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    server = PredictServer(('localhost', args.port))
+    print 'Serving predictions of %d routes on port %d' %(len(server.predictor.keys), args.port)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""In-process analysis session.  A month of flights loaded and enriched by get_jetstream, its Pacific
+and US flights, and the models fitted on them are kept in memory, so analyses repeated in one process
+(the regression, error and distance plots of a month for all, Pacific and US flights) load and fit
+each once.  Values are held in an LRU cache with a byte budget: a frame counts its memory_usage, and the
+least recently used values are evicted once the cached total exceeds the budget.  Frames returned by a
+session are shared with its cache and must not be modified.  get_session() is the session of the
+process; its budget is FLIGHTMODEL_CACHE_MB megabytes (default 1024), or set with its set_budget."""
+
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from analysis.coefficients import REGIONS
+from analysis.filter import get_jetstream, get_pacific
+from analysis.regression import OLSStats
+
+BUDGET = int(os.environ.get('FLIGHTMODEL_CACHE_MB', 1024)) << 20
+
+_sessions = {}
+
+
+def nbytes(value):
+    """Approximate memory of a cached value: frames and arrays count their data, tuples and lists their
+    items."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=True, deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache(object):
+    """Values by key, with the least recently used evicted while their total nbytes exceeds budget.  A
+    value larger than the budget is returned but not kept."""
+
+    def __init__(self, budget=BUDGET):
+        self.budget = budget
+        self.items = OrderedDict()  #key: (value, size), least recently used first.
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, load):
+        """The value of key, made by load() and kept if it is not cached."""
+        if key in self.items:
+            self.hits += 1
+            item = self.items.pop(key)
+            self.items[key] = item
+            return item[0]
+        self.misses += 1
+        return self.put(key, load())
+
+    def put(self, key, value):
+        self.pop(key)
+        size = nbytes(value)
+        if size <= self.budget:
+            self.items[key] = (value, size)
+            self.nbytes += size
+            self.evict()
+        return value
+
+    def pop(self, key):
+        if key in self.items:
+            self.nbytes -= self.items.pop(key)[1]
+
+    def evict(self):
+        while self.nbytes > self.budget:
+            key, (value, size) = self.items.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        self.items.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {'items':len(self.items), 'nbytes':self.nbytes, 'budget':self.budget, 'hits':self.hits,
+            'misses':self.misses, 'evictions':self.evictions}
+
+
+class Session(object):
+    """Months of flights and fitted models, memoized in an LRUCache of budget bytes."""
+
+    def __init__(self, budget=BUDGET):
+        self.cache = LRUCache(budget)
+
+    def set_budget(self, budget):
+        """Change the byte budget, evicting values until the cache fits it."""
+        self.cache.budget = budget
+        self.cache.evict()
+
+    def flights(self, year, month, region=None, extra=()):
+        """get_jetstream(year, month, extra) with DestOverseas, or only its flights to region (one of
+        REGIONS)."""
+        extra = tuple(sorted(extra))
+        if region is None:
+            return self.cache.get(('flights', year, month, extra),
+                lambda: get_pacific(get_jetstream(year, month, extra)))
+        if region not in REGIONS:
+            raise ValueError('Unknown region %r' %region)
+
+        def select():
+            df = self.flights(year, month, None, extra)
+            overseas = df.DestOverseas.values
+            return df[overseas if region == 'Pacific' else ~overseas].reset_index(drop=True)
+        return self.cache.get(('flights', year, month, extra, region), select)
+
+    def fit(self, year, month, region=None):
+        """(params, score, stderror) of the Distance/Jetstream model of regression, fitted on the month's
+        flights or its flights to region."""
+        return self.cache.get(('fit', year, month, region),
+            lambda: OLSStats().update_frame(self.flights(year, month, region)).solve())
+
+    def clear(self):
+        self.cache.clear()
+
+
+def get_session():
+    """The session of this process, created on first use."""
+    if 'default' not in _sessions:
+        _sessions['default'] = Session()
+    return _sessions['default']
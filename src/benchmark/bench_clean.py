@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Time fix_schdata and adjust_schtime on a large synthetic month, against their previous pandas 
+implementations, kept here as legacy_fix_flights and legacy_adjust_schtime for comparison.  
+Reports rows/sec."""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+from benchmark.synthetic import raw_month, inject_errors
+from clean.cleandata import fix_flights, adjust_schtime
+from download.get_files import FLIGHT_COLUMNS
+from store.flightstore import cast
+
+def raw_flights(rows, seed=0, errors=0.01):
+    """A synthetic month as stored in the raw partition, with errors for fix_schdata to repair."""
+    df = inject_errors(raw_month(2015, 1, rows, seed), errors, seed)
+    return cast(df.rename(columns=FLIGHT_COLUMNS), 'raw')
+
+
+def legacy_fix_flights(flights):
+    """fix_schdata before vectorization: masked Series assignments, hhmm converted per expression."""
+    flights = flights[flights.OriginAirportId != flights.DestAirportId]
+    mintotime = (lambda minutes: 100*(minutes//60) + minutes%60)
+    timetomin = (lambda t: 60*(t//100) + t%100)
+    df = pd.DataFrame({})
+    df['SValid'] = flights.SchTime.notnull() & (flights.SchTime > 0)
+    df['AValid'] = flights.ActualTime.notnull() & (flights.ActualTime > 0)
+    dep_valid = flights.DepTime.notnull() & flights.DepDelay.notnull() & flights.SchDep.notnull()
+    arr_valid = flights.ArrTime.notnull() & flights.ArrDelay.notnull() & flights.SchArr.notnull()
+    act_valid = df['SValid'] & df['AValid'] & flights.ArrDelay.notnull() & flights.DepDelay.notnull()
+    tz_valid = df['AValid'] & flights.DepTime.notnull() & flights.ArrTime.notnull()
+    sch_valid = df['SValid'] & flights.SchArr.notnull() & flights.SchDep.notnull()
+    df['D'] = ((timetomin(flights.DepTime) - flights.DepDelay - timetomin(flights.SchDep))%1440 != 0) & dep_valid
+    df['A'] = ((timetomin(flights.ArrTime) - flights.ArrDelay - timetomin(flights.SchArr))%1440 != 0) & arr_valid
+    df['ACT'] = ((flights.ActualTime - flights.ArrDelay + flights.DepDelay)%1440 != flights.SchTime) & act_valid
+    df['TZ'] = ((timetomin(flights.ArrTime) - timetomin(flights.DepTime) - flights.ActualTime)%60 != 0) & tz_valid
+    df['SCH'] = ((timetomin(flights.SchArr) - timetomin(flights.SchDep) - flights.SchTime)%60 != 0) & sch_valid
+    schdepnull = (flights.SchDep.isnull() & flights.DepTime.notnull() & flights.DepDelay.notnull())
+    flights.SchDep[schdepnull] = mintotime((timetomin(flights.DepTime[schdepnull]) - flights.DepDelay[schdepnull])%1440)
+    scharrnull = (flights.SchArr.isnull() & flights.ArrTime.notnull() & flights.ArrDelay.notnull())
+    flights.SchArr[scharrnull] = mintotime((timetomin(flights.DepTime[scharrnull]) - flights.DepDelay[scharrnull])%1440)
+    snulla = (~df.SValid) & df.AValid
+    flights.SchDep[snulla] = mintotime((timetomin(flights.DepTime[snulla]) - flights.DepDelay[snulla])%1440)
+    flights.SchArr[snulla] = mintotime((timetomin(flights.ArrTime[snulla]) - flights.ArrDelay[snulla])%1440)
+    flights.SchTime[snulla] = (flights.ActualTime[snulla] - flights.ArrDelay[snulla] + flights.DepDelay[snulla])%1440
+    sanull = df.SValid & (~df.AValid) & df.SCH
+    schtimeerror = (timetomin(flights.SchArr[sanull]) - timetomin(flights.SchDep[sanull]) - flights.SchTime[sanull])%60
+    adderror = (schtimeerror < 30 | (flights.SchTime[sanull] + schtimeerror < 60))
+    flights.SchTime[sanull] += schtimeerror - 60
+    if(len(adderror) > 0):
+        flights.SchTime[sanull & adderror] += 60
+    sa = df.SValid & df.AValid & df.SCH
+    flights.SchDep[(sa & df.D)] = mintotime((timetomin(flights.DepTime[(sa & df.D)]) - flights.DepDelay[(sa & df.D)])%1440)
+    flights.SchArr[(sa & df.A)] = mintotime((timetomin(flights.ArrTime[(sa & df.A)]) - flights.ArrDelay[(sa & df.A)])%1440)
+    flights.SchTime[(sa & df.ACT)] = (flights.ActualTime[(sa & df.ACT)] - flights.ArrDelay[(sa & df.ACT)] + flights.DepDelay[(sa & df.ACT)])%1440
+    schtimeerror = (timetomin(flights.SchArr[(sa & df.TZ)]) - timetomin(flights.SchDep[(sa & df.TZ)]) - flights.SchTime[(sa & df.TZ)])%60
+    adderror = (schtimeerror < 30 | (flights.SchTime[(sa & df.TZ)] + schtimeerror < 60))
+    flights.SchTime[(sa & df.TZ)] += schtimeerror - 60
+    if(adderror.sum() > 0):
+        flights.SchTime[sa & adderror] += 60
+    df['SValid'] = flights.SchTime.notnull() & (flights.SchTime > 0)
+    sch_valid = df['SValid'] & flights.SchArr.notnull() & flights.SchDep.notnull()
+    df['SCH'] = ((timetomin(flights.SchArr) - timetomin(flights.SchDep) - flights.SchTime)%60 == 0) & sch_valid
+    flights = flights[df.SCH]
+    return pd.DataFrame({
+        'Carrier':flights.Carrier, 
+        'Day':flights.Day, 
+        'Date':flights.Date, 
+        'OriginAirportId':flights.OriginAirportId, 
+        'DestAirportId':flights.DestAirportId, 
+        'SchDep':flights.SchDep, 
+        'SchArr':flights.SchArr, 
+        'SchTime':flights.SchTime})
+
+
+def legacy_adjust_schtime(df):
+    """adjust_schtime before vectorization: one groupby transform with a Python function per statistic."""
+    firstquartile = lambda A: np.median(A) if len(A) < 20 else A.quantile(0.25)
+    thirdquartile = lambda A: np.median(A) if len(A) < 20 else A.quantile(0.75)
+    df['Median'] = df.groupby(['OriginAirportId', 'DestAirportId']).SchTime.transform(np.median)
+    df['Q1'] = df.groupby(['OriginAirportId', 'DestAirportId']).SchTime.transform(firstquartile)
+    df['Q3'] = df.groupby(['OriginAirportId', 'DestAirportId']).SchTime.transform(thirdquartile)
+    df['IQR'] = map(lambda x: min(x, 30), df.Q3 - df.Q1)
+    outlier = (df.SchTime <= df.Q1 - df.IQR) | (df.SchTime >= df.Q3 + df.IQR)
+    df.SchTime[outlier] += 60 * np.round((df.Median[outlier] - df.SchTime[outlier])/60.)
+    df.drop(['Median', 'Q1', 'Q3', 'IQR'], axis=1, inplace=True)
+    return df
+
+
+def best_time(func, df, repeat):
+    """Shortest of repeat runs of func on a fresh copy of df, and its output."""
+    times = []
+    for i in range(repeat):
+        flights = df.copy()
+        start = time.time()
+        out = func(flights)
+        times.append(time.time() - start)
+    return min(times), out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    raw = raw_flights(args.rows)
+    fixed = fix_flights(raw)
+    fixed['SchTime'] = fixed.SchTime.astype(np.float64)
+    stages = [('fix_schdata', raw, legacy_fix_flights, fix_flights), 
+        ('adjust_schtime', fixed, legacy_adjust_schtime, adjust_schtime)]
+
+    for stage, df, before, after in stages:
+        print stage
+        for name, func in [('before', before), ('after', after)]:
+            elapsed, out = best_time(func, df, args.repeat)
+            print '  %-6s %10.0f rows/sec  (%d rows in, %d rows out, %.2f s)' %(
+                name, len(df)/elapsed, len(df), len(out), elapsed)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""End-to-end benchmark of the pipeline on a synthetic month: get_flights parsing, fix_schdata,
+adjust_schtime, get_distancefreq, get_jetstream and regression.  Each stage runs in a fresh process,
+so its peak resident memory is its own, against data written to a scratch data directory.  Reports
+rows/sec and peak RSS, and writes them to a json file; --compare prints the change from a previous
+run, e.g. of another version."""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from analysis.filter import get_jetstream
+from analysis.regression import regression
+from analysis.routes import get_routes
+from benchmark.synthetic import write_tables, write_zip
+from clean.cleandata import fix_schdata, adjust_schtime
+from download.get_dist_from_files import get_distancefreq
+from download.get_files import ZIPDIR, flight_zip, get_flights
+from store.flightstore import load_month, month_rows, partition_path, write_month
+from store.routeindex import write_clean
+
+def peak_rss():
+    """Peak resident memory of this process in MB (ru_maxrss is in kB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+#Each stage prepares any other input, untimed, and returns (rows in, seconds).  Stages run in order, each
+#reading what the one before wrote.
+def stage_get_flights(year, month, args):
+    start = time.time()
+    get_flights(year, month)
+    return month_rows('raw', year, month), time.time() - start
+
+
+def stage_fix_schdata(year, month, args):
+    start = time.time()
+    df = fix_schdata(year, month, args.fix_chunksize)
+    elapsed = time.time() - start
+    write_month('clean', year, month, df)
+    return month_rows('raw', year, month), elapsed
+
+
+def stage_adjust_schtime(year, month, args):
+    df = load_month(year, month)
+    start = time.time()
+    df = adjust_schtime(df)
+    elapsed = time.time() - start
+    write_clean(year, month, df)
+    return len(df), elapsed
+
+
+def stage_get_distancefreq(year, month, args):
+    if os.path.exists(partition_path('distfreq', year, month)):
+        os.remove(partition_path('distfreq', year, month))
+    start = time.time()
+    get_distancefreq([(year, month)])
+    return month_rows('raw', year, month), time.time() - start
+
+
+def stage_get_jetstream(year, month, args):
+    get_routes()
+    start = time.time()
+    get_jetstream(year, month)
+    return month_rows('clean', year, month), time.time() - start
+
+
+def stage_regression(year, month, args):
+    df = get_jetstream(year, month)
+    start = time.time()
+    regression(year, month, df)
+    return len(df), time.time() - start
+
+
+STAGES = [('get_flights', stage_get_flights), ('fix_schdata', stage_fix_schdata),
+    ('adjust_schtime', stage_adjust_schtime), ('get_distancefreq', stage_get_distancefreq),
+    ('get_jetstream', stage_get_jetstream), ('regression', stage_regression)]
+
+
+def run_stage(stage):
+    name, year, month, args = stage
+    rows, elapsed = dict(STAGES)[name](year, month, args)
+    return {'stage':name, 'rows':rows, 'seconds':elapsed, 'rows_per_sec':rows/elapsed if elapsed else None,
+        'peak_rss_mb':peak_rss()}
+
+
+def commit():
+    """Git commit of the code under test, if it is a git checkout."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000, help='flights in the synthetic month')
+    parser.add_argument('--errors', type=float, default=0.01, help='fraction of rows with each error class')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=1 << 20, help='rows generated at a time')
+    parser.add_argument('--fix-chunksize', type=int, default=None, help='chunksize of fix_schdata')
+    parser.add_argument('--workdir', default=None, help='scratch directory (default: a temporary one)')
+    parser.add_argument('--output', default='bench_pipeline.json', help='json file of results')
+    parser.add_argument('--compare', default=None, help='json file of a previous run')
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.output)
+    previous = os.path.abspath(args.compare) if args.compare else None
+
+    #DATA is '../data', so run from a directory next to the scratch data directory.
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_pipeline')
+    for subdir in ['data', 'run']:
+        if not os.path.isdir(os.path.join(workdir, subdir)):
+            os.makedirs(os.path.join(workdir, subdir))
+    cwd = os.getcwd()
+    os.chdir(os.path.join(workdir, 'run'))
+
+    year, month = 2015, 1
+    results = []
+    try:
+        #The synthetic zip and tables are written before the stages, so as not to count in their memory.
+        write_tables(args.seed)
+        if not os.path.isdir(ZIPDIR):
+            os.makedirs(ZIPDIR)
+        write_zip(flight_zip(year, month), year, month, args.rows, args.seed, args.errors, args.chunksize)
+        for name, stage in STAGES:
+            pool = Pool(1)
+            try:
+                result = pool.apply(run_stage, [(name, year, month, args)])
+            finally:
+                pool.close()
+                pool.join()
+            results.append(result)
+            print '%-18s %10d rows %8.2f s %12.0f rows/sec %8.0f MB peak' %(
+                name, result['rows'], result['seconds'], result['rows_per_sec'] or 0, result['peak_rss_mb'])
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    report = {'commit':commit(), 'date':datetime.datetime.now().isoformat(), 'rows':args.rows,
+        'errors':args.errors, 'seed':args.seed, 'python':platform.python_version(),
+        'numpy':np.__version__, 'pandas':pd.__version__, 'pyarrow':pa.__version__, 'stages':results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if previous:
+        with open(previous) as f:
+            before = dict((result['stage'], result) for result in json.load(f)['stages'])
+        print 'Change from %s:' %previous
+        for result in results:
+            old = before.get(result['stage'])
+            if old and old['rows_per_sec'] and result['rows_per_sec']:
+                print '%-18s %6.2fx rows/sec %+8.0f MB peak' %(result['stage'],
+                    result['rows_per_sec']/old['rows_per_sec'], result['peak_rss_mb'] - old['peak_rss_mb'])
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Load test of the prediction service on localhost.  Client threads, each on one kept-alive
+connection, send single (GET) or batched (POST) requests for random routes and fitted months as fast
+as they are answered, and the latencies are reported as p50/p90/p99 with requests and predictions per
+second.  Without --url, the service is started in a separate process for the test.  Run it from a
+directory next to the data directory, after the coefficient table has been built."""
+
+import argparse
+import httplib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import numpy as np
+
+from analysis.coefficients import load_coefficients, load_residuals
+from analysis.routes import get_routes
+
+
+def queries(count, seed=0):
+    """count random (origin, dest, year, month, carrier) requests on routes of the route table and
+    fitted months, with 5-digit AirportIds."""
+    rng = np.random.RandomState(seed)
+    routes = get_routes()
+    table = load_coefficients()
+    carriers = sorted(set(load_residuals().Carrier) - set(['All'])) or ['AA']
+    rows = rng.randint(0, len(routes), count)
+    months = rng.randint(0, len(table), count)
+    return [{'origin':int(routes.OriginAirportId.values[row]//100), 'dest':int(routes.DestAirportId.values[row]//100),
+        'year':int(table.Year.values[month]), 'month':int(table.Month.values[month]),
+        'carrier':carriers[rng.randint(len(carriers))]} for row, month in zip(rows, months)]
+
+
+def connect(url):
+    connection = httplib.HTTPConnection(url.hostname, url.port)
+    connection.connect()
+    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection
+
+
+def client(url, requests, batch, latencies, errors):
+    """Send requests in batches of batch over one connection, appending each latency in seconds."""
+    url = urlparse.urlparse(url)
+    connection = connect(url)
+    for i in range(0, len(requests), batch):
+        chunk = requests[i:i + batch]
+        start = time.time()
+        try:
+            if batch == 1:
+                connection.request('GET', '/predict?' + urllib.urlencode(chunk[0]))
+            else:
+                connection.request('POST', '/predict', json.dumps(chunk), {'Content-Type':'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status not in (200, 404):
+                errors.append(response.status)
+        except (httplib.HTTPException, IOError) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = connect(url)
+            continue
+        latencies.append(time.time() - start)
+    connection.close()
+
+
+def start_service(port):
+    """Start the service in a separate process and wait until it answers."""
+    process = subprocess.Popen([sys.executable, '-m', 'analysis.service', '--port', str(port)],
+        stdout=open(os.devnull, 'w'))
+    for i in range(600):
+        try:
+            connection = httplib.HTTPConnection('localhost', port)
+            connection.request('GET', '/health')
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status == 200:
+                return process
+        except (httplib.HTTPException, IOError):
+            if process.poll() is not None:
+                raise RuntimeError('The prediction service exited with %d' %process.returncode)
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('The prediction service did not start')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default=None, help='url of a running service (default: start one)')
+    parser.add_argument('--port', type=int, default=8081, help='port of the service started for the test')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per client')
+    parser.add_argument('--batch', type=int, default=1, help='predictions per request (1: GET, else POST)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    requests = queries(args.clients*args.requests*args.batch, args.seed)
+    process = None if args.url else start_service(args.port)
+    url = args.url or 'http://localhost:%d/' %args.port
+    try:
+        latencies, errors = [], []
+        share = args.requests*args.batch
+        threads = [threading.Thread(target=client, args=(url, requests[i*share:(i + 1)*share], args.batch,
+            latencies, errors)) for i in range(args.clients)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        if process is not None:
+            process.kill()
+            process.wait()
+
+    latencies = np.array(latencies)*1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) if len(latencies) else (np.nan,)*3
+    print '%d clients, %d requests of %d predictions in %.2f s, %d errors' %(args.clients, len(latencies),
+        args.batch, elapsed, len(errors))
+    print '%10.0f requests/sec %12.0f predictions/sec' %(len(latencies)/elapsed, len(latencies)*args.batch/elapsed)
+    print 'latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' %(p50, p90, p99, latencies.max() if len(latencies) else np.nan)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Time the conversions of store.times on a large synthetic column, against the code they replaced,
+kept here as legacy_* for comparison.  Inputs are as in a clean month: int16 hhmm times and
+'year-mon-day' dates of one month.  Reports rows/sec of each."""
+
+import argparse
+import datetime
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from store.times import date_days, mintotime, nearest_hour, timetomin
+
+
+def legacy_timetomin(time):
+    """plot.timetomin: hhmm to minutes, in floats."""
+    return (60*np.floor(time/100) + time%100)
+
+
+def legacy_mintotime(minutes):
+    """hhmm of whole minutes, as benchmark.synthetic computed it."""
+    minutes = np.mod(minutes, 1440)
+    return 100*(minutes//60) + minutes%60
+
+
+def legacy_hour(hhmm):
+    """reports.hour: nearest hour of hhmm, in floats."""
+    hhmm = np.asarray(hhmm, dtype=np.float64)
+    return (np.floor(np.floor(hhmm/100) + (hhmm % 100)/60. + 0.5) % 24).astype(np.int64)
+
+
+def legacy_date_to_days(df):
+    """plot.date_to_days: a timedelta per row, converted to days one at a time."""
+    epoch = datetime.datetime.utcfromtimestamp(0)
+    return map(lambda A: A.days, pd.to_datetime(df) - epoch)
+
+
+def columns(rows, seed=0):
+    """int16 hhmm, minutes after midnight, and dates of January 2015."""
+    rng = np.random.RandomState(seed)
+    minutes = rng.randint(0, 1440, rows).astype(np.int16)
+    hhmm = (100*(minutes//60) + minutes%60).astype(np.int16)
+    days = np.array(['2015-01-%02d' %day for day in range(1, 32)], dtype=object)
+    return hhmm, minutes, days[rng.randint(0, 31, rows)]
+
+
+def best_time(func, x, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        out = func(x)
+        times.append(time.time() - start)
+    return min(times), out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--legacy-dates', type=int, default=1000000,
+        help='rows of the per-row legacy date conversion, which is timed on fewer rows')
+    args = parser.parse_args(argv)
+
+    hhmm, minutes, dates = columns(args.rows)
+    cases = [('timetomin', hhmm, legacy_timetomin, timetomin),
+        ('mintotime', minutes, legacy_mintotime, mintotime),
+        ('nearest_hour', hhmm, legacy_hour, nearest_hour),
+        ('date_days', dates[:args.legacy_dates], legacy_date_to_days, date_days),
+        ('date_days', dates, None, date_days)]
+
+    for name, x, before, after in cases:
+        print '%s (%d rows)' %(name, len(x))
+        outs = []
+        for label, func in [('before', before), ('after', after)]:
+            if func is None:
+                continue
+            elapsed, out = best_time(func, x, args.repeat)
+            outs.append(np.asarray(out))
+            print '  %-6s %12.0f rows/sec  (%.3f s)' %(label, len(x)/elapsed, elapsed)
+        if len(outs) == 2 and not (outs[0] == outs[1]).all():
+            print '  outputs differ'
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""End-to-end run of UpdateDriver.py on synthetic months served by benchmark/testserver.py, in a scratch
+directory: a full build with several worker processes, then a second run that should find nothing to
+do.  Exercises targets with their own pools (coefficients, anomalies) alongside the graph's pool, and
+reports the time of each run; exits with the driver's status if it fails."""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.testserver import serve
+
+DRIVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'drivers', 'UpdateDriver.py')
+
+
+def run(args, env, cwd):
+    """Run UpdateDriver.py with args, returning its status and seconds."""
+    start = time.time()
+    status = subprocess.call([sys.executable, DRIVER] + args, env=env, cwd=cwd)
+    return status, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--months', type=int, default=3, help='months of 2015 to build')
+    parser.add_argument('--rows', type=int, default=20000, help='flights per month')
+    parser.add_argument('-w', '--workers', type=int, default=2, help='worker processes of UpdateDriver.py')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, rows=args.rows)
+    scratch = tempfile.mkdtemp()
+    rundir = os.path.join(scratch, 'run')
+    os.makedirs(rundir)
+    src = os.path.dirname(os.path.dirname(DRIVER))
+    env = dict(os.environ, BTS_URL='http://localhost:%d/' %args.port, BTS_FIRST_MONTH='2015-1',
+        BTS_LAST_MONTH='2015-%d' %args.months, MPLBACKEND='Agg',
+        PYTHONPATH=os.pathsep.join([src, os.path.dirname(DRIVER), os.environ.get('PYTHONPATH', '')]))
+    try:
+        for name in ['build', 'rebuild']:
+            status, seconds = run(['-w', str(args.workers)], env, rundir)
+            if status != 0:
+                print 'UpdateDriver.py -w %d failed on %s with %d' %(args.workers, name, status)
+                return status
+            print '%s of %d months of %d flights with %d workers: %.2f s' %(name, args.months, args.rows,
+                args.workers, seconds)
+    finally:
+        server.shutdown()
+        if args.keep:
+            print 'Scratch directory:', scratch
+        else:
+            shutil.rmtree(scratch)
+
+if __name__ == '__main__':
+    sys.exit(main())
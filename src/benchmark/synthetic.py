@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""Generate synthetic flight data in the format published by the Bureau of Transportation Statistics.
+Airports, routes and carriers are fixed by a seed.  Scheduled times follow distance, the jet stream 
+and time zones, so that the cleaning and regression code sees data shaped like the real thing.  
+Months of any size are generated in chunks, so a 50M row month is written with bounded memory, as 
+the zip served by BTS, the raw partition, or the clean partition of the flight store.  Clean months of 
+up to CLUSTER_ROWS rows are clustered by route in memory, at about 300 bytes per row; larger ones are 
+written unclustered, chunk by chunk, as GetCleanDriver --stream writes them."""
+
+import argparse
+import datetime
+import io
+import os
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from download import get_files
+from store.flightstore import DATA, MonthWriter, months, parse_month
+from store.routeindex import write_clean, write_unclustered
+from store.times import mintotime, timetomin
+
+CLUSTER_ROWS = 5000000  #Larger clean months are written unclustered, without a route index.
+CARRIERS = ['AA', 'UA', 'DL', 'WN', 'US', 'B6', 'AS', 'HA', 'NK', 'F9', 'VX', 'MQ']
+
+#BTS columns read by get_flights, in the order of the published files.
+FLIGHT_COLUMNS = ['DayOfWeek', 'FlightDate', 'UniqueCarrier', 'OriginAirportSeqID', 'DestAirportSeqID', 
+    'CRSDepTime', 'DepTime', 'DepDelay', 'CRSArrTime', 'ArrTime', 'ArrDelay', 'CRSElapsedTime', 
+    'ActualElapsedTime', 'Distance']
+
+#Other columns of the published files, left empty.  They give the files their real width.
+FILLER_COLUMNS = ['Year', 'Quarter', 'Month', 'DayofMonth', 'AirlineID', 'Carrier', 'TailNum', 
+    'FlightNum', 'OriginAirportID', 'OriginCityMarketID', 'Origin', 'OriginCityName', 'OriginState', 
+    'DestAirportID', 'DestCityMarketID', 'Dest', 'DestCityName', 'DestState', 'DepDelayMinutes', 
+    'TaxiOut', 'WheelsOff', 'WheelsOn', 'TaxiIn', 'Cancelled', 'CancellationCode', 'Diverted', 
+    'AirTime', 'Flights', 'DistanceGroup', 'CarrierDelay', 'WeatherDelay', 'NASDelay', 'SecurityDelay', 
+    'LateAircraftDelay'] + ['Div%d%s' %(i, name) for i in range(1, 6) 
+    for name in ['Airport', 'AirportID', 'AirportSeqID', 'WheelsOn', 'TotalGTime', 'LongestGTime', 
+        'WheelsOff', 'TailNum']]
+
+
+def airports(n=300, seed=0):
+    """Airports with 7-digit AirportId, name, Latitude and Longitude.  About 5% are in the Pacific."""
+    rng = np.random.RandomState(seed)
+    pacific = rng.rand(n) < 0.05
+    lat = np.where(pacific, rng.uniform(13, 22, n), rng.uniform(25, 49, n))
+    lon = np.where(pacific, rng.uniform(-160, -155, n), rng.uniform(-124, -70, n))
+    ids = 10000 + 37*np.arange(n)
+    return pd.DataFrame({
+        'AirportId':100*ids + rng.randint(1, 10, n), 
+        'AirportName':['Airport %d' %x for x in ids], 
+        'Latitude':lat.round(4), 
+        'Longitude':lon.round(4)})
+
+
+def routes(airportdf, n=3000, seed=0):
+    """Routes between airports, with great-circle Distance (miles), a carrier and a popularity weight."""
+    rng = np.random.RandomState(seed + 1)
+    origin = rng.randint(0, len(airportdf), 2*n)
+    dest = rng.randint(0, len(airportdf), 2*n)
+    pairs = pd.DataFrame({'o':origin, 'd':dest})
+    pairs = pairs[pairs.o != pairs.d].drop_duplicates().iloc[:n]
+    o, d = pairs.o.values, pairs.d.values
+
+    lat1, lon1 = np.radians(airportdf.Latitude.values[o]), np.radians(airportdf.Longitude.values[o])
+    lat2, lon2 = np.radians(airportdf.Latitude.values[d]), np.radians(airportdf.Longitude.values[d])
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    distance = np.round(2*3959*np.arcsin(np.sqrt(a)))
+
+    return pd.DataFrame({
+        'OriginAirportId':airportdf.AirportId.values[o], 
+        'DestAirportId':airportdf.AirportId.values[d], 
+        'Distance':np.maximum(distance, 30), 
+        'dLong':np.degrees(lon2 - lon1), 
+        'OriginTZ':np.round(airportdf.Longitude.values[o]/15)*60, 
+        'DestTZ':np.round(airportdf.Longitude.values[d]/15)*60, 
+        'Carrier':rng.choice(CARRIERS, len(o)), 
+        'Weight':rng.pareto(1.2, len(o)) + 1})
+
+
+def raw_month(year, month, rows, seed=0, airportdf=None, routedf=None, part=0):
+    """A month of flights with the 14 BTS columns read by get_flights.  About 2% are cancelled.  
+    Parts other than 0 are further flights of the same month, drawn independently."""
+    if airportdf is None:
+        airportdf = airports(seed=seed)
+    if routedf is None:
+        routedf = routes(airportdf, seed=seed)
+    rng = np.random.RandomState([seed, year, month] + ([part] if part else []))
+
+    route = routedf.iloc[rng.choice(len(routedf), rows, p=routedf.Weight.values/routedf.Weight.sum())]
+    first = datetime.date(year, month, 1)
+    ndays = ((first + datetime.timedelta(days=32)).replace(day=1) - first).days
+    day = rng.randint(0, ndays, rows)
+    dates = np.array([(first + datetime.timedelta(days=i)).isoformat() for i in range(ndays)])
+    weekday = np.array([(first + datetime.timedelta(days=i)).isoweekday() for i in range(ndays)])
+
+    #Scheduled time: ground time, cruise at ~480 mph, slower westbound against the jet stream.
+    distance = route.Distance.values
+    jet = -np.sign(route.dLong.values)*distance*(0.02 + 0.01*np.cos(2*np.pi*(month - 1)/12.))
+    schtime = np.round(25 + distance/8. - jet/8.).astype(int)
+    tz = (route.DestTZ.values - route.OriginTZ.values).astype(int)
+
+    schdep = rng.randint(300, 1380, rows)
+    depdelay = np.round(rng.exponential(12, rows) - 6).astype(int)
+    arrdelay = depdelay + np.round(rng.normal(0, 8, rows)).astype(int)
+    actual = schtime + arrdelay - depdelay
+
+    df = pd.DataFrame({
+        'DayOfWeek':weekday[day], 
+        'FlightDate':dates[day], 
+        'UniqueCarrier':route.Carrier.values, 
+        'OriginAirportSeqID':route.OriginAirportId.values, 
+        'DestAirportSeqID':route.DestAirportId.values, 
+        'CRSDepTime':mintotime(schdep), 
+        'DepTime':mintotime(schdep + depdelay).astype(float), 
+        'DepDelay':depdelay.astype(float), 
+        'CRSArrTime':mintotime(schdep + schtime + tz), 
+        'ArrTime':mintotime(schdep + schtime + tz + arrdelay).astype(float), 
+        'ArrDelay':arrdelay.astype(float), 
+        'CRSElapsedTime':schtime.astype(float), 
+        'ActualElapsedTime':actual.astype(float), 
+        'Distance':distance}, columns=FLIGHT_COLUMNS)
+
+    #Cancelled flights have no actual times.
+    cancelled = rng.rand(rows) < 0.02
+    df.loc[cancelled, ['DepTime', 'DepDelay', 'ArrTime', 'ArrDelay', 'ActualElapsedTime']] = np.nan
+    return df
+
+
+def inject_errors(df, rate=0.01, seed=0):
+    """Introduce the errors repaired by fix_schdata into a month with BTS column names, each in a 
+    fraction rate of rows: missing CRSDepTime, missing CRSArrTime, missing CRSElapsedTime, 
+    CRSElapsedTime off by 60 minutes, and CRSArrTime shifted by a time zone."""
+    df = df.copy()
+    rng = np.random.RandomState(seed)
+    rows = lambda: rng.rand(len(df)) < rate
+    df.loc[rows(), 'CRSDepTime'] = np.nan
+    df.loc[rows(), 'CRSArrTime'] = np.nan
+    df.loc[rows(), 'CRSElapsedTime'] = np.nan
+    off = rows()
+    df.loc[off, 'CRSElapsedTime'] += rng.choice([-60, 60], off.sum())
+    shifted = rows() & df.CRSArrTime.notnull().values
+    minutes = timetomin(df.CRSArrTime.values[shifted])
+    df.loc[shifted, 'CRSArrTime'] = mintotime(minutes.astype(int) + rng.choice([-60, 60], shifted.sum()))
+    return df
+
+
+def bts_csv(df):
+    """Csv text of a month with the full width of a published BTS file."""
+    df = df.copy()
+    for col in FILLER_COLUMNS:
+        df[col] = ''
+    return df.to_csv(index=False)
+
+
+def zip_bytes(name, text):
+    """A zip file containing a single file name with contents text."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(name, text)
+    return buf.getvalue()
+
+
+def flight_zip(year, month, rows, seed=0):
+    """Zip file of a month as served under PREZIP/."""
+    name = 'On_Time_On_Time_Performance_%d_%d.csv' %(year, month)
+    return zip_bytes(name, bts_csv(raw_month(year, month, rows, seed)))
+
+
+def latlong_zip(seed=0):
+    """Zip file of airport coordinates as served by BTS."""
+    df = airports(seed=seed)
+    master = pd.DataFrame({
+        'AIRPORT_SEQ_ID':df.AirportId, 
+        'DISPLAY_AIRPORT_NAME':df.AirportName, 
+        'LATITUDE':df.Latitude, 
+        'LONGITUDE':df.Longitude}, 
+        columns=['AIRPORT_SEQ_ID', 'DISPLAY_AIRPORT_NAME', 'LATITUDE', 'LONGITUDE'])
+    return zip_bytes('187806114_T_MASTER_CORD.csv', master.to_csv(index=False))
+
+
+def iter_raw_month(year, month, rows, seed=0, errors=0., chunksize=1 << 20):
+    """A month of rows flights with BTS column names, in chunks of at most chunksize rows, with a 
+    fraction errors of each error class injected."""
+    airportdf = airports(seed=seed)
+    routedf = routes(airportdf, seed=seed)
+    for part, start in enumerate(range(0, rows, chunksize)):
+        df = raw_month(year, month, min(chunksize, rows - start), seed, airportdf, routedf, part)
+        if errors:
+            df = inject_errors(df, errors, seed + part)
+        yield df
+
+
+def clean_month(raw):
+    """Cleaned flights, as written to the clean partition, of a chunk of raw_month without errors."""
+    raw = raw[raw.OriginAirportSeqID != raw.DestAirportSeqID]
+    return pd.DataFrame({
+        'Carrier':raw.UniqueCarrier.values, 
+        'Day':raw.DayOfWeek.values, 
+        'Date':raw.FlightDate.values, 
+        'OriginAirportId':raw.OriginAirportSeqID.values, 
+        'DestAirportId':raw.DestAirportSeqID.values, 
+        'SchDep':raw.CRSDepTime.values, 
+        'SchArr':raw.CRSArrTime.values, 
+        'SchTime':raw.CRSElapsedTime.values}, 
+        columns=['Carrier', 'Day', 'Date', 'OriginAirportId', 'DestAirportId', 'SchDep', 'SchArr', 'SchTime'])
+
+
+def write_zip(path, year, month, rows, seed=0, errors=0., chunksize=1 << 20):
+    """Write a month as the zip file published by BTS, through a temporary csv on disk."""
+    name = 'On_Time_On_Time_Performance_%d_%d.csv' %(year, month)
+    fd, csvpath = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for i, df in enumerate(iter_raw_month(year, month, rows, seed, errors, chunksize)):
+                for col in FILLER_COLUMNS:
+                    df[col] = ''
+                df.to_csv(f, index=False, header=(i == 0))
+        with zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            zf.write(csvpath, name)
+        os.rename(path + '.tmp', path)
+    finally:
+        os.remove(csvpath)
+    return path
+
+
+def write_month(kind, year, month, rows, seed=0, errors=0., chunksize=1 << 20):
+    """Write a month to the 'raw' or 'clean' partition of the flight store.  Clean months have no 
+    errors to repair; those of up to CLUSTER_ROWS rows are clustered by route with their route index, 
+    as GetCleanDriver writes them, and larger ones are written a chunk at a time."""
+    chunks = iter_raw_month(year, month, rows, seed, errors if kind == 'raw' else 0., chunksize)
+    if kind == 'clean' and rows > CLUSTER_ROWS:
+        return write_unclustered(year, month, (clean_month(df) for df in chunks))[0]
+    if kind == 'clean':
+        return write_clean(year, month, pd.concat([clean_month(df) for df in chunks], ignore_index=True))
+    with MonthWriter('raw', year, month) as writer:
+        for df in chunks:
+            writer.write(df.rename(columns=get_files.FLIGHT_COLUMNS))
+    return writer.path
+
+
+def write_tables(seed=0):
+    """Write LatLong.csv and distance.csv for the synthetic airports and routes to the data directory."""
+    if not os.path.isdir(DATA):
+        os.makedirs(DATA)
+    airportdf = airports(seed=seed)
+    airportdf[['AirportId', 'AirportName', 'Latitude', 'Longitude']].to_csv(DATA + '/LatLong.csv', index=False)
+    routedf = routes(airportdf, seed=seed)
+    routedf[['OriginAirportId', 'DestAirportId', 'Distance']].to_csv(DATA + '/distance.csv', index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic flight data to the data directory, '
+        '../data relative to the working directory.')
+    parser.add_argument('--first', default='2015-1', help='first month, year-month')
+    parser.add_argument('--last', default=None, help='last month, year-month (default: first)')
+    parser.add_argument('--rows', type=int, default=1000000, help='flights per month')
+    parser.add_argument('--kind', choices=['zip', 'raw', 'clean'], action='append', 
+        help='write zip files, raw or clean partitions (repeat for several; default: raw)')
+    parser.add_argument('--errors', type=float, default=0.01, help='fraction of rows with each error class')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=1 << 20)
+    args = parser.parse_args(argv)
+
+    first = parse_month(args.first)
+    last = parse_month(args.last or args.first)
+    kinds = sorted(set(args.kind or ['raw']))
+
+    write_tables(args.seed)
+    for year, month in months(first, last):
+        for kind in kinds:
+            if kind == 'zip':
+                if not os.path.isdir(get_files.ZIPDIR):
+                    os.makedirs(get_files.ZIPDIR)
+                path = write_zip(get_files.flight_zip(year, month), year, month, args.rows, args.seed, args.errors, 
+                    args.chunksize)
+            else:
+                path = write_month(kind, year, month, args.rows, args.seed, args.errors, args.chunksize)
+            print path
+
+if __name__ == '__main__':
+    sys.exit(main())
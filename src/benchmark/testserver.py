@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Local stand-in for the BTS download server.  It serves synthetic flight zips under 
+'/PREZIP/On_Time_On_Time_Performance_year_month.zip' and airport coordinates under 
+'/187806114_T_MASTER_CORD.zip', honours range requests, and can inject failures: error responses, 
+connections dropped mid-file, and a bandwidth limit.  Point the downloader at it with
+
+    python -m benchmark.testserver --port 8000 --rows 100000 --fail-rate 0.2 &
+    export BTS_URL=http://localhost:8000/
+"""
+
+import argparse
+import random
+import re
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from benchmark.synthetic import flight_zip, latlong_zip
+
+FLIGHTPATH = re.compile(r'^/PREZIP/On_Time_On_Time_Performance_(\d{4})_(\d{1,2})\.zip$')
+LATLONGPATH = '/187806114_T_MASTER_CORD.zip'
+RANGE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class BTSServer(ThreadingMixIn, HTTPServer):
+    """Threaded server holding the generated files and failure settings."""
+    daemon_threads = True
+
+    def __init__(self, address, rows=10000, seed=0, fail_rate=0.0, drop_rate=0.0, rate=None):
+        HTTPServer.__init__(self, address, BTSHandler)
+        self.rows = rows
+        self.seed = seed
+        self.fail_rate = fail_rate  #Fraction of requests answered with 503.
+        self.drop_rate = drop_rate  #Fraction of responses cut off halfway.
+        self.rate = rate  #Bytes per second per response, or None for unlimited.
+        self.files = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def content(self, path):
+        """Bytes served at path, generated on first request, or None if there is no such file."""
+        with self.lock:
+            self.requests += 1
+            if path not in self.files:
+                match = FLIGHTPATH.match(path)
+                if match:
+                    year, month = int(match.group(1)), int(match.group(2))
+                    self.files[path] = flight_zip(year, month, self.rows, self.seed)
+                elif path == LATLONGPATH:
+                    self.files[path] = latlong_zip(self.seed)
+            return self.files.get(path)
+
+
+class BTSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        if random.random() < server.fail_rate:
+            return self.send_error(503)
+
+        body = server.content(self.path)
+        if body is None:
+            return self.send_error(404)
+
+        #Serve the requested byte range, if any.
+        start, end = 0, len(body) - 1
+        match = RANGE.match(self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start > end:
+                return self.send_error(416)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %(start, end, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        #Send the body, possibly cut off halfway and throttled.
+        stop = end + 1
+        if random.random() < server.drop_rate:
+            stop = start + (stop - start)//2
+            self.close_connection = True
+        blocksize = 1 << 16
+        for offset in range(start, stop, blocksize):
+            block = body[offset:min(offset + blocksize, stop)]
+            self.wfile.write(block)
+            if server.rate:
+                time.sleep(len(block)/float(server.rate))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8000, **kwargs):
+    """Start a BTSServer on localhost in a background thread and return it."""
+    server = BTSServer(('localhost', port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve synthetic BTS files on localhost.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rows', type=int, default=10000, help='flights per month')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests failing with 503')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of responses cut off halfway')
+    parser.add_argument('--rate', type=float, default=None, help='bytes per second per response')
+    args = parser.parse_args(argv)
+
+    server = BTSServer(('localhost', args.port), args.rows, args.seed, args.fail_rate, args.drop_rate, args.rate)
+    print 'Serving synthetic BTS files on port %d' %args.port
+    server.serve_forever()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,22 +3,39 @@
 to enforce consistency and fill in NaNs.
 We consider SchTime values which are over 1 interquartile range (or 30 minutes) from the 1st and 3rd 
 quartile in order to detect outliers.  We adjust those outside that range by a multiple of 60 which will 
-bring it closest to the median.  Finally, we overwrite current data with corrected data restricted to 
-Date, Day, Carrier, Origin, Destination, SchDep, SchArr, and SchTime."""
+bring it closest to the median.  Quartiles come from the month in memory, or, to clean months too 
+large for that, from mergeable per-route sketches (clean.quantiles) read in a first streaming pass.  
+Finally, the corrected data restricted to Date, Day, Carrier, Origin, Destination, SchDep, SchArr, and 
+SchTime is written to the clean partition of the flight store."""
+
+from multiprocessing import Pool
 
 import pandas as pd
 import numpy as np
+from clean.quantiles import RouteQuantiles
+from store.flightstore import ROW_GROUP_SIZE, load_month, iter_month
+from store.runreport import add_counts
+from store.times import floatmod, timetomin, mintotime
 pd.options.mode.chained_assignment = None
 
-def fix_schdata(year, month):
-    flights = pd.read_csv('../data/%d_%d.csv' %(year, month), dtype={'Carrier':str})
-
-    #Eliminate rows with same Origin and Destination.
-    flights = flights[flights.OriginAirportId != flights.DestAirportId]
-
-    #Convert between hhmm and minutes after midnight.
-    mintotime = (lambda minutes: 100*(minutes//60) + minutes%60)
-    timetomin = (lambda t: 60*(t//100) + t%100)
+def _fix_schtime(schtime, scharr, schdep, rows):
+    """Where rows holds, change SchTime by the SCH error so that SchTime = SchArr - SchDep up to multiples 
+    of 60.  The error is added if it is under 30 minutes, or if subtracting would leave under an hour, and 
+    error - 60 is added otherwise."""
+    error = floatmod(scharr[rows] - schdep[rows] - schtime[rows], 60)
+    adderror = (error < 30) | (schtime[rows] + error < 60)
+    schtime[rows] += error - 60*(~adderror)
+
+
+def fix_flights(flights, counts=None):
+    """Repair SchDep, SchArr and SchTime of raw flight data and return the consistent rows.  Every hhmm 
+    column is converted to minutes once, and the repairs are applied in place to contiguous arrays.  
+    If a dict counts is given, the number of rows each rule repairs or drops is added to it."""
+    #Convert to float arrays of minutes after midnight.  (Copies, so the repairs do not touch flights.)
+    column = lambda name: np.array(flights[name].values, dtype=np.float64)
+    depdelay, arrdelay, actual, schtime = [column(x) for x in ['DepDelay', 'ArrDelay', 'ActualTime', 'SchTime']]
+    deptime, arrtime, schdep, scharr = [timetomin(column(x)) for x in ['DepTime', 'ArrTime', 'SchDep', 'SchArr']]
+    notnull = lambda *arrays: np.logical_and.reduce([~np.isnan(x) for x in arrays])
 
     #The following equations must hold.  We check for each type of error.
     #D. DepTime = SchDep + DepDelay
@@ -26,102 +43,200 @@ def fix_schdata(year, month):
     #ACT. ActualTime = SchTime + ArrDelay - DepDelay
     #TZ. ActualTime = ArrTime - DepTime, up to multiples of 60 minutes due to time zone.
     #SCH. SchTime = SchArr - SchDep, up to multiples of 60 minutes.
-    df = pd.DataFrame({})
-
-    #Indicator whether SchTime and ActualTime are invalid.  (If ActualTime is valid, so are DepTime, DepDelay, ArrTime, ArrDelay.)
-    df['SValid'] = flights.SchTime.notnull() & (flights.SchTime > 0)
-    df['AValid'] = flights.ActualTime.notnull() & (flights.ActualTime > 0)
-
-    #Check that variables in the equations above are valid.
-    dep_valid = flights.DepTime.notnull() & flights.DepDelay.notnull() & flights.SchDep.notnull()
-    arr_valid = flights.ArrTime.notnull() & flights.ArrDelay.notnull() & flights.SchArr.notnull()
-    act_valid = df['SValid'] & df['AValid'] & flights.ArrDelay.notnull() & flights.DepDelay.notnull()
-    tz_valid = df['AValid'] & flights.DepTime.notnull() & flights.ArrTime.notnull()
-    sch_valid = df['SValid'] & flights.SchArr.notnull() & flights.SchDep.notnull()
-
-    #Check if the equations fail.
-    df['D'] = ((timetomin(flights.DepTime) - flights.DepDelay - timetomin(flights.SchDep))%1440 != 0) & dep_valid
-    df['A'] = ((timetomin(flights.ArrTime) - flights.ArrDelay - timetomin(flights.SchArr))%1440 != 0) & arr_valid
-    df['ACT'] = ((flights.ActualTime - flights.ArrDelay + flights.DepDelay)%1440 != flights.SchTime) & act_valid
-    df['TZ'] = ((timetomin(flights.ArrTime) - timetomin(flights.DepTime) - flights.ActualTime)%60 != 0) & tz_valid
-    df['SCH'] = ((timetomin(flights.SchArr) - timetomin(flights.SchDep) - flights.SchTime)%60 != 0) & sch_valid
-		
+    with np.errstate(invalid='ignore'):
+        #Indicator whether SchTime and ActualTime are valid.  (If ActualTime is valid, so are DepTime, DepDelay, ArrTime, ArrDelay.)
+        svalid = schtime > 0
+        avalid = actual > 0
+
+        #Values implied by equations D, A and ACT.
+        depfix = deptime - depdelay
+        arrfix = arrtime - arrdelay
+        actfix = floatmod(actual - arrdelay + depdelay, 1440)
+
+        #Check if the equations fail, where the variables in them are valid.
+        D = (floatmod(depfix - schdep, 1440) != 0) & notnull(deptime, depdelay, schdep)
+        A = (floatmod(arrfix - scharr, 1440) != 0) & notnull(arrtime, arrdelay, scharr)
+        ACT = (actfix != schtime) & svalid & avalid & notnull(arrdelay, depdelay)
+        TZ = (floatmod(arrtime - deptime - actual, 60) != 0) & avalid & notnull(deptime, arrtime)
+        SCH = (floatmod(scharr - schdep - schtime, 60) != 0) & svalid & notnull(scharr, schdep)
+
+    repaired = {}
+
     #When SchDep is null, ACT and TZ hold, so we set SchDep = DepTime - DepDelay.
-    schdepnull = (flights.SchDep.isnull() & flights.DepTime.notnull() & flights.DepDelay.notnull())
-    flights.SchDep[schdepnull] = mintotime((timetomin(flights.DepTime[schdepnull]) - flights.DepDelay[schdepnull])%1440)
+    rows = np.isnan(schdep) & notnull(deptime, depdelay)
+    schdep[rows] = depfix[rows]
+    repaired['fill_schdep'] = rows
 
     #When SchArr is null, ACT and TZ hold, so we set SchArr = ArrTime - ArrDelay.
-    scharrnull = (flights.SchArr.isnull() & flights.ArrTime.notnull() & flights.ArrDelay.notnull())
-    flights.SchArr[scharrnull] = mintotime((timetomin(flights.DepTime[scharrnull]) - flights.DepDelay[scharrnull])%1440)
+    rows = np.isnan(scharr) & notnull(arrtime, arrdelay)
+    scharr[rows] = arrfix[rows]
+    repaired['fill_scharr'] = rows
 
     #If SchTime is invalid and ActualTime is invalid, we need SchDep & SchArr valid & time zone info (which we may tackle later).
 
     #If SchTime is invalid and ActualTime is valid, then D, A, TZ hold. We set SchDep, SchArr, and SchTime to appropriate values.
-    snulla = (~df.SValid) & df.AValid
-    flights.SchDep[snulla] = mintotime((timetomin(flights.DepTime[snulla]) - flights.DepDelay[snulla])%1440)
-    flights.SchArr[snulla] = mintotime((timetomin(flights.ArrTime[snulla]) - flights.ArrDelay[snulla])%1440)
-    flights.SchTime[snulla] = (flights.ActualTime[snulla] - flights.ArrDelay[snulla] + flights.DepDelay[snulla])%1440
+    rows = ~svalid & avalid
+    schdep[rows] = depfix[rows]
+    scharr[rows] = arrfix[rows]
+    schtime[rows] = actfix[rows]
+    repaired['from_actual'] = rows
 
     #If SchTime is valid, ActualTime is invalid, and SCH fails, then all other equations hold. We update SchTime.
-    sanull = df.SValid & (~df.AValid) & df.SCH
-    schtimeerror = (timetomin(flights.SchArr[sanull]) - timetomin(flights.SchDep[sanull]) - flights.SchTime[sanull])%60
-    adderror = (schtimeerror < 30 | (flights.SchTime[sanull] + schtimeerror < 60))
-    flights.SchTime[sanull] += schtimeerror - 60
-    if(len(adderror) > 0):
-        flights.SchTime[sanull & adderror] += 60
+    rows = svalid & ~avalid & SCH
+    _fix_schtime(schtime, scharr, schdep, rows)
+    repaired['fix_sch'] = rows
 
     #If SchTime and ActualTime are valid, then we update SchDep, SchArr, SchTime based on errors.
-    sa = df.SValid & df.AValid & df.SCH
-    flights.SchDep[(sa & df.D)] = mintotime((timetomin(flights.DepTime[(sa & df.D)]) - flights.DepDelay[(sa & df.D)])%1440)
-    flights.SchArr[(sa & df.A)] = mintotime((timetomin(flights.ArrTime[(sa & df.A)]) - flights.ArrDelay[(sa & df.A)])%1440)
-    flights.SchTime[(sa & df.ACT)] = (flights.ActualTime[(sa & df.ACT)] - flights.ArrDelay[(sa & df.ACT)] + flights.DepDelay[(sa & df.ACT)])%1440
+    sa = svalid & avalid & SCH
+    rows = sa & D
+    schdep[rows] = depfix[rows]
+    repaired['fix_d'] = rows
+    rows = sa & A
+    scharr[rows] = arrfix[rows]
+    repaired['fix_a'] = rows
+    rows = sa & ACT
+    schtime[rows] = actfix[rows]
+    repaired['fix_act'] = rows
 
     #When TZ and SCH fails, then D, A, ACT hold.  This suggests ActualTime and SchTime are incorrect.
-    schtimeerror = (timetomin(flights.SchArr[(sa & df.TZ)]) - timetomin(flights.SchDep[(sa & df.TZ)]) - flights.SchTime[(sa & df.TZ)])%60
-    adderror = (schtimeerror < 30 | (flights.SchTime[(sa & df.TZ)] + schtimeerror < 60))
-    flights.SchTime[(sa & df.TZ)] += schtimeerror - 60
-    if(adderror.sum() > 0):
-        flights.SchTime[sa & adderror] += 60
-
-    #Update SchDepMin and SchArrMin.
-    df['SValid'] = flights.SchTime.notnull() & (flights.SchTime > 0)
-    sch_valid = df['SValid'] & flights.SchArr.notnull() & flights.SchDep.notnull()
-    df['SCH'] = ((timetomin(flights.SchArr) - timetomin(flights.SchDep) - flights.SchTime)%60 == 0) & sch_valid
+    rows = sa & TZ
+    _fix_schtime(schtime, scharr, schdep, rows)
+    repaired['fix_tz'] = rows
 
     #Keep entries where SchArr, SchDep, SchTime are all valid, and equation SCH holds.
-    flights = flights[df.SCH]
+    #Eliminate rows with same Origin and Destination.
+    with np.errstate(invalid='ignore'):
+        hasschtime = schtime > 0
+        consistent = floatmod(scharr - schdep - schtime, 60) == 0
+    hastimes = notnull(scharr, schdep)
+    distinct = flights.OriginAirportId.values != flights.DestAirportId.values
+    keep = hasschtime & hastimes & consistent & distinct
+
+    if counts is not None:
+        #Rows dropped are counted under the first check they fail.
+        dropped = {
+            'drop_same_origin_dest':~distinct, 
+            'drop_no_schtime':distinct & ~hasschtime, 
+            'drop_no_schdep_scharr':distinct & hasschtime & ~hastimes, 
+            'drop_inconsistent':distinct & hasschtime & hastimes & ~consistent}
+        stats = dict((name, int(rows.sum())) for name, rows in repaired.items() + dropped.items())
+        stats.update({'rows_in':len(flights), 'rows_out':int(keep.sum())})
+        add_counts(counts, stats)
+
+    flights = flights[keep]
     newflights = pd.DataFrame({
-        'Carrier':flights.Carrier, 
-        'Day':flights.Day, 
-        'Date':flights.Date, 
-        'OriginAirportId':flights.OriginAirportId, 
-        'DestAirportId':flights.DestAirportId, 
-        'SchDep':flights.SchDep, 
-        'SchArr':flights.SchArr, 
-        'SchTime':flights.SchTime})
-
-    newflights.reset_index(drop=True)
+        'Carrier':flights.Carrier.values, 
+        'Day':flights.Day.values, 
+        'Date':flights.Date.values, 
+        'OriginAirportId':flights.OriginAirportId.values, 
+        'DestAirportId':flights.DestAirportId.values, 
+        'SchDep':mintotime(schdep[keep]).astype(np.int16), 
+        'SchArr':mintotime(scharr[keep]).astype(np.int16), 
+        'SchTime':schtime[keep].astype(np.int16)}, 
+        columns=['Carrier', 'Day', 'Date', 'OriginAirportId', 'DestAirportId', 'SchDep', 'SchArr', 'SchTime'])
     return newflights
 
 
-def adjust_schtime(df):
+def fix_schdata(year, month, chunksize=None, counts=None):
+    """Repair a month of raw flight data, loaded in compact form.  With chunksize, the month is read and 
+    repaired in chunks of about that many rows, so peak memory stays near the size of the output.  Counts of rows repaired 
+    and dropped by each rule are added to the dict counts, if given."""
+    if chunksize is None:
+        return fix_flights(load_month(year, month, kind='raw', compact=True), counts)
+    chunks = [fix_flights(chunk, counts) for chunk in iter_month(year, month, kind='raw', chunksize=chunksize, 
+        compact=True)]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def route_quartiles(origin, dest, schtime):
+    """Median, 1st and 3rd quartile of schtime for each (origin, dest) route, returned as arrays aligned 
+    with the input rows.  Values are sorted within routes once, and every statistic is read off the 
+    sorted array by position, interpolating linearly as pandas quantile does.  If there are < 20 flights 
+    on a route, both quartiles are the median."""
+    route = pd.factorize(origin.astype(np.int64)*10**7 + dest)[0]
+    order = np.lexsort((schtime, route))
+    values = schtime[order].astype(np.float64)
+
+    #Routes are numbered 0, 1, ..., so route i occupies values[starts[i]:starts[i] + counts[i]].
+    counts = np.bincount(route)
+    starts = np.cumsum(counts) - counts
+
+    def quantile(q):
+        position = starts + q*(counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts + counts - 1)
+        return values[lower] + (position - lower)*(values[upper] - values[lower])
+
+    median = quantile(0.5)
+    small = counts < 20
+    firstquartile = np.where(small, median, quantile(0.25))
+    thirdquartile = np.where(small, median, quantile(0.75))
+    return median[route], firstquartile[route], thirdquartile[route]
+
+
+def adjust_schtime(df, sketch=None):
     #Input: data frame with Origin, Dest, and SchTime columns.
     #We adjust SchTime outliers by multiples of 60 minutes.
 
-    #Output 1st and 3rd quartile. If there is < 20 flights that month, we output median.
-    #This indicates we adjust all SchTime.
-    firstquartile = lambda A: np.median(A) if len(A) < 20 else A.quantile(0.25)
-    thirdquartile = lambda A: np.median(A) if len(A) < 20 else A.quantile(0.75)
-
-    #Calculate median and quartiles of SchTime with given Origin/Dest.
-    df['Median'] = df.groupby(['OriginAirportId', 'DestAirportId']).SchTime.transform(np.median)
-    df['Q1'] = df.groupby(['OriginAirportId', 'DestAirportId']).SchTime.transform(firstquartile)
-    df['Q3'] = df.groupby(['OriginAirportId', 'DestAirportId']).SchTime.transform(thirdquartile)
-    df['IQR'] = map(lambda x: min(x, 30), df.Q3 - df.Q1)
+    #Calculate median and quartiles of SchTime with given Origin/Dest, from df itself or, if given, from 
+    #a RouteQuantiles sketch of the whole month (or of several months).
+    #If there is < 20 flights that month, the quartiles are the median.  This indicates we adjust all SchTime.
+    schtime = df.SchTime.values.astype(np.float64)
+    if sketch is None:
+        median, firstquartile, thirdquartile = route_quartiles(df.OriginAirportId.values, 
+            df.DestAirportId.values, schtime)
+    else:
+        median, firstquartile, thirdquartile = sketch.quartiles(df.OriginAirportId.values, 
+            df.DestAirportId.values)
+    iqr = np.minimum(thirdquartile - firstquartile, 30)
+
+    #Detect and adjust outliers.  Routes missing from a sketch are left as they are.
+    with np.errstate(invalid='ignore'):
+        outlier = (schtime <= firstquartile - iqr) | (schtime >= thirdquartile + iqr)
+    schtime[outlier] += 60 * np.round((median[outlier] - schtime[outlier])/60.)
+    df['SchTime'] = schtime.astype(df.SchTime.dtype)
+    return df
 
-    #Detect and adjust outliers.
-    outlier = (df.SchTime <= df.Q1 - df.IQR) | (df.SchTime >= df.Q3 + df.IQR)
-    df.SchTime[outlier] += 60 * np.round((df.Median[outlier] - df.SchTime[outlier])/60.)
 
-    df.drop(['Median', 'Q1', 'Q3', 'IQR'], axis=1, inplace=True)
-    return df
+def month_sketch(yearmonth, chunksize=4*ROW_GROUP_SIZE, resolution=1):
+    """RouteQuantiles sketch of the repaired SchTime of a raw month, given (year, month), read and 
+    repaired in chunks of about chunksize rows."""
+    year, month = yearmonth
+    sketch = RouteQuantiles(resolution)
+    for chunk in iter_month(year, month, kind='raw', chunksize=chunksize):
+        chunk = fix_flights(chunk)
+        sketch.add(chunk.OriginAirportId.values, chunk.DestAirportId.values, chunk.SchTime.values)
+    return sketch
+
+
+def window_sketch(monthlist, chunksize=4*ROW_GROUP_SIZE, resolution=1, workers=1):
+    """Merged sketch of the months of monthlist, each sketched by one of a pool of workers."""
+    sketch = RouteQuantiles(resolution)
+    jobs = [(yearmonth, chunksize, resolution) for yearmonth in monthlist]
+    if workers > 1 and len(jobs) > 1:
+        pool = Pool(workers)
+        try:
+            for other in pool.imap_unordered(_month_sketch, jobs):
+                sketch.merge(other)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            sketch.merge(_month_sketch(job))
+    return sketch
+
+
+def _month_sketch(job):
+    return month_sketch(*job)
+
+
+def stream_clean(year, month, chunksize=4*ROW_GROUP_SIZE, sketch=None, counts=None):
+    """Generate the repaired and adjusted flights of a raw month in chunks of about chunksize rows, without 
+    holding the month in memory.  Outliers are detected with the route quartiles of sketch, by default 
+    the month's own month_sketch, read in a first pass; a sketch of several months detects them against 
+    cross-month route statistics instead.  Counts of rows repaired and dropped are added to counts."""
+    if sketch is None:
+        sketch = month_sketch((year, month), chunksize)
+    for chunk in iter_month(year, month, kind='raw', chunksize=chunksize, compact=True):
+        yield adjust_schtime(fix_flights(chunk, counts), sketch)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Mergeable per-route quantile sketches of SchTime, so the outlier adjustment of adjust_schtime can
+stream a month (or several) in chunks instead of sorting it in memory.  SchTime is a whole number of
+minutes, so a sketch is a sparse histogram of the count of each (route, minute bin): its size depends on
+the number of routes and distinct flight times, not on the number of flights, and sketches of chunks,
+months or workers merge by adding counts.  With a resolution of 1 minute (the default) quantiles are
+exact, equal to those of route_quartiles; with bins of resolution minutes each quantile is within
+(resolution - 1)/2 minutes of the exact one."""
+
+import numpy as np
+
+OFFSET = 1 << 15  #SchTime is int16, so SchTime + OFFSET is in [0, 2**16).
+BITS = 16
+
+
+def route_key(origin, dest):
+    return np.asarray(origin, dtype=np.int64)*10**7 + np.asarray(dest, dtype=np.int64)
+
+
+class RouteQuantiles(object):
+    """Counts of SchTime in bins of resolution minutes for each (origin, dest) route, kept as sorted
+    int64 keys (route key << 16 | bin) and their counts."""
+
+    def __init__(self, resolution=1):
+        self.resolution = resolution
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def flights(self):
+        return int(self.counts.sum())
+
+    def _merge(self, keys, counts):
+        keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts])).astype(np.int64)
+        self.keys = keys
+
+    def add(self, origin, dest, schtime):
+        """Count flights with the given origin, dest and SchTime arrays.  NaN SchTimes are skipped."""
+        schtime = np.asarray(schtime, dtype=np.float64)
+        rows = ~np.isnan(schtime)
+        bins = ((np.clip(schtime[rows], -OFFSET, OFFSET - 1) + OFFSET)//self.resolution).astype(np.int64)
+        keys, counts = np.unique((route_key(origin, dest)[rows] << BITS) | bins, return_counts=True)
+        self._merge(keys, counts)
+        return self
+
+    def merge(self, *others):
+        """Add the counts of other sketches of the same resolution into this one."""
+        for other in others:
+            if other.resolution != self.resolution:
+                raise ValueError('Cannot merge sketches of resolution %d and %d' %(self.resolution, other.resolution))
+            self._merge(other.keys, other.counts)
+        return self
+
+    def route_stats(self, small=20):
+        """Routes (sorted keys), their number of flights, and the median, 1st and 3rd quartile of SchTime
+        on each, interpolated between order statistics as pandas quantile does.  If there are < small
+        flights on a route, both quartiles are the median."""
+        routes, starts = np.unique(self.keys >> BITS, return_index=True)
+        if not len(routes):
+            empty = np.zeros(0)
+            return routes, np.zeros(0, dtype=np.int64), empty, empty, empty
+        flights = np.add.reduceat(self.counts, starts)
+        cumulative = np.cumsum(self.counts)
+        before = cumulative[starts] - self.counts[starts]
+        values = (self.keys & ((1 << BITS) - 1))*self.resolution - OFFSET + (self.resolution - 1)/2.
+
+        def value(rank):
+            return values[np.searchsorted(cumulative, before + rank, side='right')]
+
+        def quantile(q):
+            position = q*(flights - 1)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, flights - 1)
+            low = value(lower)
+            return low + (position - lower)*(value(upper) - low)
+
+        median = quantile(0.5)
+        few = flights < small
+        return (routes, flights, median, np.where(few, median, quantile(0.25)),
+            np.where(few, median, quantile(0.75)))
+
+    def quartiles(self, origin, dest):
+        """Median, 1st and 3rd quartile of the route of each flight, as arrays aligned with origin and
+        dest; NaN for routes not in the sketch."""
+        routes, flights, median, firstquartile, thirdquartile = self.route_stats()
+        key = route_key(origin, dest)
+        ids = np.minimum(np.searchsorted(routes, key), max(len(routes) - 1, 0))
+        found = routes[ids] == key if len(routes) else np.zeros(len(key), dtype=bool)
+
+        def aligned(stat):
+            return np.where(found, stat[ids], np.nan) if len(routes) else np.full(len(key), np.nan)
+        return aligned(median), aligned(firstquartile), aligned(thirdquartile)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Download files over HTTP without shelling out.  Partial downloads are kept as 'file.part' and 
+resumed with HTTP range requests, failed attempts are retried with exponential backoff, and a 
+file is only moved into place after its size and integrity check pass.  fetch_many downloads 
+several files at once with a bounded pool of threads."""
+
+import httplib
+import os
+import random
+import socket
+import time
+import urllib2
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+RETRIES = 5
+BACKOFF = 1.0  #Seconds before the first retry; doubled for each further retry.
+TIMEOUT = 60
+BLOCKSIZE = 1 << 20
+
+#HTTP status codes that are worth retrying.  Other client errors (e.g. 404) fail immediately.
+RETRY_CODES = set([408, 416, 429, 500, 502, 503, 504])
+
+
+class FetchError(IOError):
+    """A file could not be downloaded after all retries."""
+
+
+class IntegrityError(IOError):
+    """A downloaded file is complete but fails its integrity check."""
+
+
+def verify_zip(path):
+    """Check that a zip file is readable and the CRC of every member is correct."""
+    if not zipfile.is_zipfile(path):
+        raise IntegrityError('%s is not a zip file' %path)
+    with zipfile.ZipFile(path) as zf:
+        bad = zf.testzip()
+    if bad is not None:
+        raise IntegrityError('%s: bad CRC for %s' %(path, bad))
+
+
+def _fetch_once(url, part, timeout):
+    """Download url into part, resuming from its current size.  Raises IOError if incomplete."""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    request = urllib2.Request(url)
+    if offset:
+        request.add_header('Range', 'bytes=%d-' %offset)
+
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as e:
+        if e.code == 416:
+            os.remove(part)  #Range past the end of the file: start over.
+        raise
+
+    #The server may ignore the range and send the whole file.
+    if offset and response.getcode() != 206:
+        offset = 0
+    length = response.info().getheader('Content-Length')
+    total = offset + int(length) if length is not None else None
+
+    with open(part, 'ab' if offset else 'wb') as f:
+        for block in iter(lambda: response.read(BLOCKSIZE), b''):
+            f.write(block)
+
+    size = os.path.getsize(part)
+    if total is not None and size != total:
+        raise IOError('received %d of %d bytes' %(size, total))
+
+
+def fetch(url, path, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT, verify=None):
+    """Download url to path, unless path already exists.  verify(path) raises IntegrityError for a 
+    corrupt download, which is then discarded and downloaded again.  Returns path."""
+    if os.path.exists(path):
+        return path
+    if not os.path.isdir(os.path.dirname(path) or '.'):
+        os.makedirs(os.path.dirname(path))
+
+    part = path + '.part'
+    for attempt in range(retries + 1):
+        try:
+            _fetch_once(url, part, timeout)
+            if verify is not None:
+                verify(part)
+            os.rename(part, path)
+            return path
+        except urllib2.HTTPError as e:
+            error = e
+            if e.code not in RETRY_CODES:
+                break
+        except IntegrityError as e:
+            error = e
+            os.remove(part)
+        except (IOError, socket.error, httplib.HTTPException) as e:
+            error = e
+
+        if attempt < retries:
+            time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+    raise FetchError('%s: %s' %(url, error))
+
+
+def fetch_many(jobs, workers=4, **kwargs):
+    """Download each (url, path) in jobs, with at most workers downloads at a time.  Keyword 
+    arguments are passed to fetch.  Raises FetchError listing every failure once all jobs finish."""
+    def fetch_job(job):
+        try:
+            return fetch(job[0], job[1], **kwargs), None
+        except FetchError as e:
+            return None, e
+
+    pool = ThreadPool(max(1, min(workers, len(jobs))))
+    try:
+        results = pool.map(fetch_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    errors = [str(error) for path, error in results if error is not None]
+    if errors:
+        raise FetchError('%d of %d downloads failed:\n%s' %(len(errors), len(jobs), '\n'.join(errors)))
+    return [path for path, error in results]
@@ -1,86 +1,113 @@
 #!/usr/bin/env python
 """From flight data, gather info about distance between airports and check for consistency.  Then 
-write to distance.csv"""
+write to distance.csv.  Each month is reduced to counts of (Origin, Dest, Distance), cached in the 
+'distfreq' partition of the flight store, and the monthly counts are summed in one step.  Adding a 
+month only costs counting that month, and months can be counted in parallel."""
 
-from sets import Set
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
+from store.flightstore import months, load_month, write_month, is_current
 pd.options.mode.chained_assignment = None #Suppress overwrite error.
 
-def get_distancefreq():
-    #Empty dataframe to accumulate frequency, based on Origin, Dest, and Distance.
-    freqdf=pd.DataFrame({
-        'OriginAirportId':[], 
-        'DestAirportId':[], 
-        'Distance':[], 
-        'Freq':[]})
-    freqdf.set_index(['OriginAirportId', 'DestAirportId', 'Distance'], inplace=True)
-
-    for year in range(1987, 2016):
-        if(year == 1987):
-            startmonth = 10
-        else:
-            startmonth = 1
-        for month in range(startmonth, 13):
-            flightfile='../data/%d_%d.csv' %(year, month)
-            df = pd.read_csv(flightfile)[['OriginAirportId', 'DestAirportId', 'Distance']]
-
-            #Create a freq column and calculate frequency for a given month.
-            df['Freq'] = np.nan
-            df['Freq'] = df.groupby(['OriginAirportId', 'DestAirportId', 'Distance']).transform(len)
-            df.drop_duplicates(inplace=True)
-            df.set_index(['OriginAirportId', 'DestAirportId', 'Distance'], inplace=True)
-
-            #Align rows by index, and sum frequencies.
-            freqdf, df = freqdf.align(df, fill_value=0)
-            freqdf += df
-
+def count_routes(origin, dest, distance):
+    """Count occurrences of each (origin, dest, distance).  Each column is encoded as integer codes, 
+    which are combined into one integer key and counted with bincount, or a sort if the key space is 
+    large compared to the number of rows.  Rows with a missing value are ignored."""
+    codes, uniques = zip(*[pd.factorize(col, sort=True) for col in [origin, dest, distance]])
+    valid = (codes[0] >= 0) & (codes[1] >= 0) & (codes[2] >= 0)
+    sizes = [len(x) for x in uniques]
+    key = (codes[0][valid].astype(np.int64)*sizes[1] + codes[1][valid])*sizes[2] + codes[2][valid]
+
+    if sizes[0]*sizes[1]*sizes[2] <= max(4*len(key), 1 << 20):
+        freq = np.bincount(key, minlength=sizes[0]*sizes[1]*sizes[2])
+        key = np.flatnonzero(freq)
+        freq = freq[key]
+    else:
+        key, freq = np.unique(key, return_counts=True)
+
+    return pd.DataFrame({
+        'OriginAirportId':uniques[0][key//(sizes[1]*sizes[2])], 
+        'DestAirportId':uniques[1][(key//sizes[2])%sizes[1]], 
+        'Distance':uniques[2][key%sizes[2]], 
+        'Freq':freq}, columns=['OriginAirportId', 'DestAirportId', 'Distance', 'Freq'])
+
+
+def month_distfreq(yearmonth):
+    """Distance counts for one (year, month), recomputed only if the raw month is newer than the cache."""
+    year, month = yearmonth
+    if is_current('distfreq', year, month, 'raw'):
+        return load_month(year, month, kind='distfreq')
+
+    df = load_month(year, month, columns=['OriginAirportId', 'DestAirportId', 'Distance'], kind='raw')
+    freq = count_routes(df.OriginAirportId.values, df.DestAirportId.values, df.Distance.values)
+    write_month('distfreq', year, month, freq)
+    return freq
+
+
+def get_distancefreq(monthlist=None, workers=1):
+    #Count each month, in a pool of workers if workers > 1.
+    monthlist = monthlist or months()
+    if workers > 1:
+        pool = Pool(workers)
+        try:
+            partials = pool.map(month_distfreq, monthlist)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        partials = [month_distfreq(yearmonth) for yearmonth in monthlist]
+
+    #Sum frequencies based on Origin, Dest, and Distance over all months.
+    freqdf = pd.concat(partials, ignore_index=True)
+    freqdf = freqdf.groupby(['OriginAirportId', 'DestAirportId', 'Distance']).Freq.sum().to_frame()
     return freqdf.reset_index(level=2)
 
 
 def checkdistance(distdf):
-    #Input dataframe has index=Origin, Dest; columns = Distance, Freq.
-    #Freq = frequency of each distance given origin, dest.
-    flights = list(distdf.index.unique())
-    roundtrips = [x for x in flights if (x[1], x[0]) in flights and x[0] < x[1]]
-
-    #Check, store, and print various errors.
-    print "Same Origin and Dest Airports:"
-    same_origindest = [x[0] for x in flights if x[0] == x[1]]
-    print same_origindest
-
-    print "Multiple Distance Errors:"
-    multipledist = [(x[0], x[1]) for x in flights if distdf.Distance[x[0], x[1]].size > 1]
-    for x in multipledist:
-        print "Flight: ", x
-        print "Distances: ", list(distdf.Distance[x])
-        print "Frequency: ",  list(distdf.Freq[x])
-
-    print "Round Trip Errors:"
-    roundtriperrors = [x for x in roundtrips if 
-        (True if distdf.Distance[x].size != distdf.Distance[x[1], x[0]].size
-        else (distdf.Distance[x] != distdf.Distance[x[1], x[0]]) 
-            if (distdf.Distance[x].size == 1)
-        else (Set(distdf.Distance[x]) != Set(distdf.Distance[x[1], x[0]])))]
-
-    for x in roundtriperrors:
-        print "Flight: ", x
-        print "Distance to: ", list(distdf.Distance[x])
-        print "Distance back: ", list(distdf.Distance[x[1], x[0]])
+    """Check distance counts for errors.  Input dataframe has index=Origin, Dest; columns = Distance, Freq.
+    Freq = frequency of each distance given origin, dest.  Returns three dataframes:
+        same_origindest: routes whose origin and destination airport are the same.
+        multipledist: routes with more than one distance, one row per distance.
+        roundtriperrors: round trips (Origin < Dest) whose set of distances differs in each direction, 
+            one row per distance, with Freq counted on the route and Return on the route back.  
+            A distance only seen in one direction has NaN in the other."""
+    df = distdf.reset_index()
+    keys = ['OriginAirportId', 'DestAirportId']
+
+    same_origindest = df[df.OriginAirportId == df.DestAirportId].reset_index(drop=True)
+
+    numdist = df.groupby(keys).Distance.transform('size')
+    multipledist = df[numdist > 1].reset_index(drop=True)
+
+    #Line up each distance with the same distance on the route back.
+    back = df.rename(columns={'OriginAirportId':'DestAirportId', 'DestAirportId':'OriginAirportId', 
+        'Freq':'Return'})
+    trips = df.merge(back, on=keys + ['Distance'], how='outer')
+    trips = trips[trips.OriginAirportId < trips.DestAirportId]
+
+    #A round trip has distances in both directions.  It is an error if some distance is only in one.
+    seen = pd.DataFrame({'To':trips.Freq.notnull(), 'Back':trips.Return.notnull()})
+    seen['Both'] = seen.To & seen.Back
+    seen = seen.astype(int).groupby([trips.OriginAirportId, trips.DestAirportId]).transform('sum')
+    error = (seen.To > 0) & (seen.Back > 0) & ((seen.Both < seen.To) | (seen.Both < seen.Back))
+    roundtriperrors = trips[error.values].sort_values(keys + ['Distance']).reset_index(drop=True)
 
     return [same_origindest, multipledist, roundtriperrors]
 
 
-def getdistance():
+def getdistance(monthlist=None, workers=1):
     #Get distance info from flight data and check for errors.
-    distfreq_df = get_distancefreq()
+    distfreq_df = get_distancefreq(monthlist, workers)
     errors = checkdistance(distfreq_df)
+    for name, error in zip(['Same Origin and Dest', 'Multiple Distance', 'Round Trip'], errors):
+        print "%s Errors: %d rows" %(name, len(error))
 
     #Remove same origin/dest flights.
-    distfreq_df.drop([(x,x) for x in errors[0]], inplace=True)
+    distfreq_df.reset_index(inplace=True)
+    distfreq_df = distfreq_df[distfreq_df.OriginAirportId != distfreq_df.DestAirportId]
 
     #Choose distance which occurs more than half the time.
-    distfreq_df.reset_index(inplace=True)
     distfreq_df['TotalFreq'] = distfreq_df.groupby(['OriginAirportId', 'DestAirportId']).Freq.transform(sum)
     distfreq_df = distfreq_df[distfreq_df.Freq/distfreq_df.TotalFreq > 0.5]
 
@@ -1,26 +1,71 @@
 #!/usr/bin/env python
 """Download Latitude/Longitude information and Flight time information from 
-the Bureau of Transportation Statistics website, using wget."""
+the Bureau of Transportation Statistics website.  Zip files are fetched into '../data/zip' with 
+retries and range resume, checked, and read in place.  Flight data is streamed from the zip in 
+chunks, reading only the columns we use, and written once to the raw partition of the flight store.  
+Set BTS_URL to download from another server, e.g. the local stand-in in benchmark/testserver.py."""
 
 import os
+import zipfile
 import pandas as pd
-import tempfile
 
-URL='http://tsdata.bts.gov/'
+from download.fetch import fetch, fetch_many, verify_zip
+from store.flightstore import DATA, DTYPES, ROW_GROUP_SIZE, MonthWriter, shared_dictionary
+
+URL=os.environ.get('BTS_URL', 'http://tsdata.bts.gov/')
 LATLONG='187806114_T_MASTER_CORD'
 FLIGHT='On_Time_On_Time_Performance'
+ZIPDIR=DATA + '/zip'
+CHUNKSIZE=4*ROW_GROUP_SIZE  #Rows per chunk read from a flight zip.
+
+#BTS column names of the flight data we keep, and our names for them.
+FLIGHT_COLUMNS = {
+    'DayOfWeek':'Day', 
+    'FlightDate':'Date', 
+    'UniqueCarrier':'Carrier', 
+    'OriginAirportSeqID':'OriginAirportId', 
+    'DestAirportSeqID':'DestAirportId', 
+    'CRSDepTime':'SchDep', 
+    'DepTime':'DepTime', 
+    'DepDelay':'DepDelay', 
+    'CRSArrTime':'SchArr', 
+    'ArrTime':'ArrTime', 
+    'ArrDelay':'ArrDelay', 
+    'CRSElapsedTime':'SchTime', 
+    'ActualElapsedTime':'ActualTime', 
+    'Distance':'Distance'}
+
+def flight_url(year, month):
+    return URL + 'PREZIP/' + FLIGHT + '_%d_%d.zip' %(year, month)
+
+
+def flight_zip(year, month):
+    return ZIPDIR + '/' + FLIGHT + '_%d_%d.zip' %(year, month)
+
+
+def open_member(zf, name):
+    """Open the csv file name in a zip file, or its only csv file if there is no such member."""
+    names = zf.namelist()
+    if name not in names:
+        name = [x for x in names if x.lower().endswith('.csv')][0]
+    return zf.open(name)
+
+
+def fetch_flights(monthlist, workers=4):
+    """Download the zip files for a list of (year, month), at most workers at a time."""
+    jobs = [(flight_url(year, month), flight_zip(year, month)) for year, month in monthlist]
+    return fetch_many(jobs, workers, verify=verify_zip)
+
 
 def get_latlong():
-    newlatlongfile='../data/LatLong.csv'
+    newlatlongfile=DATA + '/LatLong.csv'
 
-    #Download LatLong.csv
-    os.system('wget ' + URL + LATLONG + '.zip')
-    os.system('unzip ' + LATLONG + '.zip')
-    os.system('rm ' + LATLONG + '.zip')
-    os.system('mv ' + LATLONG + '.csv ' + newlatlongfile)
+    #Download the LatLong zip.
+    zippath = fetch(URL + LATLONG + '.zip', ZIPDIR + '/' + LATLONG + '.zip', verify=verify_zip)
 
     #Read LatLong.csv, select and write columns.
-    df = pd.read_csv(newlatlongfile)
+    with zipfile.ZipFile(zippath) as zf:
+        df = pd.read_csv(open_member(zf, LATLONG + '.csv'))
     latlong = pd.DataFrame({
         'AirportId':df.AIRPORT_SEQ_ID, 
         'AirportName':df.DISPLAY_AIRPORT_NAME, 
@@ -29,37 +74,25 @@ def get_latlong():
 
     latlong.dropna(inplace=True)
     latlong.to_csv(newlatlongfile, index=False)
+    os.remove(zippath)
 
 
 def get_flights(year, month):
     flightfile=FLIGHT + '_%d_%d' %(year, month)
-    flighturl=URL + 'PREZIP/' + flightfile + '.zip'
-    newflightfile='../data/%d_%d.csv' %(year, month)
-
-    #Download flight data as year_month.csv
-    os.system('wget ' + flighturl)
-    tempdir = tempfile.mkdtemp()  #Create temporary directory to place unzipped file.
-    os.system('unzip ' + flightfile + ' -d ' + tempdir)
-    os.system('rm ' + flightfile + '.zip')
-    os.system('mv ' + tempdir + '/' + flightfile + '.csv ' + newflightfile)
-    os.system('rm ' + tempdir + '/*')
-    os.removedirs(tempdir)
 
-    #Read LatLong.csv, select and write columns.
-    df=pd.read_csv(newflightfile, dtype={'UniqueCarrier':str})
-    flightdf=pd.DataFrame({
-        'Day':df.DayOfWeek, 
-        'Date':df.FlightDate, 
-        'Carrier':df.UniqueCarrier, 
-        'OriginAirportId':df.OriginAirportSeqID, 
-        'DestAirportId':df.DestAirportSeqID, 
-        'SchDep':df.CRSDepTime, 
-        'DepTime':df.DepTime, 
-        'DepDelay':df.DepDelay, 
-        'SchArr':df.CRSArrTime, 
-        'ArrTime':df.ArrTime, 
-        'ArrDelay':df.ArrDelay, 
-        'SchTime':df.CRSElapsedTime, 
-        'ActualTime':df.ActualElapsedTime, 
-        'Distance':df.Distance})
-    flightdf.to_csv(newflightfile, index=False)
+    #Download flight data, unless fetch_flights already has.
+    zippath = fetch(flight_url(year, month), flight_zip(year, month), verify=verify_zip)
+
+    #Read the columns we keep straight from the zip, in chunks with compact types, and write them to the store.
+    #Ids are read as floats, since they may be missing; the store drops those rows and converts the rest.
+    dtypes = dict((bts, DTYPES['raw'][col]) for bts, col in FLIGHT_COLUMNS.items() 
+        if col not in ['OriginAirportId', 'DestAirportId'])
+    dtypes.update({'UniqueCarrier':str, 'FlightDate':str})
+    with zipfile.ZipFile(zippath) as zf, MonthWriter('raw', year, month) as writer:
+        chunks = pd.read_csv(open_member(zf, flightfile + '.csv'), usecols=list(FLIGHT_COLUMNS), 
+            dtype=dtypes, chunksize=CHUNKSIZE)
+        for chunk in chunks:
+            shared_dictionary('Carrier', chunk.UniqueCarrier.unique())  #New carriers get their codes here.
+            writer.write(chunk.rename(columns=FLIGHT_COLUMNS))
+    os.remove(zippath)
+    return writer.path
@@ -2,42 +2,99 @@
 """Plot scheduled flight times for AA flights between JFK and LAX.
 For a given year and month, visualize dist vs sch time, run a regression, 
 and look at error.  Filter based on whether the destination is in the Pacific, 
-and study the regression and error for each group."""
+and study the regression and error for each group.  Each stage is timed and measured, and a report of 
+the run is saved in '../data/runs'.  The month's flights and fits are loaded once into the analysis 
+session (analysis.session), whose memory is bounded by --cache-mb."""
 
+import argparse
 import os
 import sys
 
-from analysis.filter import get_jetstream, get_pacific
+from analysis.anomalies import build_anomalies
+from analysis.coefficients import build_coefficients
 from analysis.plot import plot_schtime, plot_regression, plot_error, plot_regression_coef
-from analysis.regression import regression
+from analysis.regression import fit_groups, stream_fit_groups
+from analysis.session import get_session
+from store.flightstore import months
+from store.runreport import RunReport, set_profile
 
-def main():
+def analyze(args, report):
+    """Run the analysis and plots, adding measurements to report."""
     year = 2015
     month = 1
 
     os.system('mkdir -p graphs')  #Create directory to place graphs, if it doesn't exist.
 
-    plot_schtime(12478, 12892, 'AA') #Plot sch flight time from JFK to LAX
-    plot_schtime(12892, 12478, 'AA') #Plot sch flight time from LAX to JFK
+    with report.measure('plot', 'schtime_AA_12478_12892'):
+        plot_schtime(12478, 12892, 'AA') #Plot sch flight time from JFK to LAX
+    with report.measure('plot', 'schtime_AA_12892_12478'):
+        plot_schtime(12892, 12478, 'AA') #Plot sch flight time from LAX to JFK
 
-    flights = get_jetstream(year, month)  #Get flight info.
+    #Get flight info, with whether the destination is in the Pacific.
+    session = get_session()
+    with report.measure('enrich', '%d_%d' %(year, month)) as record:
+        flights = session.flights(year, month)
+        record['rows_out'] = len(flights)
 
-    #Get info whether destination is in the Pacific and filter.
-    df_pac = get_pacific(flights)
-    overseas = df_pac[df_pac.DestOverseas]
-    not_overseas = df_pac[~df_pac.DestOverseas]
+    analysislist = [[None, 'Regression Error'], 
+        ['Pacific', 'Pacific Regression Error'], 
+        ['US', 'US Regression Error']]
 
-    analysislist = [[flights, 'Regression Error'], 
-        [overseas, 'Pacific Regression Error'], 
-        [not_overseas, 'US Regression Error']]
+    #Fit all flights, and Pacific and US flights in one pass.
+    with report.measure('fit', 'Region', len(flights)):
+        print session.fit(year, month)
+        print fit_groups(flights, 'Region').to_string(index=False)
 
-    #Plot dist vs sch time, regression, and error for filtered flight data.
-    for i, [df, title] in enumerate(analysislist):
-        plot_regression(year, month, df)
-        print regression(year, month, df)
-        plot_error(year, month, df, title)
+    #Plot dist vs sch time, regression, and error for filtered flight data, fitted once each.
+    for region, title in analysislist:
+        df = session.flights(year, month, region)
+        params = session.fit(year, month, region)[0]
+        with report.measure('plot', 'regression_' + title, len(df)):
+            plot_regression(year, month, df, params=params)
+        with report.measure('plot', 'error_' + title, len(df)):
+            plot_error(year, month, df, title, params=params)
 
-    plot_regression_coef()    #Plot monthly US and Pacific regression coefficients over time.
+    #Fit each carrier over the year.
+    with report.measure('fit', 'Carrier_%d' %year) as record:
+        carriers = stream_fit_groups('Carrier', months((year, 1), (year, 12)))
+        record['rows_in'] = int(carriers.Flights.sum())
+    print carriers.to_string(index=False)
+
+    #Plot monthly US and Pacific regression coefficients over time, from the table of monthly fits.
+    with report.measure('fit', 'coefficients') as record:
+        record['rows_out'] = len(build_coefficients(workers=args.workers))
+    with report.measure('plot', 'regression_coef'):
+        plot_regression_coef(args.workers)
+
+    #Rank routes by their mean error over every month, and list the worst flights of the first ones.
+    with report.measure('report', 'anomalies') as record:
+        ranked, worst = build_anomalies(workers=args.workers)
+        record['rows_out'] = len(ranked)
+    print ranked.head(20).to_string(index=False)
+
+    stats = session.cache.stats()
+    print 'Session cache: %d hits, %d misses, %d evictions, %d items in %.1f of %.0f MB' %(stats['hits'], 
+        stats['misses'], stats['evictions'], stats['items'], stats['nbytes']/2.**20, stats['budget']/2.**20)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--cache-mb', type=int, default=None, 
+        help='memory budget of the analysis session in MB (default: FLIGHTMODEL_CACHE_MB or 1024)')
+    parser.add_argument('--report', default=None, help='path of the json run report')
+    parser.add_argument('--profile', default=None, help='directory for a cProfile dump of each stage')
+    args = parser.parse_args(argv)
+
+    if args.cache_mb is not None:
+        get_session().set_budget(args.cache_mb << 20)
+    report = RunReport('AnalysisDriver', args.report)
+    set_profile(args.profile)
+    try:
+        analyze(args, report)
+    finally:
+        print 'Run report:', report.save()
+        report.print_summary()
 
 
 if __name__ == '__main__':
@@ -1,39 +1,146 @@
 #!/usr/bin/env python
 """Download and clean data from Bureau of Transportation Statistics.  Place files 
-in the data folder."""
+in the data folder.  Zip files are downloaded several at a time, and months are read and cleaned 
+across a pool of worker processes.  Each downloaded month, distance partial, distance.csv and cleaned 
+month is a target of a dependency graph recorded in '../data/manifest.json', so an interrupted run 
+resumes where it stopped, and only targets whose inputs changed are built again: publishing a new month 
+(--last) downloads and cleans that month and sums the distance partials again.  Every stage of every 
+month is timed and measured, and a report of the run is saved in '../data/runs'."""
 
+import argparse
 import os
 import sys
 
-from download.get_files import get_latlong, get_flights
-from download.get_dist_from_files import getdistance
-from clean.cleandata import fix_schdata, adjust_schtime
+from download.get_files import get_latlong, get_flights, fetch_flights
+from download.get_dist_from_files import getdistance, month_distfreq
+from clean.cleandata import fix_schdata, adjust_schtime, month_sketch, stream_clean
+from store.build import Graph
+from store.flightstore import DATA, LAST_MONTH, months, month_rows, parse_month, partition_path, set_last_month
+from store.routeindex import write_clean, write_unclustered
+from store.manifest import Manifest
+from store.runreport import RunReport, measure, set_profile
+
+def month_key(year, month):
+    return '%d_%d' %(year, month)
+
+
+def download_latlong():
+    with measure('download', 'LatLong') as record:
+        get_latlong()  #Get LatLong.csv
+    return [record]
+
+
+def download_month(yearmonth):
+    year, month = yearmonth
+    with measure('ingest', month_key(year, month)) as record:
+        get_flights(year, month)  #Get flight data into the raw partition of the store.
+        record['rows_out'] = month_rows('raw', year, month)
+    return [record]
+
+
+def distance_month(yearmonth):
+    with measure('distfreq', month_key(*yearmonth)) as record:
+        record['rows_out'] = len(month_distfreq(yearmonth))  #Count distances of a month.
+    return [record]
+
+
+def distance(monthlist):
+    with measure('distance') as record:
+        getdistance(monthlist)  #Sum the monthly counts and get distance.csv.
+    return [record]
+
+
+def clean_month(yearmonth, chunksize=None):
+    year, month = yearmonth
+    key = month_key(year, month)
+    if chunksize:
+        return stream_clean_month(year, month, chunksize)
+    #Fix SchDep, SchArr, SchTime so that data is consistent.
+    with measure('fix', key) as fix:
+        newflightdata = fix_schdata(year, month, counts=fix['counts'])
+        fix['rows_in'], fix['rows_out'] = fix['counts'].pop('rows_in'), fix['counts'].pop('rows_out')
+
+    with measure('adjust', key, len(newflightdata)) as adjust:
+        finalflightdata = adjust_schtime(newflightdata)  #Adjust SchTime that are outliers.
+        adjust['rows_out'] = len(finalflightdata)
+
+    with measure('write', key, len(finalflightdata)) as write:
+        write_clean(year, month, finalflightdata)  #Write to the flight store, clustered by route.
+    return [fix, adjust, write]
+
+
+def stream_clean_month(year, month, chunksize):
+    """Clean a month in chunks of about chunksize rows: sketch its route quartiles in one pass, then fix, 
+    adjust and write it in a second pass, never holding the month in memory."""
+    key = month_key(year, month)
+    with measure('sketch', key, month_rows('raw', year, month)) as sketch:
+        quantiles = month_sketch((year, month), chunksize)
+        sketch['rows_out'] = len(quantiles)
+
+    with measure('stream', key) as stream:
+        stream['rows_out'] = write_unclustered(year, month, 
+            stream_clean(year, month, chunksize, quantiles, stream['counts']))[1]
+        stream['rows_in'] = stream['counts'].pop('rows_in')
+        stream['counts'].pop('rows_out')
+    return [sketch, stream]
+
+
+def flight_graph(monthlist, manifest=None, chunksize=None):
+    """Dependency graph of the downloaded months, distance partials, distance.csv and cleaned months.  
+    With chunksize, months are cleaned in chunks of about that many rows by stream_clean_month."""
+    graph = Graph(manifest)
+    graph.add('download', 'LatLong', download_latlong, paths=DATA + '/LatLong.csv')
+    for year, month in monthlist:
+        key = month_key(year, month)
+        graph.add('download', key, download_month, [(year, month)], paths=partition_path('raw', year, month))
+        graph.add('distfreq', key, distance_month, [(year, month)], [('download', key)], 
+            partition_path('distfreq', year, month))
+        graph.add('clean', key, clean_month, [(year, month), chunksize], [('download', key)], 
+            partition_path('clean', year, month))
+    graph.add('distance', 'distance', distance, [monthlist], 
+        [('distfreq', month_key(year, month)) for year, month in monthlist], DATA + '/distance.csv')
+    return graph
+
+
+def update(graph, report, workers=1, fetchers=4):
+    """Build the stale targets of graph, adding measurements to report."""
+    #Download the zip files of months to ingest first, several at a time.
+    todo = [graph.targets[name].args[0] for name in graph.stale() if name[0] == 'download' and name[1] != 'LatLong']
+    if todo:
+        with report.measure('download') as record:
+            fetch_flights(todo, fetchers)
+            record['counts']['files'] = len(todo)
+
+    for target, records in graph.update(workers):
+        report.add(*records)
+        rows = [record['rows_out'] for record in records if record['rows_out'] is not None]
+        print '%s %s: %.1f s%s' %(target.stage, target.key, sum(record['seconds'] for record in records), 
+            ', %d rows' %rows[-1] if rows else '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('-f', '--fetchers', type=int, default=4, help='number of concurrent downloads')
+    parser.add_argument('--last', default=None, help='last month to get, year-month (default: %d-%d)' %LAST_MONTH)
+    parser.add_argument('--stream', type=int, default=None, metavar='CHUNKSIZE', 
+        help='clean months in chunks of about CHUNKSIZE rows, in two streaming passes')
+    parser.add_argument('--manifest', default=None, help='path of the progress manifest')
+    parser.add_argument('--report', default=None, help='path of the json run report')
+    parser.add_argument('--profile', default=None, help='directory for a cProfile dump of each stage')
+    args = parser.parse_args(argv)
 
-def main():
     os.system('mkdir -p data')  #Create data folder to put flight data, if it doesn't exist.
-    get_latlong()  #Get LatLong.csv
-
-    for year in range(1987,2016):
-        if(year == 1987):
-            startmonth=10
-        else:
-            startmonth=1
-        for month in range(startmonth, 13):
-            get_flights(year, month)  #Get flight data as year_month.csv
-
-    getdistance()  #Get distance.csv
-
-    for year in range(1987, 2016):
-        if(year == 1987):
-            startmonth = 10
-        else:
-            startmonth = 1
-        for month in range(startmonth, 13):
-            #Fix SchDep, SchArr, SchTime so that data is consistent.
-            newflightdata = fix_schdata(year, month)
-
-            finalflightdata = adjust_schtime(newflightdata)  #Adjust SchTime that are outliers.
-            finalflightdata.to_csv('../data/%d_%d.csv' %(year, month), index=False)
+    if args.last:
+        set_last_month(parse_month(args.last))
+    manifest = Manifest(args.manifest) if args.manifest else Manifest()
+    report = RunReport('GetCleanDriver', args.report)
+    set_profile(args.profile)
+    try:
+        update(flight_graph(months(), manifest, args.stream), report, args.workers, args.fetchers)
+    finally:
+        print 'Run report:', report.save()
+        report.print_summary()
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""Compute the reports of BigQuery.txt from the cleaned flight data, without uploading it to BigQuery.  
+Months are reduced to partial aggregates across a pool of worker processes, and each report is 
+written to '../data/reports/<report>.csv'."""
+
+import argparse
+import sys
+
+from analysis.reports import REPORTS, build_reports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('reports', nargs='*', help='reports to compute (default: all): ' + ', '.join(REPORTS))
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.reports if name not in REPORTS]
+    if unknown:
+        parser.error('unknown report: ' + ', '.join(unknown))
+
+    for name, report in build_reports(args.reports, workers=args.workers).items():
+        print name
+        print report.to_string(index=False)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
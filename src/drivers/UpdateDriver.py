@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Bring every derived file up to date: downloaded and cleaned months, distance partials, distance.csv, 
+the route table, the coefficient and residual tables, the route anomaly report, the coefficient plots 
+and the JFK/LAX scheduled time plots.  They form one dependency graph keyed by content hash (see 
+store/build.py), so when a new month is published, running with --last set to it downloads and cleans 
+that month, sums the distance partials, fits the new month's coefficients, adds its residuals to the 
+anomaly report and redraws the plots, leaving every other month alone."""
+
+import argparse
+import os
+import sys
+
+from analysis.anomalies import build_anomalies
+from analysis.coefficients import COEFFICIENTS, REGIONS, RESIDUALS, build_coefficients
+from analysis.plot import COEF_PLOTS, plot_regression_coef, plot_schtime
+from analysis.reports import REPORTDIR
+from analysis.routes import ROUTES, get_routes
+from store.flightstore import DATA, LAST_MONTH, months, parse_month, set_last_month
+from store.manifest import Manifest
+from store.runreport import RunReport, measure, set_profile
+from GetCleanDriver import flight_graph, month_key, update
+
+#Flights whose scheduled times are plotted, as in AnalysisDriver: (origin, destination, carrier).
+ROUTE_PLOTS = [(12478, 12892, 'AA'), (12892, 12478, 'AA')]
+
+
+def route_table():
+    with measure('routes') as record:
+        record['rows_out'] = len(get_routes())
+    return [record]
+
+
+def coefficients(workers):
+    with measure('fit', 'coefficients') as record:
+        record['rows_out'] = len(build_coefficients(workers=workers))
+    return [record]
+
+
+def anomalies(workers):
+    with measure('report', 'anomalies') as record:
+        record['rows_out'] = len(build_anomalies(workers=workers)[0])
+    return [record]
+
+
+def plot_coefficients():
+    with measure('plot', 'regression_coef') as record:
+        plot_regression_coef()
+    return [record]
+
+
+def plot_route(origin, destination, carrier):
+    with measure('plot', 'schtime_%s_%d_%d' %(carrier, origin, destination)) as record:
+        plot_schtime(origin, destination, carrier)
+    return [record]
+
+
+def analysis_graph(graph, monthlist, workers=1):
+    """Add the route table, coefficient table, anomaly report and plots to the graph of flight_graph."""
+    cleaned = [('clean', month_key(year, month)) for year, month in monthlist]
+    graph.add('routes', 'routes', route_table, deps=[('download', 'LatLong'), ('distance', 'distance')], 
+        paths=ROUTES)
+    graph.add('coefficients', 'coefficients', coefficients, [workers], cleaned + [('routes', 'routes')], 
+        [COEFFICIENTS, RESIDUALS], pooled=True)
+    graph.add('report', 'anomalies', anomalies, [workers], cleaned + [('coefficients', 'coefficients')], 
+        [REPORTDIR + '/anomalies.csv', REPORTDIR + '/anomalies_worst.csv'], pooled=True)
+    graph.add('plot', 'regression_coef', plot_coefficients, deps=[('coefficients', 'coefficients')], 
+        paths=['../graphs/' + region + name for region in REGIONS for title, unit, name in COEF_PLOTS])
+    for origin, destination, carrier in ROUTE_PLOTS:
+        graph.add('plot', 'schtime_%s_%d_%d' %(carrier, origin, destination), plot_route, 
+            [origin, destination, carrier], cleaned, '../graphs/%s%d_%d.jpg' %(carrier, origin, destination))
+    return graph
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('-f', '--fetchers', type=int, default=4, help='number of concurrent downloads')
+    parser.add_argument('--last', default=None, help='last month of the data, year-month (default: %d-%d)' %LAST_MONTH)
+    parser.add_argument('--stream', type=int, default=None, metavar='CHUNKSIZE', 
+        help='clean months in chunks of about CHUNKSIZE rows, in two streaming passes')
+    parser.add_argument('--manifest', default=None, help='path of the progress manifest')
+    parser.add_argument('--report', default=None, help='path of the json run report')
+    parser.add_argument('--profile', default=None, help='directory for a cProfile dump of each stage')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='list the targets that are out of date or depend on one, and stop')
+    args = parser.parse_args(argv)
+
+    for directory in [DATA, '../graphs']:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    if args.last:
+        set_last_month(parse_month(args.last))
+    monthlist = months()
+    manifest = Manifest(args.manifest) if args.manifest else None
+    graph = analysis_graph(flight_graph(monthlist, manifest, args.stream), monthlist, args.workers)
+
+    if args.dry_run:
+        for stage, key in graph.stale():
+            print stage, key
+        return
+
+    report = RunReport('UpdateDriver', args.report)
+    set_profile(args.profile)
+    try:
+        update(graph, report, args.workers, args.fetchers)
+    finally:
+        print 'Run report:', report.save()
+        report.print_summary()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Dependency graph of the files the pipeline derives: downloaded and cleaned months, distance partials,
+distance.csv, the route table, the coefficient table and plots.  Each target is a (stage, key) entry
+of the manifest, made by a module-level function from the targets it depends on.  A target is built
+again only if its files are missing or changed, or if the content hashes of its dependencies differ
+from those it was built from, so a new month rebuilds that month and the aggregates over all months,
+but no other month.  Targets are built in order of dependency, those of the same depth across a pool
+of worker processes.  Targets whose function runs its own pool are built in this process, after the
+rest of their level, since pool workers cannot start processes."""
+
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from store.manifest import Manifest
+
+
+def _build(job):
+    index, func, args = job
+    return index, func(*args)
+
+
+class Target(object):
+
+    def __init__(self, stage, key, func, args, deps, paths, pooled=False):
+        self.stage = stage
+        self.key = key
+        self.func = func
+        self.args = tuple(args)
+        self.deps = list(deps)
+        self.paths = [paths] if isinstance(paths, basestring) else list(paths)
+        self.pooled = pooled
+
+    @property
+    def name(self):
+        return (self.stage, self.key)
+
+
+class Graph(object):
+
+    def __init__(self, manifest=None):
+        self.manifest = manifest or Manifest()
+        self.targets = OrderedDict()
+        self._depth = {}
+
+    def add(self, stage, key, func, args=(), deps=(), paths=(), pooled=False):
+        """Add target (stage, key), made by func(*args), which writes the file or list of files paths.  deps
+        are the (stage, key) of targets it is made from, or of other entries of the manifest.  pooled 
+        marks a func that runs its own pool of worker processes."""
+        target = Target(stage, key, func, args, deps, paths, pooled)
+        self.targets[target.name] = target
+        return target
+
+    def depth(self, name):
+        """0 for targets without dependencies in the graph, else 1 + the largest depth of a dependency."""
+        if name not in self._depth:
+            deps = [dep for dep in self.targets[name].deps if dep in self.targets]
+            self._depth[name] = 1 + max([self.depth(dep) for dep in deps]) if deps else 0
+        return self._depth[name]
+
+    def source(self, name):
+        """Hash of the dependencies of a target as they are now, or False if one of them is missing.
+        A single dependency's hash is used as it is, as GetCleanDriver recorded it before the graph."""
+        hashes = [self.manifest.hash(*dep) for dep in self.targets[name].deps]
+        if None in hashes:
+            return False
+        if not hashes:
+            return None
+        return hashes[0] if len(hashes) == 1 else Manifest.combine(hashes)
+
+    def stale(self, names=None):
+        """Targets of names (default: all) that would be built now: those out of date, and those depending
+        on a stale target of the graph, which is built first.  Targets with a missing dependency that is
+        not in the graph are left out."""
+        stale = set()
+        for name in sorted(self.targets, key=self.depth):
+            if any(dep in stale for dep in self.targets[name].deps):
+                stale.add(name)
+                continue
+            source = self.source(name)
+            if source is not False and not self.manifest.done(name[0], name[1], source):
+                stale.add(name)
+        names = self.targets if names is None else names
+        return [name for name in names if name in stale]
+
+    def update(self, workers=1):
+        """Build stale targets, in order of depth, and generate (target, result of its function) for
+        each, once its files are recorded in the manifest.  Targets whose dependencies are missing are
+        skipped, and pooled targets are built in this process after the others of their level."""
+        levels = {}
+        for name in self.targets:
+            levels.setdefault(self.depth(name), []).append(name)
+
+        for depth in sorted(levels):
+            todo = []
+            for name in levels[depth]:
+                source = self.source(name)
+                if source is not False and not self.manifest.done(name[0], name[1], source):
+                    todo.append((self.targets[name], source))
+            jobs = [(i, target.func, target.args) for i, (target, source) in enumerate(todo)]
+            pooled = [job for job in jobs if todo[job[0]][0].pooled]
+            jobs = [job for job in jobs if not todo[job[0]][0].pooled]
+
+            if workers > 1 and len(jobs) > 1:
+                pool = Pool(workers)
+                try:
+                    for i, result in pool.imap_unordered(_build, jobs):
+                        yield self._record(todo[i]), result
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for job in jobs:
+                    i, result = _build(job)
+                    yield self._record(todo[i]), result
+            for job in pooled:
+                i, result = _build(job)
+                yield self._record(todo[i]), result
+
+    def _record(self, built):
+        target, source = built
+        if len(target.paths) == 1:
+            self.manifest.record(target.stage, target.key, target.paths[0], source)
+        else:
+            self.manifest.record_files(target.stage, target.key, target.paths, source)
+        return target
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+"""Columnar store for flight data.  Each month is written once as a compressed parquet file, 
+partitioned by dataset, year and month, with fixed column types.  Readers select columns and rows 
+through load_month and scan instead of parsing '../data/year_month.csv' in full.  Row filters are 
+pushed down to parquet row groups using their min/max statistics, then applied exactly.
+With compact=True, months are loaded in a compact in-memory form (compact_frame): Carrier as a 
+categorical whose codes come from a dictionary shared by every month and process 
+('../data/store/dictionary.json'), and Date as int16 days since 1970-01-01, instead of a Python string 
+per flight."""
+
+import fcntl
+import json
+import operator
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from store.times import date_days, day_dates
+
+DATA = '../data'
+STORE = DATA + '/store'
+
+#First and last months of BTS flight data.  Set BTS_LAST_MONTH (e.g. '2016-1') or call set_last_month 
+#when a new month is published; BTS_FIRST_MONTH restricts the data to later months.
+FIRST_MONTH = tuple(int(x) for x in os.environ.get('BTS_FIRST_MONTH', '1987-10').split('-'))
+LAST_MONTH = tuple(int(x) for x in os.environ.get('BTS_LAST_MONTH', '2015-12').split('-'))
+
+ROW_GROUP_SIZE = 1 << 16
+#Clean months are clustered by route (see routeindex), so smaller row groups let a route be read alone.
+ROW_GROUP_SIZES = {'clean':1 << 13}
+COMPRESSION = 'snappy'
+
+#Fixed column types.  'raw' is the 14 column download, 'clean' the output of cleandata, 'distfreq' 
+#the per-month distance counts of get_dist_from_files, 'routeindex' the row ranges of routeindex, and 
+#'routeresiduals' and 'worstflights' the per-month route aggregates and worst flights of anomalies.
+DTYPES = {
+    'raw': {
+        'Day':np.int8, 
+        'Date':object, 
+        'Carrier':object, 
+        'OriginAirportId':np.int32, 
+        'DestAirportId':np.int32, 
+        'SchDep':np.float32, 
+        'DepTime':np.float32, 
+        'DepDelay':np.float32, 
+        'SchArr':np.float32, 
+        'ArrTime':np.float32, 
+        'ArrDelay':np.float32, 
+        'SchTime':np.float32, 
+        'ActualTime':np.float32, 
+        'Distance':np.float32}, 
+    'clean': {
+        'Carrier':object, 
+        'Day':np.int8, 
+        'Date':object, 
+        'OriginAirportId':np.int32, 
+        'DestAirportId':np.int32, 
+        'SchDep':np.int16, 
+        'SchArr':np.int16, 
+        'SchTime':np.int16}, 
+    'distfreq': {
+        'OriginAirportId':np.int32, 
+        'DestAirportId':np.int32, 
+        'Distance':np.float32, 
+        'Freq':np.int64}, 
+    'routeindex': {
+        'Origin':np.int32, 
+        'Dest':np.int32, 
+        'Carrier':object, 
+        'Start':np.int64, 
+        'Stop':np.int64}, 
+    'routeresiduals': {
+        'OriginAirportId':np.int32, 
+        'DestAirportId':np.int32, 
+        'Flights':np.int64, 
+        'Mean':np.float64, 
+        'M2':np.float64, 
+        'Min':np.float64, 
+        'Max':np.float64}, 
+    'worstflights': {
+        'OriginAirportId':np.int32, 
+        'DestAirportId':np.int32, 
+        'Year':np.int16, 
+        'Month':np.int8, 
+        'Date':object, 
+        'Carrier':object, 
+        'SchTime':np.int16, 
+        'Residual':np.float64}}
+
+#Shared dictionaries of the categorical columns of compact months.
+DICTIONARY = STORE + '/dictionary.json'
+_dictionaries = {}
+
+#Row filter operators.  A filter is a list of (column, op, value) tuples which must all hold.
+OPS = {'==':operator.eq, '!=':operator.ne, '<':operator.lt, '<=':operator.le, 
+    '>':operator.gt, '>=':operator.ge}
+
+
+def parse_month(text):
+    """'year-month' to (year, month)."""
+    year, month = [int(x) for x in text.split('-')]
+    return year, month
+
+
+def set_last_month(last):
+    """Make (year, month) the last month of the data set, and the default end of months()."""
+    global LAST_MONTH
+    LAST_MONTH = tuple(last)
+
+
+def months(first=None, last=None):
+    """List of (year, month) from first to last inclusive, by default FIRST_MONTH to LAST_MONTH."""
+    first = first or FIRST_MONTH
+    last = last or LAST_MONTH
+    return [(year, month) for year in range(first[0], last[0] + 1) for month in range(1, 13) 
+        if first <= (year, month) <= last]
+
+
+def csv_path(year, month):
+    return DATA + '/%d_%d.csv' %(year, month)
+
+
+def partition_path(kind, year, month):
+    return STORE + '/%s/year=%d/month=%d/part.parquet' %(kind, year, month)
+
+
+def has_month(kind, year, month):
+    return os.path.exists(partition_path(kind, year, month))
+
+
+def month_rows(kind, year, month):
+    """Number of rows of a stored month, read from the parquet footer."""
+    return pq.ParquetFile(partition_path(kind, year, month)).metadata.num_rows
+
+
+def is_current(kind, year, month, source):
+    """Whether a partition exists and is newer than the dataset it was derived from."""
+    path = partition_path(kind, year, month)
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(month_path(source, year, month))
+
+
+def month_signature(kind, year, month):
+    """Cheap signature of the file a month is read from (path, size and modification time), which 
+    changes whenever the month is rewritten."""
+    path = month_path(kind, year, month)
+    stat = os.stat(path)
+    return '%s %d %r' %(path, stat.st_size, stat.st_mtime)
+
+
+def month_path(kind, year, month):
+    """File a month is read from: its partition, or '../data/year_month.csv' if not in the store."""
+    path = partition_path(kind, year, month)
+    return path if os.path.exists(path) else csv_path(year, month)
+
+
+def shared_dictionary(name, values=()):
+    """Shared list of the values of column name, e.g. of every carrier, with any of values not in it 
+    appended.  The list only grows, so the code (position) of a value never changes, and it is kept in 
+    DICTIONARY, updated under a file lock, so that every process and month uses the same codes."""
+    known = _dictionaries.get(name)
+    if known is not None and set(values) <= set(known):
+        return known
+    if not os.path.isdir(STORE):
+        os.makedirs(STORE)
+    with open(DICTIONARY + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dictionaries = {}
+        if os.path.exists(DICTIONARY):
+            with open(DICTIONARY) as f:
+                dictionaries = json.load(f)
+        known = dictionaries.get(name, [])
+        new = sorted(set(values) - set(known))
+        if new:
+            dictionaries[name] = known = known + new
+            with open(DICTIONARY + '.tmp', 'w') as f:
+                json.dump(dictionaries, f)
+            os.rename(DICTIONARY + '.tmp', DICTIONARY)
+        for key, value in dictionaries.items():
+            _dictionaries[key] = value
+    _dictionaries[name] = known
+    return known
+
+
+def encode(name, values):
+    """Categorical of values with the shared dictionary of column name as categories.  Each distinct 
+    value is looked up once."""
+    codes, uniques = pd.factorize(values)
+    categories = shared_dictionary(name, [value for value in uniques])
+    lookup = pd.Index(categories).get_indexer(uniques)
+    return pd.Categorical.from_codes(np.append(lookup, -1)[codes], categories)
+
+
+def compact_frame(df):
+    """Give Carrier and Date their compact in-memory types, in place, and return df."""
+    if 'Carrier' in df.columns and not pd.api.types.is_categorical_dtype(df.Carrier):
+        df['Carrier'] = encode('Carrier', df.Carrier.values)
+    if 'Date' in df.columns and df.Date.dtype == object:
+        df['Date'] = date_days(df.Date.values)
+    return df
+
+
+def expand_frame(df):
+    """A copy of df with compact Carrier and Date back to strings, as in DTYPES, or df itself if neither is."""
+    carrier = 'Carrier' in df.columns and pd.api.types.is_categorical_dtype(df.Carrier)
+    date = 'Date' in df.columns and pd.api.types.is_integer_dtype(df.Date)
+    if not (carrier or date):
+        return df
+    df = df.copy()
+    if carrier:
+        df['Carrier'] = np.asarray(df.Carrier.values, dtype=object)
+    if date:
+        df['Date'] = day_dates(df.Date.values)
+    return df
+
+
+def cast(df, kind):
+    """Restrict a dataframe to the columns of the dataset and give them fixed types.  Rows without 
+    airport ids are dropped, since they cannot be matched to distance or coordinates."""
+    df = expand_frame(df)
+    dtypes = DTYPES[kind]
+    df = df[[col for col in df.columns if col in dtypes]]
+    ids = [col for col in ['OriginAirportId', 'DestAirportId'] if col in df.columns]
+    df = df.dropna(subset=ids)
+    return df.astype(dict((col, dtypes[col]) for col in df.columns))
+
+
+def arrow_schema(kind, columns):
+    """Arrow schema of the given columns of a dataset."""
+    fields = [pa.field(col, pa.string() if DTYPES[kind][col] is object 
+        else pa.from_numpy_dtype(DTYPES[kind][col])) for col in columns]
+    return pa.schema(fields)
+
+
+class MonthWriter(object):
+    """Write a month to the store one chunk at a time, so the whole month never has to be in memory.
+    The partition is written to a temporary file and only moved into place by close(); used as a 
+    context manager, an exception discards the temporary file and leaves any existing month intact."""
+
+    def __init__(self, kind, year, month):
+        self.kind = kind
+        self.path = partition_path(kind, year, month)
+        self.writer = None
+        self.rows = 0
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+    def write(self, df):
+        df = cast(df, self.kind)
+        if self.writer is None:
+            self.schema = arrow_schema(self.kind, df.columns)
+            self.writer = pq.ParquetWriter(self.path + '.tmp', self.schema, compression=COMPRESSION)
+        #Without pandas metadata, which only slows reading and is not needed for a fixed schema.
+        table = pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+        table = table.replace_schema_metadata(None)
+        self.writer.write_table(table, row_group_size=ROW_GROUP_SIZES.get(self.kind, ROW_GROUP_SIZE))
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is None:
+            self.write(pd.DataFrame(dict((col, pd.Series([], dtype=dtype)) 
+                for col, dtype in DTYPES[self.kind].items())))
+        self.writer.close()
+        os.rename(self.path + '.tmp', self.path)
+        return self.path
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.remove(self.path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, value, traceback):
+        if exctype is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_month(kind, year, month, df):
+    """Write a month to the store, replacing any existing partition.  Returns the partition path."""
+    with MonthWriter(kind, year, month) as writer:
+        writer.write(df)
+    return writer.path
+
+
+def import_csv(kind, year, month):
+    """Copy an existing '../data/year_month.csv' into the store."""
+    return write_month(kind, year, month, pd.read_csv(csv_path(year, month), dtype={'Carrier':str}))
+
+
+def _may_match(stats, op, value):
+    """Whether a row group with the given column statistics may contain matching rows."""
+    if stats is None or not stats.has_min_max:
+        return True
+    lo, hi = stats.min, stats.max
+    if op == 'in':
+        return any(lo <= v <= hi for v in value)
+    return {'==': lo <= value <= hi, 
+        '!=': not (lo == hi == value), 
+        '<': lo < value, 
+        '<=': lo <= value, 
+        '>': hi > value, 
+        '>=': hi >= value}[op]
+
+
+def _row_groups(parquetfile, filters):
+    """Indices of row groups whose statistics do not rule out the filters."""
+    metadata = parquetfile.metadata
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    groups = []
+    for i in range(metadata.num_row_groups):
+        rowgroup = metadata.row_group(i)
+        if all(_may_match(rowgroup.column(names.index(col)).statistics, op, value) 
+                for col, op, value in filters):
+            groups.append(i)
+    return groups
+
+
+def apply_filters(df, filters):
+    """Keep the rows of df satisfying every (column, op, value) filter."""
+    if not filters:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for col, op, value in filters:
+        if op == 'in':
+            mask &= df[col].isin(value).values
+        else:
+            mask &= OPS[op](df[col], value).values
+    return df[mask]
+
+
+def read_parquet(path, columns=None, filters=None):
+    """Read the given columns of the rows of a parquet file satisfying filters, skipping row groups 
+    whose statistics rule the filters out."""
+    filters = filters or []
+    readcols = None
+    if columns is not None:
+        readcols = list(columns) + [col for col, op, value in filters if col not in columns]
+
+    parquetfile = pq.ParquetFile(path)
+    groups = _row_groups(parquetfile, filters)
+    if len(groups) == 0:
+        schema = parquetfile.schema.to_arrow_schema()
+        names = readcols or [name for name in schema.names if not name.startswith('__')]
+        df = pa.schema([schema.field(name) for name in names]).empty_table().to_pandas()
+    else:
+        df = parquetfile.read_row_groups(groups, columns=readcols).to_pandas()
+
+    df = apply_filters(df, filters)
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
+
+
+def load_month(year, month, columns=None, filters=None, kind='clean', compact=False):
+    """Load a month of flight data, restricted to the given columns and to rows satisfying filters, in 
+    compact form if compact.  Falls back to '../data/year_month.csv' for months that have not been 
+    written to the store."""
+    path = partition_path(kind, year, month)
+    if os.path.exists(path):
+        df = read_parquet(path, columns, filters)
+        return compact_frame(df) if compact else df
+
+    filters = filters or []
+    readcols = None
+    if columns is not None:
+        readcols = list(columns) + [col for col, op, value in filters if col not in columns]
+    df = cast(pd.read_csv(csv_path(year, month), usecols=readcols, dtype={'Carrier':str}), kind)
+    df = apply_filters(df, filters)
+    if columns is not None:
+        df = df[list(columns)]
+    df = df.reset_index(drop=True)
+    return compact_frame(df) if compact else df
+
+
+def load_rows(year, month, start, stop, columns=None, kind='clean', compact=False):
+    """Rows start to stop (exclusive) of a month in the store, reading only the row groups holding them."""
+    parquetfile = pq.ParquetFile(partition_path(kind, year, month))
+    metadata = parquetfile.metadata
+    groups, offset, first = [], 0, None
+    for i in range(metadata.num_row_groups):
+        rows = metadata.row_group(i).num_rows
+        if offset < stop and offset + rows > start:
+            groups.append(i)
+            first = offset if first is None else first
+        offset += rows
+    if not groups:
+        df = arrow_schema(kind, columns or DTYPES[kind].keys()).empty_table().to_pandas()
+    else:
+        df = parquetfile.read_row_groups(groups, columns=columns).to_pandas()
+        df = df.iloc[start - first:stop - first].reset_index(drop=True)
+    return compact_frame(df) if compact else df
+
+
+def iter_month(year, month, columns=None, kind='clean', chunksize=4*ROW_GROUP_SIZE, compact=False):
+    """Generate a month of flight data in chunks of about chunksize rows (whole row groups), so that 
+    it can be processed without holding the month in memory."""
+    for chunk in _iter_month(year, month, columns, kind, chunksize):
+        yield compact_frame(chunk) if compact else chunk
+
+
+def _iter_month(year, month, columns, kind, chunksize):
+    path = partition_path(kind, year, month)
+    if os.path.exists(path):
+        parquetfile = pq.ParquetFile(path)
+        groups, rows = [], 0
+        for i in range(parquetfile.metadata.num_row_groups):
+            groups.append(i)
+            rows += parquetfile.metadata.row_group(i).num_rows
+            if rows >= chunksize or i == parquetfile.metadata.num_row_groups - 1:
+                yield parquetfile.read_row_groups(groups, columns=columns).to_pandas()
+                groups, rows = [], 0
+    else:
+        for chunk in pd.read_csv(csv_path(year, month), usecols=columns, dtype={'Carrier':str}, 
+                chunksize=chunksize):
+            yield cast(chunk, kind)
+
+
+def scan(monthlist=None, columns=None, filters=None, kind='clean', compact=False):
+    """Generate (year, month, dataframe) for each month in monthlist (default: all months)."""
+    for year, month in (monthlist or months()):
+        yield year, month, load_month(year, month, columns, filters, kind, compact)
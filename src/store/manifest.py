@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""On-disk record of which months have been downloaded and cleaned.  Each entry stores the path, 
+size, modification time and sha1 of the file a stage produced, along with the hash of its input, so 
+an interrupted run can resume and a month is only redone when its files change."""
+
+import hashlib
+import json
+import os
+
+from store.flightstore import DATA
+
+MANIFEST = DATA + '/manifest.json'
+
+
+def file_hash(path, blocksize=1 << 20):
+    """sha1 of a file's contents."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Manifest(object):
+    """Entries are keyed by stage (e.g. 'download', 'clean') and 'year_month'."""
+
+    def __init__(self, path=MANIFEST):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        #Write to a temporary file and rename, so the manifest is never left half written.
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+
+    def get(self, stage, key):
+        return self.entries.get(stage, {}).get(key)
+
+    def hash(self, stage, key):
+        """Hash of the recorded file if it is unchanged on disk, otherwise None.  For an entry of several 
+        files, a hash of all of them if none has changed."""
+        entry = self.get(stage, key)
+        if entry is None:
+            return None
+        if 'files' in entry:
+            hashes = [self._file_hash(fileentry) for fileentry in entry['files']]
+            return None if None in hashes else self.combine(hashes)
+        return self._file_hash(entry)
+
+    def _file_hash(self, entry):
+        if not os.path.exists(entry['path']):
+            return None
+
+        #Trust the recorded hash when size and mtime match; otherwise hash the file again.
+        stat = os.stat(entry['path'])
+        if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+            return entry['sha1']
+        sha1 = file_hash(entry['path'])
+        if sha1 != entry['sha1']:
+            return None
+        entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime
+        return sha1
+
+    @staticmethod
+    def combine(hashes):
+        """Single hash standing for a list of hashes, e.g. the inputs of an aggregate."""
+        return hashlib.sha1(' '.join(str(h) for h in hashes).encode('ascii')).hexdigest()
+
+    def done(self, stage, key, source=None):
+        """Whether stage has produced an unchanged file for key, from an input with hash source."""
+        entry = self.get(stage, key)
+        return self.hash(stage, key) is not None and (source is None or entry.get('source') == source)
+
+    @staticmethod
+    def file_entry(path):
+        stat = os.stat(path)
+        return {'path':path, 'size':stat.st_size, 'mtime':stat.st_mtime, 'sha1':file_hash(path)}
+
+    def record(self, stage, key, path, source=None):
+        entry = self.file_entry(path)
+        entry['source'] = source
+        self.entries.setdefault(stage, {})[key] = entry
+        self.save()
+
+    def record_files(self, stage, key, paths, source=None):
+        """Record several files produced together, e.g. the plots of one function."""
+        self.entries.setdefault(stage, {})[key] = {
+            'files':[self.file_entry(path) for path in paths], 
+            'source':source}
+        self.save()
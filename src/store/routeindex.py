@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Secondary index of the clean flight data by route and carrier.  Cleaned months are written sorted 
+by (origin airport, destination airport, carrier), using 5-digit AirportIds, so the flights of each 
+route and carrier are one contiguous range of rows.  The range of each route and carrier in each month 
+is saved in the 'routeindex' partition, and the monthly ranges are merged into one table, so the 
+history of a single route reads only the row groups holding it."""
+
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from store.flightstore import STORE, ROW_GROUP_SIZES, MonthWriter, months, partition_path, write_month, load_month, load_rows, read_parquet
+
+ROUTEINDEX = STORE + '/routeindex.parquet'
+
+
+def cluster(df):
+    """Sort flights by 5-digit origin, destination and carrier.  Returns the sorted flights and the 
+    index of their row ranges, with columns Origin, Dest, Carrier, Start, Stop."""
+    origin = df.OriginAirportId.values//100
+    dest = df.DestAirportId.values//100
+    carrier, carriers = pd.factorize(np.asarray(df.Carrier.values, dtype=object), sort=True)
+    order = np.lexsort((carrier, dest, origin))
+    df = df.iloc[order].reset_index(drop=True)
+    origin, dest, carrier = origin[order], dest[order], carrier[order]
+
+    #A range starts wherever the route or carrier changes.
+    change = np.ones(len(df), dtype=bool)
+    change[1:] = (origin[1:] != origin[:-1]) | (dest[1:] != dest[:-1]) | (carrier[1:] != carrier[:-1])
+    start = np.flatnonzero(change)
+    stop = np.append(start[1:], len(df))
+    index = pd.DataFrame({
+        'Origin':origin[start], 
+        'Dest':dest[start], 
+        'Carrier':np.asarray(carriers, dtype=object)[carrier[start]] if len(start) else [], 
+        'Start':start, 
+        'Stop':stop}, columns=['Origin', 'Dest', 'Carrier', 'Start', 'Stop'])
+    return df, index
+
+
+def write_clean(year, month, df):
+    """Write a cleaned month to the store, clustered by route and carrier, along with its index.  
+    Returns the path of the clean partition."""
+    df, index = cluster(df)
+    path = write_month('clean', year, month, df)
+    write_month('routeindex', year, month, index)
+    return path
+
+
+def write_unclustered(year, month, chunks):
+    """Write a cleaned month to the store from an iterable of chunks, in their order, without an index, 
+    for months too large to sort by route in memory.  scan_route filters such months in full.  Returns 
+    the path of the clean partition and the number of rows."""
+    with MonthWriter('clean', year, month) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    index = partition_path('routeindex', year, month)
+    if os.path.exists(index):
+        os.remove(index)
+    return writer.path, writer.rows
+
+
+def get_index():
+    """Path of the merged index: row ranges of every route and carrier in every indexed month, sorted 
+    by Origin, Dest and Carrier, with Year and Month columns.  It is rebuilt when a month's index is 
+    newer than it.  Also returns the list of indexed (year, month)."""
+    paths = glob.glob(STORE + '/routeindex/year=*/month=*/part.parquet')
+    newest = max([os.path.getmtime(path) for path in paths] or [0])
+    if os.path.exists(ROUTEINDEX) and os.path.exists(ROUTEINDEX + '.json'):
+        with open(ROUTEINDEX + '.json') as f:
+            saved = json.load(f)
+        if len(saved['months']) == len(paths) and newest <= os.path.getmtime(ROUTEINDEX):
+            return ROUTEINDEX, [tuple(yearmonth) for yearmonth in saved['months']]
+
+    indexes, indexed = [], []
+    for path in paths:
+        year, month = [int(part.split('=')[1]) for part in path.split(os.sep)[-3:-1]]
+        index = pd.read_parquet(path)
+        index['Year'], index['Month'] = year, month
+        indexes.append(index)
+        indexed.append((year, month))
+    if indexes:
+        index = pd.concat(indexes, ignore_index=True).sort_values(['Origin', 'Dest', 'Carrier', 'Year', 'Month'])
+    else:
+        index = pd.DataFrame(dict((col, pd.Series([], dtype=dtype)) for col, dtype in 
+            [('Origin', np.int32), ('Dest', np.int32), ('Carrier', object), ('Start', np.int64), 
+            ('Stop', np.int64), ('Year', np.int64), ('Month', np.int64)]))
+
+    #Small row groups, so that a lookup reads only the groups holding one route.
+    pq.write_table(pa.Table.from_pandas(index, preserve_index=False), ROUTEINDEX + '.tmp', 
+        row_group_size=ROW_GROUP_SIZES['clean'])
+    os.rename(ROUTEINDEX + '.tmp', ROUTEINDEX)
+    with open(ROUTEINDEX + '.json', 'w') as f:
+        json.dump({'months':sorted(indexed)}, f)
+    return ROUTEINDEX, indexed
+
+
+def scan_route(origin, destination, carrier, columns=None, monthlist=None):
+    """Generate (year, month, dataframe) with the flights from origin to destination (5-digit AirportIds) 
+    by carrier.  Indexed months read only the matching rows; others are filtered in full."""
+    path, indexed = get_index()
+    ranges = read_parquet(path, ['Year', 'Month', 'Start', 'Stop'], 
+        [('Origin', '==', origin), ('Dest', '==', destination), ('Carrier', '==', carrier)])
+    ranges = dict(((year, month), (start, stop)) 
+        for year, month, start, stop in zip(ranges.Year, ranges.Month, ranges.Start, ranges.Stop))
+    indexed = set(indexed)
+
+    isflight = [('OriginAirportId', '>=', 100*origin), ('OriginAirportId', '<', 100*(origin + 1)), 
+        ('DestAirportId', '>=', 100*destination), ('DestAirportId', '<', 100*(destination + 1)), 
+        ('Carrier', '==', carrier)]
+    for year, month in (monthlist or months()):
+        if (year, month) in ranges:
+            start, stop = ranges[year, month]
+            yield year, month, load_rows(year, month, start, stop, columns)
+        elif (year, month) not in indexed:
+            yield year, month, load_month(year, month, columns, isflight)
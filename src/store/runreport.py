@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Instrumentation of pipeline stages.  measure(stage, key) wraps one unit of work (a month's
+download, fix, adjust, ...) and records its wall time, rows in and out, peak memory and any counts
+the stage adds, such as the rows dropped by each fix_schdata rule.  Records are plain dicts, so worker
+processes return them to the driver, which collects them in a RunReport and saves it as json in
+'../data/runs'.  With a profile directory set, each stage is also run under cProfile."""
+
+import cProfile
+import datetime
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+from store.flightstore import DATA
+
+RUNS = DATA + '/runs'
+
+_profile = {'dir':None}
+
+
+def set_profile(directory):
+    """Dump a cProfile of every measured stage to directory (None to stop).  Set before worker
+    processes are started, so they inherit it."""
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _profile['dir'] = directory
+
+
+def reset_peak():
+    """Reset the peak resident memory of this process, where Linux allows it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peak_rss():
+    """Peak resident memory in MB since the last reset_peak (or since the process started)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])/1024.
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def add_counts(counts, new):
+    """Add the dict of counts new into counts, and return counts."""
+    for name, count in new.items():
+        counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+@contextmanager
+def measure(stage, key=None, rows_in=None):
+    """Measure the enclosed work as a record of stage (e.g. 'fix') for key (e.g. '2015_1').  The record
+    is yielded, for the work to set 'rows_in', 'rows_out' or add other counts to record['counts']."""
+    record = {'stage':stage, 'key':key, 'rows_in':rows_in, 'rows_out':None, 'counts':{},
+        'start':datetime.datetime.now().isoformat()}
+    profiler = cProfile.Profile() if _profile['dir'] else None
+    reset_peak()
+    start = time.time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(_profile['dir'], '%s_%s.prof' %(stage, key)))
+        record['seconds'] = time.time() - start
+        record['peak_rss_mb'] = peak_rss()
+        rows = record['rows_in'] if record['rows_in'] is not None else record['rows_out']
+        record['rows_per_sec'] = rows/record['seconds'] if rows is not None and record['seconds'] > 0 else None
+
+
+class RunReport(object):
+    """Records of the stages of one run, from this process and worker processes."""
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.started = datetime.datetime.now()
+        self.path = path or RUNS + '/%s_%s.json' %(name, self.started.strftime('%Y%m%d_%H%M%S'))
+        self.records = []
+
+    @contextmanager
+    def measure(self, stage, key=None, rows_in=None):
+        with measure(stage, key, rows_in) as record:
+            yield record
+        self.add(record)
+
+    def add(self, *records):
+        self.records.extend(records)
+
+    def summary(self):
+        """Totals for each stage: number of records, seconds, rows in and out, rows/sec, the largest
+        peak memory, counts summed, and the key of the slowest record."""
+        stages = {}
+        for record in self.records:
+            total = stages.setdefault(record['stage'], {'records':0, 'seconds':0., 'rows_in':0,
+                'rows_out':0, 'peak_rss_mb':0., 'counts':{}, 'slowest':None, 'slowest_seconds':0.})
+            total['records'] += 1
+            total['seconds'] += record['seconds']
+            total['rows_in'] += record['rows_in'] or 0
+            total['rows_out'] += record['rows_out'] or 0
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+            add_counts(total['counts'], record['counts'])
+            if record['seconds'] >= total['slowest_seconds']:
+                total['slowest'], total['slowest_seconds'] = record['key'], record['seconds']
+        for total in stages.values():
+            rows = total['rows_in'] or total['rows_out']
+            total['rows_per_sec'] = rows/total['seconds'] if rows and total['seconds'] > 0 else None
+        return stages
+
+    def save(self):
+        """Write the report as json, through a temporary file.  Returns its path."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        report = {'name':self.name, 'started':self.started.isoformat(),
+            'seconds':(datetime.datetime.now() - self.started).total_seconds(),
+            'summary':self.summary(), 'records':self.records}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+        return self.path
+
+    def print_summary(self):
+        for stage, total in sorted(self.summary().items(), key=lambda item: -item[1]['seconds']):
+            print '%-10s %5d x %9.1f s %12d rows in %12d rows out %10.0f rows/sec %7.0f MB peak, slowest %s' %(
+                stage, total['records'], total['seconds'], total['rows_in'], total['rows_out'],
+                total['rows_per_sec'] or 0, total['peak_rss_mb'], total['slowest'])
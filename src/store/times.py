@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Times of day and dates, converted the same way by cleaning, reports and plots.  Times of day are hhmm
+numbers as in the BTS data (1345 for 1:45 pm) or minutes after midnight.  Whole-number times, such as
+the int16 columns of clean months, are converted by lookup in tables of every hhmm from 0 to 2400 and
+every minute of a day; float times are converted arithmetically, so NaN (missing) stays NaN.  Dates are
+'year-mon-day' strings or int16 days since 1970-01-01; each distinct string is parsed once and the result
+broadcast to its rows."""
+
+import numpy as np
+import pandas as pd
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+#Lookup tables, indexed by hhmm (0 to 2400) or by minute of the day (0 to 1439).
+_HHMM = np.arange(2401)
+MINUTES = (60*(_HHMM//100) + _HHMM%100).astype(np.int16)
+HOURS = (np.floor(_HHMM//100 + (_HHMM%100)/60. + 0.5) % 24).astype(np.int64)
+_MINUTE = np.arange(1440)
+HHMM = (100*(_MINUTE//60) + _MINUTE%60).astype(np.int16)
+
+
+def _is_int(x):
+    return x.dtype.kind in 'iu'
+
+
+def floatmod(x, n):
+    """x modulo n for float arrays of whole numbers; the sign follows n, as with %, but cheaper than np.mod."""
+    return x - n*np.floor(x/n)
+
+
+def timetomin(t):
+    """hhmm to minutes after midnight.  Integers from 0 to 2400 give int16 minutes; floats give floats,
+    with NaN for NaN."""
+    t = np.asarray(t)
+    if _is_int(t):
+        return MINUTES.take(t)
+    return t - 40*np.floor(t/100)
+
+
+def mintotime(minutes):
+    """Minutes after midnight (any number of minutes, taken modulo a day) to hhmm.  Integers give int16
+    hhmm; floats give floats, with NaN for NaN."""
+    minutes = np.asarray(minutes)
+    if _is_int(minutes):
+        return HHMM.take(minutes % 1440)
+    minutes = floatmod(minutes, 1440)
+    return minutes + 40*np.floor(minutes/60)
+
+
+def nearest_hour(hhmm):
+    """Nearest hour (0 to 23) of hhmm times, as INTEGER(ROUND(FLOOR(t/100) + (t%100)/60))%24 in BigQuery."""
+    hhmm = np.asarray(hhmm)
+    if _is_int(hhmm):
+        return HOURS.take(hhmm)
+    return (np.floor(np.floor(hhmm/100) + (hhmm % 100)/60. + 0.5) % 24).astype(np.int64)
+
+
+def date_days(dates):
+    """'year-mon-day' strings to int16 days since 1970-01-01."""
+    codes, uniques = pd.factorize(np.asarray(dates))
+    days = (np.array(uniques, dtype='datetime64[D]') - EPOCH).astype(np.int16)
+    return days[codes]
+
+
+def day_dates(days):
+    """int16 days since 1970-01-01 to 'year-mon-day' strings."""
+    codes, uniques = pd.factorize(np.asarray(days))
+    dates = np.array(EPOCH + uniques.astype(np.int64), dtype='datetime64[D]').astype(str).astype(object)
+    return dates[codes]
+
+
+def day_of_month(dates):
+    """Day of the month of 'year-mon-day' strings or of days since 1970-01-01."""
+    codes, uniques = pd.factorize(np.asarray(dates))
+    if _is_int(uniques):
+        days = EPOCH + uniques.astype(np.int64)
+        return ((days - days.astype('datetime64[M]')).astype(np.int64) + 1)[codes]
+    return np.array([int(date[8:10]) for date in uniques], dtype=np.int64)[codes]
+
+
+def month_days(yearmonths):
+    """Days since 1970-01-01 of the first day of each (year, month)."""
+    firsts = np.array(['%d-%02d' %(year, month) for year, month in yearmonths], dtype='datetime64[M]')
+    return (firsts.astype('datetime64[D]') - EPOCH).astype(np.int64)